@@ -0,0 +1,202 @@
+import asyncio
+import logging
+
+from FrameScheduler import FrameScheduler
+from Rtsp import LEGACY_WAIT, RtspError, RtspParser
+from ServerWorker import RECV_SIZE, ServerWorker, bindPortPair
+from SessionRegistry import sessionRegistry
+from UdpBatch import UdpBatchSender
+
+log = logging.getLogger(__name__)
+
+
+class RtpProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint shared by every session served from the event loop."""
+
+    def __init__(self):
+        self.transport = None
+        self.sock = None
+        self.sender = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def sendPacket(self, rtpPacket, address):
+        """Send one RTP packet, scatter-gather when the socket has room."""
+        if not self.transport.get_write_buffer_size():
+            try:
+                self.sock.sendmsg(rtpPacket.getBuffers(), [], 0, address)
+                return
+            except (BlockingIOError, InterruptedError):
+                pass
+        # Socket buffer full: let the transport queue a flattened copy
+        self.transport.sendto(rtpPacket.getPacket(), address)
+
+    def sendPackets(self, packets, address):
+        """Send a frame's packets in one batch, queueing whatever the socket refuses."""
+        sent = 0
+        if not self.transport.get_write_buffer_size():
+            try:
+                self.sender.send([rtpPacket.getBuffers() for rtpPacket in packets], address)
+                return
+            except BlockingIOError as exc:
+                sent = exc.characters_written
+        for rtpPacket in packets[sent:]:
+            self.transport.sendto(rtpPacket.getPacket(), address)
+
+    def error_received(self, exc):
+        pass  # ICMP port unreachable from a client that went away
+
+
+class RtcpProtocol(asyncio.DatagramProtocol):
+    """Shared RTCP endpoint that routes reports to sessions by client address."""
+
+    def __init__(self):
+        self.transport = None
+        self.workers = {}  # (client host, client RTCP port) -> AsyncServerWorker
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        worker = self.workers.get(address[:2])
+        if worker is not None:
+            worker.handleRtcp(data)
+
+    def error_received(self, exc):
+        pass
+
+
+class AsyncServerWorker(ServerWorker):
+    """ServerWorker whose RTSP and RTP I/O run as event loop callbacks."""
+
+    def __init__(self, clientInfo, writer, server):
+        super().__init__(clientInfo)
+        self.writer = writer
+        self.server = server
+
+    async def run(self, reader):
+        """Read RTSP requests until the client disconnects."""
+        parser = RtspParser(lenient=True)
+        try:
+            while True:
+                if parser.stalled():
+                    try:
+                        data = await asyncio.wait_for(reader.read(RECV_SIZE), LEGACY_WAIT)
+                    except asyncio.TimeoutError:
+                        # A legacy client sends no blank line: its request ends where it went quiet
+                        for request in parser.flush():
+                            self.processRtspRequest(request)
+                        continue
+                elif "session" in self.clientInfo:
+                    data = await reader.read(RECV_SIZE)
+                else:
+                    # A connection that never sets up a session is dropped after the session timeout
+                    data = await asyncio.wait_for(reader.read(RECV_SIZE), sessionRegistry.timeout)
+                if not data:
+                    break
+                for request in parser.feed(data):
+                    self.processRtspRequest(request)
+        except RtspError:
+            self.replyBadRequest()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.stopStreaming()
+            self.closeSession()
+            self.writer.close()
+
+    def openRtpPorts(self):
+        self.server.rtcp.workers[self.rtcpAddress()] = self
+        return self.server.rtpPort
+
+    def rtcpAddress(self):
+        return (self.clientInfo["rtspSocket"][1][0], int(self.clientInfo["rtpPort"]) + 1)
+
+    def sendRtcp(self, data):
+        self.server.rtcp.transport.sendto(data, self.rtcpAddress())
+
+    def closeSession(self):
+        super().closeSession()
+        if "rtpPort" in self.clientInfo and self.server.rtcp.workers.get(self.rtcpAddress()) is self:
+            del self.server.rtcp.workers[self.rtcpAddress()]
+
+    def expire(self):
+        # Called from the reaper thread; the session's state belongs to the event loop
+        self.server.loop.call_soon_threadsafe(super().expire)
+
+    def deliverRtcp(self, data):
+        # Broadcast channels poll RTCP on the frame scheduler's thread; hand reports to the loop
+        self.server.loop.call_soon_threadsafe(self.handleRtcp, data)
+
+    def closeConnection(self):
+        self.writer.close()
+
+    def startStreaming(self):
+        self.clientInfo["pacer"] = self.server.scheduler.add(self, self.playRate(self.clientInfo["videoStream"]))
+        self.server.pace()
+
+    def stopStreaming(self):
+        if "pacer" in self.clientInfo:
+            self.server.scheduler.remove(self.clientInfo.pop("pacer"))
+
+    def sendPacket(self, rtpPacket, address):
+        self.server.rtp.sendPacket(rtpPacket, address)
+
+    def sendPackets(self, packets, address):
+        self.server.rtp.sendPackets(packets, address)
+
+    def sendRtspReply(self, reply):
+        self.writer.write(reply)
+
+
+class AsyncServer:
+    """Serve every RTSP session and its RTP stream from a single event loop."""
+
+    def __init__(self, port, sock=None):
+        self.port = port
+        self.sock = sock
+        self.rtp = RtpProtocol()
+        self.rtcp = RtcpProtocol()
+        self.rtpPort = None
+        self.scheduler = FrameScheduler()
+        self.timer = None
+        self.loop = None
+
+    def pace(self):
+        """Send due frames and re-arm the loop timer for the next deadline."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        deadline = self.scheduler.runOnce()
+        if deadline is not None:
+            delay = max(0.0, deadline - self.scheduler.clock())
+            self.timer = asyncio.get_running_loop().call_later(delay, self.pace)
+
+    async def handleClient(self, reader, writer):
+        clientAddress = writer.get_extra_info("peername")
+        log.info("Client connected: %s", clientAddress)
+        clientInfo = {"rtspSocket": (None, clientAddress)}
+        await AsyncServerWorker(clientInfo, writer, self).run(reader)
+
+    async def serve(self):
+        loop = self.loop = asyncio.get_running_loop()
+        sock, rtcpSock = bindPortPair()
+        sock.setblocking(False)
+        rtcpSock.setblocking(False)
+        self.rtp.sock = sock
+        self.rtp.sender = UdpBatchSender(sock, ServerWorker.gso)
+        self.rtpPort = sock.getsockname()[1]
+        await loop.create_datagram_endpoint(lambda: self.rtp, sock=sock)
+        await loop.create_datagram_endpoint(lambda: self.rtcp, sock=rtcpSock)
+
+        if self.sock is not None:
+            server = await asyncio.start_server(self.handleClient, sock=self.sock)
+        else:
+            server = await asyncio.start_server(self.handleClient, "", self.port, backlog=1024)
+        log.info("RTSP Server (asyncio) listening on port %s", self.port)
+        async with server:
+            await server.serve_forever()
+
+    def main(self):
+        asyncio.run(self.serve())
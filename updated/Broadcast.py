@@ -0,0 +1,202 @@
+"""Broadcast channels: each movie read and packetized once, fanned out to every viewer."""
+import socket
+import threading
+from random import getrandbits
+from time import perf_counter, time
+
+from Metrics import frameReadSeconds, rtpBytes, rtpPackets, sendErrors
+from RtcpPacket import encodeCompound, makeBye
+from ServerWorker import REPORT_INTERVAL, ServerWorker
+from VideoStream import VideoStream
+
+
+class Channel(ServerWorker):
+    """A movie streamed once, with the same packet buffers sent to every subscriber.
+
+    It reuses ServerWorker's packetizer and RTP/RTCP sockets; subscribing
+    sessions only choose where the packets go. At the end of the file the
+    channel starts over, like a live feed.
+    """
+
+    multicastGroup = None  # send each packet once to this group instead of once per subscriber
+    multicastPort = 5004  # first group port; each channel takes the next free even port
+    multicastTtl = 1
+
+    def __init__(self, filename, groupPort=None):
+        super().__init__({})
+        self.filename = filename
+        self.groupPort = groupPort
+        self.lock = threading.Lock()
+        self.subscribers = {}  # ServerWorker -> (client host, client RTP port)
+        self.references = 0
+        self.clientInfo["videoStream"] = VideoStream(filename, self.store)
+        self.clientInfo["ssrc"] = getrandbits(32)
+        self.clientInfo["rtpSeq"] = getrandbits(16)
+        self.clientInfo["timestampOffset"] = getrandbits(32)
+        self.clientInfo["framesSent"] = 0
+        try:
+            self.openRtpPorts()
+        except OSError:
+            self.clientInfo.pop("videoStream").close()
+            raise
+        if self.multicastGroup:
+            for name in ("rtpSocket", "rtcpSocket"):
+                self.clientInfo[name].setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicastTtl)
+        self.state = self.READY
+
+    def port(self):
+        """Return the port the channel sends RTP from."""
+        return self.clientInfo["rtpSocket"].getsockname()[1]
+
+    def transport(self, clientPort):
+        """Return the Transport header that tells a subscriber where packets come from."""
+        port = self.port()
+        if self.multicastGroup:
+            return "Transport: RTP/AVP;multicast;destination={};port={}-{};ttl={};server_port={}-{}".format(
+                self.multicastGroup, self.groupPort, self.groupPort + 1, self.multicastTtl, port, port + 1)
+        return "Transport: RTP/AVP;unicast;client_port={}-{};server_port={}-{}".format(
+            clientPort, clientPort + 1, port, port + 1)
+
+    def subscribe(self, worker, address):
+        """Start sending the channel's packets to address on behalf of worker."""
+        with self.lock:
+            self.subscribers[worker] = address
+            if "pacer" not in self.clientInfo:
+                self.state = self.PLAYING
+                self.startStreaming()
+
+    def unsubscribe(self, worker):
+        """Stop sending to worker; pause the channel once nobody is watching."""
+        with self.lock:
+            self.subscribers.pop(worker, None)
+            if not self.subscribers:
+                self.state = self.READY
+                self.stopStreaming()
+
+    def leave(self, worker):
+        """Unsubscribe worker and drop its reference to the channel."""
+        self.unsubscribe(worker)
+        broadcaster.release(self)
+
+    def destinations(self):
+        if self.multicastGroup:
+            return [(self.multicastGroup, self.groupPort)]
+        with self.lock:
+            return list(self.subscribers.values())
+
+    def sendFrame(self, stream):
+        """Packetize the next frame once and send it to every subscriber."""
+        start = perf_counter()
+        data = stream.nextFrame()
+        frameReadSeconds.observe(perf_counter() - start)
+        if not data:
+            stream.seek(0)
+            data = stream.nextFrame()
+            if not data:
+                return False
+        # Timestamps follow frames sent, so they keep rising when the file loops
+        frameNumber = self.clientInfo["framesSent"]
+        self.clientInfo["framesSent"] = frameNumber + 1
+        packets = self.makeRtp(data, frameNumber)
+        sender = self.clientInfo["rtpSender"]
+        batch = sender.prepare([rtpPacket.getBuffers() for rtpPacket in packets])
+        octets = sum(len(rtpPacket.payloadHeader) + len(rtpPacket.payload) for rtpPacket in packets)
+        for address in self.destinations():
+            try:
+                sender.sendPrepared(batch, address)
+                rtpPackets.inc(len(packets))
+                rtpBytes.inc(octets)
+            except OSError as e:
+                sendErrors.inc(error=type(e).__name__)  # one unreachable viewer must not hold up the others
+
+        with self.lock:
+            workers = list(self.subscribers)
+        for info in [self.clientInfo] + [worker.clientInfo for worker in workers]:
+            info["packetsSent"] = info.get("packetsSent", 0) + len(packets)
+            info["octetsSent"] = info.get("octetsSent", 0) + octets
+        self.clientInfo["lastTimestamp"] = packets[-1].timestamp()
+        if time() - self.clientInfo.get("lastReport", 0) >= REPORT_INTERVAL:
+            self.sendRtcpReport()
+        return True
+
+    def sendRtcp(self, data):
+        """Send an RTCP datagram to every destination's RTCP port."""
+        for host, port in self.destinations():
+            self.clientInfo["rtcpSocket"].sendto(data, (host, port + 1))
+
+    def pollRtcp(self):
+        """Hand each waiting receiver report to the subscriber that sent it."""
+        while True:
+            try:
+                data, source = self.clientInfo["rtcpSocket"].recvfrom(2048)
+            except (BlockingIOError, KeyError, OSError):
+                return
+            with self.lock:
+                subscribers = list(self.subscribers.items())
+            # Exact RTCP address first; multicast viewers on one host share a port
+            matches = [worker for worker, (host, port) in subscribers if (host, port + 1) == source[:2]]
+            matches += [worker for worker, (host, port) in subscribers if host == source[0]]
+            if matches:
+                matches[0].deliverRtcp(data)
+
+    def closeSession(self):
+        try:
+            self.sendRtcp(encodeCompound([makeBye(self.ssrc(), "channel closed")]))
+        except (KeyError, OSError):
+            pass
+        super().closeSession()
+
+    def stats(self):
+        with self.lock:
+            subscribers = len(self.subscribers)
+        return {
+            "subscribers": subscribers,
+            "packetsSent": self.clientInfo.get("packetsSent", 0),
+            "octetsSent": self.clientInfo.get("octetsSent", 0),
+        }
+
+
+class Broadcaster:
+    """Reference-counted registry of the process's broadcast channels."""
+
+    def __init__(self):
+        self.channels = {}  # filename -> Channel
+        self.lock = threading.Lock()
+
+    def acquire(self, filename):
+        """Return the channel for filename, opening it on first use."""
+        with self.lock:
+            channel = self.channels.get(filename)
+            if channel is None:
+                channel = Channel(filename, self.freeGroupPort())
+                self.channels[filename] = channel
+            channel.references += 1
+            return channel
+
+    def freeGroupPort(self):
+        """Return the lowest even multicast port no open channel uses."""
+        used = {channel.groupPort for channel in self.channels.values()}
+        port = Channel.multicastPort
+        while port in used:
+            port += 2
+        return port
+
+    def release(self, channel):
+        """Drop a reference; the last one stops and closes the channel."""
+        with self.lock:
+            channel.references -= 1
+            if channel.references > 0:
+                return
+            if self.channels.get(channel.filename) is channel:
+                del self.channels[channel.filename]
+        channel.stopStreaming()
+        channel.closeSession()
+
+    def stats(self):
+        """Return {filename: channel statistics}."""
+        with self.lock:
+            channels = list(self.channels.items())
+        return {filename: channel.stats() for filename, channel in channels}
+
+
+broadcaster = Broadcaster()
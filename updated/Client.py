@@ -1,14 +1,29 @@
-import os
+import queue
+import random
 import socket
 import sys
 import threading
+import time
+from io import BytesIO
 from tkinter import *
 from tkinter import messagebox
 from PIL import Image, ImageTk
-from RtpPacket import RtpPacket
+from RtpPacket import CLOCK_RATE, RtpPacket
+from JitterBuffer import JitterBuffer
+from RtpJpeg import JpegReassembler
+from RtcpPacket import SR, ReceptionStats, decodeCompound, encodeCompound, makeBye, makeNack, makeReceiverReport, makeSdes
+from Retransmit import RTX_PAYLOAD_TYPE, LossTracker, fromRtx, originalSeq
+from UdpBatch import RecvRing
+from Rtsp import RtspError, RtspParser, formatRequest, parseRange, parseScale, parseTransport, portRange
 
-CACHE_FILE_NAME = "cache-"
-CACHE_FILE_EXT = ".jpg"
+DECODE_QUEUE_SIZE = 4  # encoded frames waiting for the decoder
+READY_QUEUE_SIZE = 2  # decoded frames waiting for the Tk thread
+DISPLAY_POLL_MS = 10
+REPORT_INTERVAL = 1.0  # seconds between RTCP receiver reports
+RECV_SLOTS = 32  # datagrams drained per recvmmsg call
+RECV_SLOT_SIZE = 65536  # largest UDP datagram
+KEEPALIVE_POLL_MS = 1000
+MAX_SCALE = 8  # fastest fast-forward or rewind
 
 class Client:
     INIT = 0
@@ -21,8 +36,9 @@ class Client:
     PAUSE = 2
     TEARDOWN = 3
     DESCRIBE = 4  # Novo comando
+    KEEPALIVE = 5  # GET_PARAMETER that only refreshes the session
 
-    def __init__(self, master, serveraddr, serverport, rtpport, filename):
+    def __init__(self, master, serveraddr, serverport, rtpport, filename, broadcast=False):
         self.master = master
         self.master.protocol("WM_DELETE_WINDOW", self.handler)
         self.createWidgets()
@@ -30,12 +46,38 @@ class Client:
         self.serverPort = int(serverport)
         self.rtpPort = int(rtpport)
         self.fileName = filename
+        self.broadcast = broadcast  # watch the server's shared channel for the file
         self.rtspSeq = 0
         self.sessionId = 0
         self.requestSent = -1
+        self.pendingRequests = {}  # CSeq -> request code awaiting its reply
+        self.lastRequest = 0
+        self.sessionTimeout = None  # seconds, from the server's Session header
+        self.scale = 1.0  # playback speed to ask for; negative rewinds
+        self.seekTo = None  # npt seconds the next PLAY starts from
+        self.duration = None
+        self.position = 0.0  # npt of the frame last played
+        self.playStart = 0.0  # npt, speed and RTP timestamp of the latest PLAY reply
+        self.playScale = 1.0
+        self.playRtpTime = None
+        self.dragging = False
         self.teardownAcked = 0
+        self.rtspReader = None  # thread reading replies, started with the first request
+        self.ssrc = random.getrandbits(32)
+        self.serverSsrc = None  # the media stream we lock onto
+        self.serverRtcpPort = None
+        self.lastReport = 0
+        self.receptionStats = ReceptionStats(CLOCK_RATE)
+        self.lossTracker = LossTracker()  # gaps NACKed, and how their retransmissions went
         self.connectToServer()
         self.frameNbr = 0
+        self.reassembler = JpegReassembler()
+        self.decodeQueue = queue.Queue(DECODE_QUEUE_SIZE)
+        self.readyQueue = queue.Queue(READY_QUEUE_SIZE)
+        self.framesDropped = 0
+        threading.Thread(target=self.decodeFrames, daemon=True).start()
+        self.master.after(DISPLAY_POLL_MS, self.showFrames)
+        self.master.after(KEEPALIVE_POLL_MS, self.keepAlive)
 
     def createWidgets(self):
         """Build GUI."""
@@ -69,6 +111,22 @@ class Client:
         self.describe["command"] = self.describeMovie
         self.describe.grid(row=1, column=4, padx=2, pady=2)
 
+        # Create Rewind, seek bar and Fast forward controls
+        self.rewind = Button(self.master, width=15, padx=3, pady=3)
+        self.rewind["text"] = "<< Rewind"
+        self.rewind["command"] = self.rewindMovie
+        self.rewind.grid(row=2, column=0, padx=2, pady=2)
+
+        self.seekBar = Scale(self.master, from_=0, to=0, resolution=0.1, orient=HORIZONTAL, showvalue=0)
+        self.seekBar.bind("<ButtonPress-1>", self.startDrag)
+        self.seekBar.bind("<ButtonRelease-1>", self.seekMovie)
+        self.seekBar.grid(row=2, column=1, columnspan=3, sticky=W+E, padx=2, pady=2)
+
+        self.forward = Button(self.master, width=15, padx=3, pady=3)
+        self.forward["text"] = "Fast forward >>"
+        self.forward["command"] = self.fastForwardMovie
+        self.forward.grid(row=2, column=4, padx=2, pady=2)
+
         # Create a label to display the movie
         self.label = Label(self.master, height=19)
         self.label.grid(row=0, column=0, columnspan=5, sticky=W+E+N+S, padx=5, pady=5)
@@ -80,12 +138,12 @@ class Client:
 
     def exitClient(self):
         """Teardown button handler."""
+        self.sendRtcp([makeReceiverReport(self.ssrc, [self.receptionStats.reportBlock()]),
+                       makeBye(self.ssrc, "teardown")])
         self.sendRtspRequest(self.TEARDOWN)
+        print("Retransmission: {nacked} packets NACKed, {recovered} recovered, {late} too late".format(
+            **self.lossTracker.stats()))
         self.master.destroy()
-        try:
-            os.remove(CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT)
-        except OSError:
-            pass
 
     def pauseMovie(self):
         """Pause button handler."""
@@ -93,11 +151,41 @@ class Client:
             self.sendRtspRequest(self.PAUSE)
 
     def playMovie(self):
-        """Play button handler."""
-        if self.state == self.READY:
+        """Play button handler; while fast-forwarding or rewinding, back to normal speed."""
+        if self.state == self.PLAYING and self.scale != 1:
+            self.scale = 1.0
+            self.sendRtspRequest(self.PLAY)
+        elif self.state == self.READY:
             self.playEvent = threading.Event()
             self.playEvent.clear()
+            self.jitterBuffer = JitterBuffer(CLOCK_RATE)
             threading.Thread(target=self.listenRtp, daemon=True).start()
+            threading.Thread(target=self.playRtp, daemon=True).start()
+            threading.Thread(target=self.reportRtcp, daemon=True).start()
+            self.sendRtspRequest(self.PLAY)
+
+    def fastForwardMovie(self):
+        """Fast forward button handler: 2x, then each press doubles up to MAX_SCALE."""
+        self.scale = min(self.scale * 2, MAX_SCALE) if self.scale >= 2 else 2.0
+        self.changePlay()
+
+    def rewindMovie(self):
+        """Rewind button handler: -2x, then each press doubles up to MAX_SCALE."""
+        self.scale = max(self.scale * 2, -MAX_SCALE) if self.scale <= -2 else -2.0
+        self.changePlay()
+
+    def startDrag(self, event):
+        self.dragging = True
+
+    def seekMovie(self, event):
+        """Seek bar release handler: play on from the chosen time."""
+        self.dragging = False
+        self.seekTo = self.position = self.seekBar.get()
+        self.changePlay()
+
+    def changePlay(self):
+        """Send a new PLAY while playing; when paused, the next Play applies the change."""
+        if self.state == self.PLAYING:
             self.sendRtspRequest(self.PLAY)
 
     def describeMovie(self):
@@ -106,16 +194,26 @@ class Client:
 
     def listenRtp(self):
         """Listen for RTP packets."""
+        ring = RecvRing(self.rtpSocket, RECV_SLOTS, RECV_SLOT_SIZE)
         while True:
             try:
-                data = self.rtpSocket.recv(20480)
-                if data:
+                for view in ring.recv():
                     rtpPacket = RtpPacket()
-                    rtpPacket.decode(data)
-                    currFrameNbr = rtpPacket.seqNum()
-                    if currFrameNbr > self.frameNbr:
-                        self.frameNbr = currFrameNbr
-                        self.updateMovie(self.writeFrame(rtpPacket.getPayload()))
+                    # The jitter buffer outlives the ring slot, so keep a copy
+                    rtpPacket.decodeFrom(bytes(view))
+                    if rtpPacket.payloadType() == RTX_PAYLOAD_TYPE:
+                        self.repairPacket(rtpPacket)
+                        continue
+                    if self.serverSsrc is None:
+                        self.serverSsrc = rtpPacket.ssrc()
+                    if rtpPacket.ssrc() == self.serverSsrc:
+                        self.receptionStats.update(rtpPacket)
+                        missing = self.lossTracker.received(rtpPacket.seqNum())
+                        if missing:
+                            # A compound RTCP packet must start with a report, so an empty RR leads the NACK
+                            self.sendRtcp([makeReceiverReport(self.ssrc),
+                                           makeNack(self.ssrc, self.serverSsrc, missing)])
+                        self.jitterBuffer.push(rtpPacket)
             except:
                 if hasattr(self, "playEvent") and self.playEvent.is_set():
                     break
@@ -127,16 +225,100 @@ class Client:
                         pass
                     break
 
-    def writeFrame(self, data):
-        """Write the received frame to a temp image file."""
-        cachename = CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT
-        with open(cachename, "wb") as file:
-            file.write(data)
-        return cachename
+    def repairPacket(self, rtx):
+        """Put a retransmitted packet we asked for back into the stream."""
+        if self.serverSsrc is None or not self.lossTracker.requested(originalSeq(rtx)):
+            return  # a duplicate, or a repair for a gap we gave up on
+        self.lossTracker.repaired(self.jitterBuffer.push(fromRtx(rtx, self.serverSsrc), repair=True))
+
+    def playRtp(self):
+        """Render frames as the jitter buffer releases them on its playout clock."""
+        jitterBuffer = self.jitterBuffer
+        while not self.playEvent.is_set() and self.teardownAcked == 0:
+            for rtpPacket in jitterBuffer.pop(timeout=0.5):
+                frame = self.reassembler.push(rtpPacket)
+                if frame:
+                    self.frameNbr += 1
+                    self.trackPosition(rtpPacket.timestamp())
+                    self.queueFrame(self.decodeQueue, frame)
+
+    def trackPosition(self, timestamp):
+        """Work out a frame's npt from its RTP timestamp and the latest PLAY reply's RTP-Info."""
+        if self.playRtpTime is None:
+            return
+        elapsed = ((timestamp - self.playRtpTime + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        if elapsed >= 0:  # earlier frames were sent before the latest PLAY took effect
+            self.position = self.playStart + elapsed / CLOCK_RATE * self.playScale
+
+    def reportRtcp(self):
+        """Send receiver reports and record the server's sender reports while playing."""
+        while not self.playEvent.is_set() and self.teardownAcked == 0:
+            try:
+                for packet in decodeCompound(self.rtcpSocket.recv(2048)):
+                    if packet.packetType == SR:
+                        self.receptionStats.senderReport(packet)
+            except socket.timeout:
+                pass
+            except (AttributeError, OSError):
+                return
+            if time.time() - self.lastReport >= REPORT_INTERVAL:
+                self.sendRtcp([makeReceiverReport(self.ssrc, [self.receptionStats.reportBlock()])])
+
+    def sendRtcp(self, packets):
+        """Send packets to the server as a compound led by a report, then SDES."""
+        if self.serverRtcpPort is None:
+            return
+        compound = packets[:1] + [makeSdes(self.ssrc, "client@" + socket.gethostname())] + packets[1:]
+        self.lastReport = time.time()
+        try:
+            self.rtcpSocket.sendto(encodeCompound(compound), (self.serverAddr, self.serverRtcpPort))
+        except (AttributeError, OSError):
+            pass
+
+    def queueFrame(self, frames, frame):
+        """Queue a frame, dropping the oldest one when the consumer falls behind."""
+        while True:
+            try:
+                frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    frames.get_nowait()
+                    self.framesDropped += 1
+                except queue.Empty:
+                    pass
+
+    def decodeFrames(self):
+        """Decode JPEG frames in memory, off both the network and Tk threads."""
+        while True:
+            frame = self.decodeQueue.get()
+            try:
+                image = Image.open(BytesIO(frame))
+                image.load()
+            except OSError:
+                self.framesDropped += 1
+                continue
+            self.queueFrame(self.readyQueue, image)
+
+    def showFrames(self):
+        """Display the newest decoded frame; runs on the Tk thread via after()."""
+        image = None
+        while True:
+            try:
+                image = self.readyQueue.get_nowait()
+            except queue.Empty:
+                break
+        if image is not None:
+            self.updateMovie(image)
+        if self.duration and float(self.seekBar["to"]) != self.duration:
+            self.seekBar.configure(to=self.duration)
+        if not self.dragging:
+            self.seekBar.set(self.position)
+        self.master.after(DISPLAY_POLL_MS, self.showFrames)
 
-    def updateMovie(self, imageFile):
-        """Update the image file as video frame in the GUI."""
-        photo = ImageTk.PhotoImage(Image.open(imageFile))
+    def updateMovie(self, image):
+        """Update the decoded image as video frame in the GUI."""
+        photo = ImageTk.PhotoImage(image)
         self.label.configure(image=photo, height=288)
         self.label.image = photo
 
@@ -153,45 +335,77 @@ class Client:
         self.rtspSeq += 1
         
         if requestCode == self.SETUP and self.state == self.INIT:
-            threading.Thread(target=self.recvRtspReply, daemon=True).start()
-            request = "SETUP {} RTSP/1.0\nCSeq: {}\nTransport: RTP/UDP; client_port= {}\n".format(self.fileName, self.rtspSeq, self.rtpPort)
+            self.startReplyReader()
+            if self.broadcast:
+                transport = "RTP/AVP;multicast;client_port={}-{}".format(self.rtpPort, self.rtpPort + 1)
+            else:
+                transport = "RTP/UDP; client_port= {}".format(self.rtpPort)
+            request = formatRequest("SETUP", self.fileName, self.rtspSeq, [("Transport", transport)])
             self.requestSent = self.SETUP
         
-        elif requestCode == self.PLAY and self.state == self.READY:
-            request = "PLAY {} RTSP/1.0\nCSeq: {}\nSession: {}\n".format(self.fileName, self.rtspSeq, self.sessionId)
+        elif requestCode == self.PLAY and (self.state == self.READY or self.state == self.PLAYING):
+            headers = [("Session", self.sessionId)]
+            if self.seekTo is not None:
+                headers.append(("Range", "npt={:.3f}-".format(self.seekTo)))
+                self.seekTo = None
+            if self.scale != 1:
+                headers.append(("Scale", "{:g}".format(self.scale)))
+            request = formatRequest("PLAY", self.fileName, self.rtspSeq, headers)
             self.requestSent = self.PLAY
         
         elif requestCode == self.PAUSE and self.state == self.PLAYING:
-            request = "PAUSE {} RTSP/1.0\nCSeq: {}\nSession: {}\n".format(self.fileName, self.rtspSeq, self.sessionId)
+            request = formatRequest("PAUSE", self.fileName, self.rtspSeq, [("Session", self.sessionId)])
             self.requestSent = self.PAUSE
         
         elif requestCode == self.TEARDOWN and not self.state == self.INIT:
-            request = "TEARDOWN {} RTSP/1.0\nCSeq: {}\nSession: {}\n".format(self.fileName, self.rtspSeq, self.sessionId)
+            request = formatRequest("TEARDOWN", self.fileName, self.rtspSeq, [("Session", self.sessionId)])
             self.requestSent = self.TEARDOWN
             
         elif requestCode == self.DESCRIBE:
             # Se for chamado antes do Setup, precisamos garantir que a thread de resposta esteja rodando
             if self.state == self.INIT:
-                 threading.Thread(target=self.recvRtspReply, daemon=True).start()
-            request = "DESCRIBE {} RTSP/1.0\nCSeq: {}\nSession: {}\n".format(self.fileName, self.rtspSeq, self.sessionId)
+                self.startReplyReader()
+            request = formatRequest("DESCRIBE", self.fileName, self.rtspSeq, [("Session", self.sessionId)])
             self.requestSent = self.DESCRIBE
+
+        elif requestCode == self.KEEPALIVE and not self.state == self.INIT:
+            request = formatRequest("GET_PARAMETER", self.fileName, self.rtspSeq, [("Session", self.sessionId)])
             
         else:
             return
 
+        self.pendingRequests[self.rtspSeq] = requestCode
+        self.lastRequest = time.time()
+
         try:
             self.rtspSocket.send(request.encode("utf-8"))
             print("\nData sent:\n" + request)
         except Exception as e:
             print("Failed sending RTSP request:", e)
 
+    def keepAlive(self):
+        """Refresh the session before the server's timeout frees it; runs on the Tk thread."""
+        if (self.sessionTimeout and not self.state == self.INIT
+                and time.time() - self.lastRequest >= self.sessionTimeout / 2):
+            self.sendRtspRequest(self.KEEPALIVE)
+        self.master.after(KEEPALIVE_POLL_MS, self.keepAlive)
+
+    def startReplyReader(self):
+        """Start the thread reading RTSP replies, once per connection."""
+        if self.rtspReader is None:
+            self.rtspReader = threading.Thread(target=self.recvRtspReply, daemon=True)
+            self.rtspReader.start()
+
     def recvRtspReply(self):
         """Receive RTSP reply from the server."""
+        parser = RtspParser()
         while True:
             try:
-                reply = self.rtspSocket.recv(4096)
-                if reply:
-                    self.parseRtspReply(reply.decode("utf-8"))
+                data = self.rtspSocket.recv(4096)
+                if not data:
+                    break
+                for reply in parser.feed(data):
+                    self.parseRtspReply(reply)
                 
                 if self.requestSent == self.TEARDOWN:
                     self.rtspSocket.shutdown(socket.SHUT_RDWR)
@@ -200,60 +414,90 @@ class Client:
             except:
                 break
 
-    def parseRtspReply(self, data):
-        """Parse the RTSP reply from the server."""
-        lines = data.splitlines()
-        if not lines: return
-
-        try:
-            seqNum = int(lines[1].split(" ")[1])
-        except:
+    def parseRtspReply(self, reply):
+        """Parse an RTSP reply (an RtspMessage) from the server."""
+        seqNum = reply.cseq()
+        if seqNum is None or not reply.isResponse():
             return
 
-        if seqNum == self.rtspSeq:
+        requestCode = self.pendingRequests.pop(seqNum, None)
+        if requestCode is not None:
             try:
-                session = int(lines[2].split(" ")[1])
-            except:
+                session = int(reply.session())
+            except (TypeError, ValueError):
                 session = self.sessionId
 
             if self.sessionId == 0: self.sessionId = session
             
             if self.sessionId == session:
-                if int(lines[0].split(" ")[1]) == 200:
-                    if self.requestSent == self.SETUP:
+                if reply.status == 200:
+                    if reply.sessionTimeout():
+                        self.sessionTimeout = reply.sessionTimeout()
+                    if requestCode == self.SETUP:
                         self.state = self.READY
-                        self.openRtpPort()
-                    elif self.requestSent == self.PLAY:
+                        transport = parseTransport(reply.header("Transport", ""))
+                        if "server_port" in transport:
+                            self.serverRtcpPort = portRange(transport["server_port"])[1]
+                        if "multicast" in transport and "destination" in transport:
+                            self.openRtpPort(transport["destination"], portRange(transport.get("port", self.rtpPort))[0])
+                        else:
+                            self.openRtpPort()
+                    elif requestCode == self.PLAY:
                         self.state = self.PLAYING
-                    elif self.requestSent == self.PAUSE:
+                        self.playStarted(reply)
+                    elif requestCode == self.PAUSE:
                         self.state = self.READY
                         if hasattr(self, "playEvent"): self.playEvent.set()
-                    elif self.requestSent == self.TEARDOWN:
+                    elif requestCode == self.TEARDOWN:
                         self.state = self.INIT
                         self.teardownAcked = 1
-                    elif self.requestSent == self.DESCRIBE:
+                    elif requestCode == self.DESCRIBE:
                         # Extrai o corpo SDP e mostra no terminal
-                        body = ""
-                        if "\n\n" in data:
-                            body = data.split("\n\n", 1)[1]
-                        elif "\r\n\r\n" in data:
-                            body = data.split("\r\n\r\n", 1)[1]
-                        else:
-                            if "v=0" in data:
-                                body = data[data.find("v=0"):]
-                            else:
-                                body = "No SDP body found"
-                                
+                        body = reply.body.decode("utf-8", errors="replace") or "No SDP body found"
                         print(body.strip())
+                        for line in body.splitlines():
+                            if line.startswith("a=range:"):
+                                try:
+                                    self.duration = parseRange(line[len("a=range:"):])[1] or self.duration
+                                except RtspError:
+                                    pass
+
+    def playStarted(self, reply):
+        """Note where and how fast a PLAY reply says playback resumes."""
+        try:
+            start, end = parseRange(reply.header("Range"))
+            self.playScale = parseScale(reply.header("Scale"))
+        except RtspError:
+            return
+        rtpInfo = parseTransport(reply.header("RTP-Info", ""))
+        if start is None or "rtptime" not in rtpInfo:
+            return
+        self.playStart = self.position = start
+        self.playRtpTime = int(rtpInfo["rtptime"])
+        if end is not None:
+            self.duration = max(end, self.duration or 0)
+
+    def openRtpPort(self, group=None, port=None):
+        """Open RTP socket binded to a specified port, and RTCP on the port above it.
 
-    def openRtpPort(self):
-        """Open RTP socket binded to a specified port."""
+        With a multicast group, bind the group's ports and join it instead.
+        """
+        port = self.rtpPort if group is None else port
         self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.rtpSocket.settimeout(0.5)
+        self.rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rtcpSocket.settimeout(0.5)
         try:
-            self.rtpSocket.bind(("", self.rtpPort))
+            for offset, sock in enumerate((self.rtpSocket, self.rtcpSocket)):
+                if group is not None:
+                    # Other viewers on this host may have joined the same group
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(("", port + offset))
+                if group is not None:
+                    membership = socket.inet_aton(group) + socket.inet_aton("0.0.0.0")
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
         except:
-            messagebox.showwarning("Unable to Bind", "Unable to bind PORT=%d" % self.rtpPort)
+            messagebox.showwarning("Unable to Bind", "Unable to bind PORT=%d" % port)
 
     def handler(self):
         """Handler on explicitly closing the GUI window."""
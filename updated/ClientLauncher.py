@@ -9,14 +9,15 @@ if __name__ == "__main__":
         serverPort = int(sys.argv[2])
         rtpPort = int(sys.argv[3])
         fileName = sys.argv[4]
+        broadcast = "--broadcast" in sys.argv[5:]
     except IndexError:
-        print("[Usage: ClientLauncher.py Server_name Server_port RTP_port Video_file]")
+        print("[Usage: ClientLauncher.py Server_name Server_port RTP_port Video_file [--broadcast]]")
         sys.exit(1)
 
     root = Tk()
 
     # Create a new client
-    app = Client(root, serverAddr, serverPort, rtpPort, fileName)
+    app = Client(root, serverAddr, serverPort, rtpPort, fileName, broadcast)
     app.master.title("RTPClient")
 
     root.mainloop()
@@ -0,0 +1,176 @@
+"""Binary MJPEG container (.mjpb) and a converter from the legacy .Mjpeg format.
+
+Layout, all fields little-endian:
+
+    header   magic "MJPB", version, header size, fps (double), width, height,
+             frame count, index offset
+    frames   per frame a 32-bit length followed by the JPEG bytes
+    index    magic "MIDX", then frame count offsets (u64), lengths (u32) and
+             presentation times in microseconds (u64), each as one array
+
+The index offsets point at the JPEG bytes, past their length prefix, so the
+frames can also be scanned sequentially when the index is missing.
+
+Usage: python Container.py input.Mjpeg output.mjpb [--fps N]
+"""
+import argparse
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"MJPB"
+VERSION = 1
+EXT = ".mjpb"
+HEADER = struct.Struct("<4sHHdHHIQ")  # magic, version, header size, fps, width, height, frames, index offset
+LENGTH = struct.Struct("<I")
+INDEX_MAGIC = b"MIDX"
+INDEX_ENTRY_BYTES = 8 + 4 + 8  # offset, length and timestamp of one frame
+MAX_FRAME_BYTES = 0xFFFFFFFF
+
+
+class ContainerError(ValueError):
+    """A file that is not a readable container."""
+
+
+class ContainerIndex:
+    """Header fields and frame index of a container file."""
+
+    def __init__(self, fps, width, height, offsets, lengths, timestamps):
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.offsets = offsets
+        self.lengths = lengths
+        self.timestamps = timestamps  # microseconds from the first frame
+
+
+def isContainer(file):
+    """Return True if file starts with the container magic. Leaves the position at 0."""
+    file.seek(0)
+    magic = file.read(len(MAGIC))
+    file.seek(0)
+    return magic == MAGIC
+
+
+def readArray(file, typecode, count):
+    values = array(typecode)
+    values.fromfile(file, count)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def readIndex(file):
+    """Read a container's header and trailing index."""
+    file.seek(0)
+    try:
+        magic, version, headerSize, fps, width, height, count, indexOffset = HEADER.unpack(file.read(HEADER.size))
+    except struct.error:
+        raise ContainerError("truncated container header")
+    if magic != MAGIC:
+        raise ContainerError("not a container file")
+    if version != VERSION:
+        raise ContainerError("unsupported container version %d" % version)
+    if not fps > 0:
+        raise ContainerError("container frame rate %r is not positive" % fps)
+    size = file.seek(0, os.SEEK_END)
+    # Checked before reading so a corrupt count cannot size the arrays
+    if indexOffset + len(INDEX_MAGIC) + count * INDEX_ENTRY_BYTES > size:
+        raise ContainerError("container index of %d frames at %d runs past the end of the file" % (count, indexOffset))
+    file.seek(indexOffset)
+    if file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+        raise ContainerError("container index is missing")
+    try:
+        offsets = readArray(file, "Q", count)
+        lengths = readArray(file, "I", count)
+        timestamps = readArray(file, "Q", count)
+    except EOFError:
+        raise ContainerError("truncated container index")
+    file.seek(0)
+    return ContainerIndex(fps, width, height, offsets, lengths, timestamps)
+
+
+class ContainerWriter:
+    """Write frames to a container file; close() appends the index."""
+
+    def __init__(self, file, fps, width=0, height=0):
+        self.file = file
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.timestamps = array("Q")
+        self.file.write(bytes(HEADER.size))  # rewritten by close()
+
+    def writeFrame(self, data, timestamp=None):
+        """Append one JPEG frame; timestamp is in microseconds and defaults to the frame rate."""
+        if len(data) > MAX_FRAME_BYTES:
+            raise ContainerError("frame of %d bytes is too large" % len(data))
+        if timestamp is None:
+            timestamp = round(len(self.offsets) * 1000000 / self.fps)
+        self.file.write(LENGTH.pack(len(data)))
+        self.offsets.append(self.file.tell())
+        self.lengths.append(len(data))
+        self.timestamps.append(timestamp)
+        self.file.write(data)
+
+    def close(self):
+        """Write the index and the final header."""
+        indexOffset = self.file.tell()
+        self.file.write(INDEX_MAGIC)
+        for values in (self.offsets, self.lengths, self.timestamps):
+            if sys.byteorder == "big":
+                values = array(values.typecode, values)
+                values.byteswap()
+            values.tofile(self.file)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, HEADER.size, self.fps, self.width, self.height,
+                                    len(self.offsets), indexOffset))
+        self.file.seek(0, os.SEEK_END)
+
+
+def convert(source, destination, fps=None):
+    """Convert a legacy .Mjpeg file to a container. Return the number of frames written."""
+    from RtpJpeg import parseJpeg
+    from VideoStream import loadFrameRate, scanIndex
+
+    fps = fps or loadFrameRate(source)
+    with open(source, "rb") as src:
+        offsets, lengths = scanIndex(src)
+        width = height = 0
+        if offsets:
+            src.seek(offsets[0])
+            try:
+                first = parseJpeg(src.read(lengths[0]))
+                width, height = first.width, first.height
+            except ValueError:
+                pass  # dimensions stay unknown
+        with open(destination + ".tmp", "wb") as dst:
+            writer = ContainerWriter(dst, fps, width, height)
+            for offset, length in zip(offsets, lengths):
+                src.seek(offset)
+                writer.writeFrame(src.read(length))
+            writer.close()
+    os.replace(destination + ".tmp", destination)
+    return len(offsets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a legacy .Mjpeg movie to the binary container.")
+    parser.add_argument("source")
+    parser.add_argument("destination", nargs="?",
+                        help="output file (default: the source with its extension replaced by %s)" % EXT)
+    parser.add_argument("--fps", type=float,
+                        help="frame rate to record (default: the source's .fps file, else 20)")
+    args = parser.parse_args()
+    if args.fps is not None and not args.fps > 0:
+        parser.error("--fps must be greater than 0")
+    destination = args.destination or os.path.splitext(args.source)[0] + EXT
+    count = convert(args.source, destination, args.fps)
+    print("Wrote {} frames to {}".format(count, destination))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+PROTECTED_SHARE = 0.8  # share of the budget kept for frames read more than once
+
+
+class FrameCache:
+    """Process-wide segmented LRU cache of video frames with a byte budget.
+
+    New frames enter a probation segment; a frame read again moves to the
+    protected segment. Eviction takes the least recently used probation frame
+    first, so a stream playing cold content once through only recycles
+    probation space and never pushes out frames that several sessions share.
+    Keys are (file identity, frame number); a budget of 0 disables the cache.
+    """
+
+    def __init__(self, budget=0, protectedShare=PROTECTED_SHARE):
+        self.budget = budget
+        self.protectedShare = protectedShare
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.probationBytes = 0
+        self.protectedBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached frame for key, or None."""
+        with self.lock:
+            data = self.protected.get(key)
+            if data is not None:
+                self.protected.move_to_end(key)
+                self.hits += 1
+                return data
+            data = self.probation.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.probationBytes -= len(data)
+            self.protected[key] = data
+            self.protectedBytes += len(data)
+            # Demote the protected segment's oldest frames back to probation
+            while self.protectedBytes > self.budget * self.protectedShare and len(self.protected) > 1:
+                oldKey, oldData = self.protected.popitem(last=False)
+                self.protectedBytes -= len(oldData)
+                self.probation[oldKey] = oldData
+                self.probationBytes += len(oldData)
+            self.evict()
+            return data
+
+    def put(self, key, data):
+        """Cache a frame read from disk. Frames larger than the budget are not kept."""
+        if len(data) > self.budget:
+            return
+        with self.lock:
+            if key in self.protected or key in self.probation:
+                return
+            self.probation[key] = data
+            self.probationBytes += len(data)
+            self.evict()
+
+    def evict(self):
+        # Caller holds the lock
+        while self.probationBytes + self.protectedBytes > self.budget:
+            segment = self.probation if self.probation else self.protected
+            _, data = segment.popitem(last=False)
+            if segment is self.probation:
+                self.probationBytes -= len(data)
+            else:
+                self.protectedBytes -= len(data)
+            self.evictions += 1
+
+    def resize(self, budget):
+        """Change the byte budget, evicting whatever no longer fits."""
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.probation.clear()
+            self.protected.clear()
+            self.probationBytes = self.protectedBytes = 0
+
+    def stats(self):
+        """Return size and hit/miss counters."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "budget": self.budget,
+                "bytes": self.probationBytes + self.protectedBytes,
+                "protectedBytes": self.protectedBytes,
+                "frames": len(self.probation) + len(self.protected),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+frameCache = FrameCache()
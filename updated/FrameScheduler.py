@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import logging
+import selectors
+import socket
+import threading
+import time
+
+from Metrics import sendLateness
+
+log = logging.getLogger(__name__)
+
+REBASE_AFTER = 1.0  # seconds behind schedule before a stream gives up catching up
+
+
+class Pacer:
+    """Schedule state of one session: its frame clock and send lateness."""
+
+    def __init__(self, session, fps, start):
+        self.session = session
+        self.interval = 1.0 / fps
+        self.base = start
+        self.frames = 0
+        self.active = True
+        self.lastLate = 0.0
+        self.maxLate = 0.0
+        self.totalLate = 0.0
+        self.sent = 0
+
+    def deadline(self):
+        # Derived from the frame count, not accumulated, so rounding never drifts
+        return self.base + self.frames * self.interval
+
+    def stats(self):
+        return {
+            "fps": 1.0 / self.interval,
+            "sent": self.sent,
+            "lastLate": self.lastLate,
+            "maxLate": self.maxLate,
+            "meanLate": self.totalLate / self.sent if self.sent else 0.0,
+        }
+
+
+class FrameScheduler:
+    """Drive every playing session from one heap keyed on next-frame deadline.
+
+    Between deadlines the scheduler thread waits on the sockets passed to
+    watch(), so RTCP feedback such as NACKs is handled as it arrives rather
+    than after the session's next frame.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.selector = None  # created by start()
+        self.waker = None  # written to when the next deadline may have moved
+
+    def add(self, session, fps):
+        """Start pacing session.sendRtp() at fps. Return its Pacer."""
+        pacer = Pacer(session, fps, self.clock())
+        with self.cond:
+            heapq.heappush(self.heap, (pacer.deadline(), next(self.counter), pacer))
+        self.wake()
+        return pacer
+
+    def remove(self, pacer):
+        """Stop pacing; the heap entry is discarded when it comes due."""
+        pacer.active = False
+
+    def runOnce(self):
+        """Send every frame that is due. Return the next deadline, or None if idle."""
+        while True:
+            with self.cond:
+                while self.heap and not self.heap[0][2].active:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    return None
+                deadline, _, pacer = self.heap[0]
+                now = self.clock()
+                if deadline > now:
+                    return deadline
+                heapq.heappop(self.heap)
+
+            late = now - deadline
+            try:
+                sent = pacer.session.sendRtp()
+            except Exception:
+                log.exception("Stopped pacing %r after sendRtp failed", pacer.session)
+                sent = False
+            if sent is False:
+                pacer.active = False
+                continue
+            pacer.sent += 1
+            sendLateness.observe(late)
+            pacer.lastLate = late
+            pacer.totalLate += late
+            pacer.maxLate = max(pacer.maxLate, late)
+            pacer.frames += 1
+            if late > REBASE_AFTER:
+                pacer.base, pacer.frames = now, 0
+
+            with self.cond:
+                if pacer.active:
+                    heapq.heappush(self.heap, (pacer.deadline(), next(self.counter), pacer))
+
+    def watch(self, sock, callback):
+        """Call callback() on the scheduler thread whenever sock is readable."""
+        self.start()
+        self.selector.register(sock, selectors.EVENT_READ, callback)
+        self.wake()
+
+    def unwatch(self, sock):
+        """Stop watching sock. Call it before closing sock."""
+        if self.selector is None:
+            return
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            return
+        self.wake()
+
+    def wake(self):
+        """Make the scheduler thread re-read the next deadline and the watched sockets."""
+        if self.waker is not None:
+            try:
+                self.waker.send(b"\0")
+            except BlockingIOError:
+                pass  # already full of wakeups
+
+    def run(self, woken):
+        """Scheduler thread main loop."""
+        while True:
+            deadline = self.runOnce()
+            # An add() or watch() since runOnce() left a byte on woken, so select() returns at once
+            timeout = None if deadline is None else max(0.0, deadline - self.clock())
+            try:
+                events = self.selector.select(timeout)
+            except OSError:
+                continue  # a socket was closed while watched; its unwatch() is on the way
+            for key, _ in events:
+                if key.fileobj is woken:
+                    try:
+                        woken.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                try:
+                    key.data()
+                except Exception:
+                    log.exception("Callback for watched socket %s failed", key.fileobj)
+
+    def start(self):
+        """Start the scheduler thread once."""
+        with self.cond:
+            if self.thread is None:
+                self.selector = selectors.DefaultSelector()
+                woken, self.waker = socket.socketpair()
+                woken.setblocking(False)
+                self.waker.setblocking(False)
+                self.selector.register(woken, selectors.EVENT_READ)
+                self.thread = threading.Thread(target=self.run, args=(woken,), daemon=True)
+                self.thread.start()
+
+    def stats(self):
+        """Return {session: lateness statistics} for every active session."""
+        with self.cond:
+            return {pacer.session: pacer.stats() for _, _, pacer in self.heap if pacer.active}
+
+
+frameScheduler = FrameScheduler()
@@ -0,0 +1,135 @@
+import heapq
+import threading
+import time
+
+SEQ_MOD = 1 << 16
+TS_MOD = 1 << 32
+
+
+class JitterBuffer:
+    """Reorder RTP packets by sequence number and release them on a playout clock.
+
+    Each packet is due at  firstArrival + (timestamp - firstTimestamp) / clockRate + delay,
+    where delay adapts to the measured interarrival jitter (RFC 3550, 6.4.1).
+    """
+
+    def __init__(self, clockRate, minDelay=0.05, maxDelay=1.0, clock=time.monotonic):
+        self.clockRate = clockRate
+        self.minDelay = minDelay
+        self.maxDelay = maxDelay
+        self.clock = clock
+        self.delay = minDelay
+        self.cond = threading.Condition()
+
+        self.heap = []  # (extended seq, packet)
+        self.queued = set()
+        self.maxSeq = None
+        self.cycles = 0
+        self.nextSeq = None  # extended seq expected to be played next
+        self.baseTimestamp = None
+        self.baseArrival = None
+        self.lastTransit = None
+        self.jitter = 0.0  # in timestamp units
+
+        self.received = 0
+        self.late = 0
+        self.lost = 0
+        self.duplicate = 0
+
+    def extendSeq(self, seq):
+        """Map a 16-bit sequence number onto a monotonic extended sequence number."""
+        if self.maxSeq is None:
+            self.maxSeq = seq
+            return seq
+        if (seq - self.maxSeq) % SEQ_MOD < SEQ_MOD // 2:
+            if seq < self.maxSeq:
+                self.cycles += SEQ_MOD  # wrapped forward
+            self.maxSeq = seq
+            return self.cycles + seq
+        # Older than the highest seen; it may belong to the previous cycle
+        if seq > self.maxSeq:
+            return self.cycles - SEQ_MOD + seq
+        return self.cycles + seq
+
+    def push(self, rtpPacket, repair=False):
+        """Queue a received packet. Return False if it was late or a duplicate.
+
+        A repair (a retransmitted packet) arrives a round trip late by design,
+        so it is left out of the jitter estimate.
+        """
+        arrival = self.clock()
+        with self.cond:
+            self.received += 1
+            ext = self.extendSeq(rtpPacket.seqNum())
+            if self.nextSeq is not None and ext < self.nextSeq:
+                self.late += 1
+                return False
+            if ext in self.queued:
+                self.duplicate += 1
+                return False
+
+            timestamp = rtpPacket.timestamp()
+            if repair and self.baseTimestamp is not None:
+                heapq.heappush(self.heap, (ext, rtpPacket))
+                self.queued.add(ext)
+                self.cond.notify()
+                return True
+            if self.baseTimestamp is None:
+                self.baseTimestamp = timestamp
+                self.baseArrival = arrival
+            transit = arrival * self.clockRate - self.mediaTime(timestamp)
+            if self.lastTransit is not None:
+                self.jitter += (abs(transit - self.lastTransit) - self.jitter) / 16
+            self.lastTransit = transit
+            target = 4 * self.jitter / self.clockRate
+            self.delay = max(self.minDelay, min(self.maxDelay, target))
+
+            heapq.heappush(self.heap, (ext, rtpPacket))
+            self.queued.add(ext)
+            self.cond.notify()
+            return True
+
+    def mediaTime(self, timestamp):
+        """Timestamp units elapsed since the first packet, tolerating 32-bit wrap."""
+        diff = (timestamp - self.baseTimestamp) % TS_MOD
+        return diff - TS_MOD if diff >= TS_MOD // 2 else diff
+
+    def playoutTime(self, rtpPacket):
+        return self.baseArrival + self.mediaTime(rtpPacket.timestamp()) / self.clockRate + self.delay
+
+    def pop(self, timeout=None):
+        """Wait up to timeout for due packets and return them in sequence order."""
+        with self.cond:
+            deadline = None if timeout is None else self.clock() + timeout
+            while True:
+                now = self.clock()
+                due = []
+                while self.heap and self.playoutTime(self.heap[0][1]) <= now:
+                    ext, packet = heapq.heappop(self.heap)
+                    self.queued.discard(ext)
+                    if self.nextSeq is not None and ext > self.nextSeq:
+                        self.lost += ext - self.nextSeq  # the gap's playout time has passed
+                    self.nextSeq = ext + 1
+                    due.append(packet)
+                if due:
+                    return due
+                wait = None if deadline is None else deadline - now
+                if self.heap:
+                    untilDue = self.playoutTime(self.heap[0][1]) - now
+                    wait = untilDue if wait is None else min(wait, untilDue)
+                if wait is not None and wait <= 0:
+                    return []
+                self.cond.wait(wait)
+
+    def stats(self):
+        """Return the buffer's counters and its current target delay in seconds."""
+        with self.cond:
+            return {
+                "received": self.received,
+                "late": self.late,
+                "lost": self.lost,
+                "duplicate": self.duplicate,
+                "buffered": len(self.heap),
+                "delay": self.delay,
+                "jitter": self.jitter / self.clockRate,
+            }
@@ -0,0 +1,53 @@
+"""Leveled, rate-limited logging for the server.
+
+Modules log through logging.getLogger(__name__). configureLogging() installs
+one handler whose filter lets each message template through at most BURST
+times per INTERVAL; the next record let through after a quiet spell says how
+many were suppressed. A client that misbehaves in a tight loop therefore
+costs a few lines per second rather than a synchronous write per packet.
+"""
+import logging
+import threading
+import time
+
+INTERVAL = 10.0  # seconds per rate limit window
+BURST = 10  # records of one template allowed per window
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop records of a template past BURST per INTERVAL, counting what was dropped."""
+
+    def __init__(self, interval=INTERVAL, burst=BURST, clock=time.monotonic):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.clock = clock
+        self.windows = {}  # (logger, template) -> [window start, records let through, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = self.clock()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                window = self.windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.msg = "%s (%d similar messages suppressed)" % (record.msg, suppressed)
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+def configureLogging(level="INFO", interval=INTERVAL, burst=BURST):
+    """Log to stderr at level, rate limited per message template."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(FORMAT))
+    handler.addFilter(RateLimitFilter(interval, burst))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
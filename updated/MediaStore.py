@@ -0,0 +1,91 @@
+import mmap
+import threading
+
+from VideoStream import loadMovie
+
+
+class MediaFile:
+    """A video file mapped into memory once and shared by every session."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.refs = 0
+        try:
+            self.file = open(filename, "rb")
+            self.index = loadMovie(filename, self.file)
+            self.offsets, self.lengths = self.index.offsets, self.index.lengths
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            if getattr(self, "file", None) is not None:
+                self.file.close()
+            raise IOError("Não foi possível abrir o arquivo de vídeo.")
+        self.view = memoryview(self.map)
+        self.fps = self.index.fps
+
+    def frameAt(self, n):
+        """Return frame n (1-based) as a read-only memoryview into the mapping."""
+        offset = self.offsets[n - 1]
+        return self.view[offset:offset + self.lengths[n - 1]]
+
+    def prefault(self, start, end):
+        """Start bringing bytes [start, end) of the file into memory, without copying them.
+
+        Where madvise is available the kernel reads the pages in the background
+        and this returns at once; elsewhere it touches each page, blocking on
+        the disk with the GIL held.
+        """
+        first = start - start % mmap.PAGESIZE
+        if hasattr(mmap, "MADV_WILLNEED"):
+            self.map.madvise(mmap.MADV_WILLNEED, first, end - first)
+            return
+        for offset in range(first, end, mmap.PAGESIZE):
+            self.map[offset]
+
+    def frameCount(self):
+        """Get the total number of frames."""
+        return len(self.offsets)
+
+    def close(self):
+        """Unmap and close the file."""
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # a frame slice is still in flight; the mapping goes with it
+        self.file.close()
+
+
+class MediaStore:
+    """Reference-counted table of shared MediaFiles keyed by filename."""
+
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, filename):
+        """Return the shared MediaFile for filename, mapping it on first use."""
+        with self.lock:
+            media = self.files.get(filename)
+            if media is None:
+                media = MediaFile(filename)
+                self.files[filename] = media
+            media.refs += 1
+            return media
+
+    def release(self, media):
+        """Drop one reference, unmapping the file when the last session leaves."""
+        with self.lock:
+            media.refs -= 1
+            if media.refs > 0:
+                return
+            if self.files.get(media.filename) is media:
+                del self.files[media.filename]
+        media.close()
+
+    def openFiles(self):
+        """Return {filename: reference count} for every mapped file."""
+        with self.lock:
+            return {name: media.refs for name, media in self.files.items()}
+
+
+mediaStore = MediaStore()
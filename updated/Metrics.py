@@ -0,0 +1,206 @@
+"""Counters, gauges and histograms, served in the Prometheus text format.
+
+Metrics live in one process-wide registry. Hot paths update them under a
+short lock; gauges that mirror state elsewhere (such as sessions by state)
+are computed from a callback when /metrics is scraped.
+"""
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def formatLabels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, escapeLabel(value)) for name, value in pairs) + "}"
+
+
+def escapeLabel(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        for suffix, names, values, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, formatLabels(self.labels, names, values),
+                                        formatValue(value)))
+        return lines
+
+
+class Counter(Metric):
+    """A count that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            return [("", key, (), value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, set directly or read from collect() at scrape time.
+
+    collect returns {label values tuple: value}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.values = {}
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def samples(self):
+        if self.collect is not None:
+            values = self.collect()
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [("", key, (), value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        samples = []
+        for key, counts in sorted(values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                samples.append(("_bucket", key, [("le", formatValue(float(bound)))], total))
+            samples.append(("_sum", key, (), counts[-1]))
+            samples.append(("_count", key, (), total))
+        return samples
+
+
+class MetricsRegistry:
+    """The metrics of this process, by name."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """Add metric, or return the one already registered under its name."""
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are too frequent to log
+
+
+def serveMetrics(port, host="127.0.0.1", registry=None):
+    """Serve registry (default: the process registry) on http://host:port/metrics from a daemon thread."""
+    handler = type("Handler", (MetricsHandler,), {"registry": registry or metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+metrics = MetricsRegistry()
+
+rtspRequests = metrics.counter("rtsp_requests_total", "RTSP requests by method and reply status.",
+                               ("method", "status"))
+rtpPackets = metrics.counter("rtp_packets_sent_total", "RTP packets sent.")
+rtpBytes = metrics.counter("rtp_payload_bytes_sent_total", "RTP payload bytes sent.")
+sendErrors = metrics.counter("rtp_send_errors_total", "Frames that failed to send, by error.", ("error",))
+sendLateness = metrics.histogram("send_lateness_seconds", "How late frames were sent after their deadline.")
+rtxPackets = metrics.counter("rtx_packets_sent_total", "Packets resent on RTX streams in answer to NACKs.")
+rtxUnavailable = metrics.counter("rtx_unavailable_total",
+                                 "NACKed packets not resent: gone from the history or resent too often.")
+frameReadSeconds = metrics.histogram("frame_read_seconds", "Time the sender waited for the next frame.")
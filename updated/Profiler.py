@@ -0,0 +1,159 @@
+"""Sampling profiler that a running server can switch on for a few seconds.
+
+While active, a thread samples the stack of every other thread in the process
+every SAMPLE_INTERVAL and counts identical stacks. When the time is up the
+counts are written in the collapsed-stack format that flamegraph.pl and
+speedscope read, one "thread;outer;...;inner count" line per stack. Next to it
+goes a JSON file with the per-phase timers (frame read, packetize, send) that
+sendRtp recorded over the same window.
+
+A local client starts it with RTSP SET_PARAMETER, "profile: <seconds>"; see
+ServerWorker.setParameters. Each process profiles only its own threads, so
+with --workers the profile covers the worker that accepted the connection.
+
+Usage: python Profiler.py host port [seconds]
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005  # seconds between samples
+MAX_SECONDS = 300
+FOLDED_EXT = ".folded"
+PHASES_EXT = ".phases.json"
+
+
+def frameName(frame):
+    code = frame.f_code
+    return "%s (%s)" % (getattr(code, "co_qualname", code.co_name), os.path.basename(code.co_filename))
+
+
+def collapse(threadName, frame):
+    """Return the stack under frame as "thread;outermost;...;innermost"."""
+    names = []
+    while frame is not None:
+        names.append(frameName(frame))
+        frame = frame.f_back
+    names.append(str(threadName))
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Stack sampler for every thread in the process, plus per-phase timers.
+
+    Callers time their phases unconditionally and report them only while
+    active is set, so the timers cost one attribute check when profiling is off.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, directory=None):
+        self.interval = interval
+        self.directory = directory or tempfile.gettempdir()
+        self.active = False
+        self.path = None  # collapsed-stack file of the running or latest profile
+        self.thread = None
+        self.phases = {}  # phase -> [count, total seconds, max seconds]
+        self.lock = threading.Lock()
+
+    def start(self, seconds):
+        """Profile for seconds. Return the path the stacks will be written to.
+
+        If a profile is already running, return its path instead.
+        """
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError("profile length must be between 0 and %d seconds" % MAX_SECONDS)
+        with self.lock:
+            if self.active:
+                return self.path
+            name = "profile-%d-%s" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S"))
+            self.path = os.path.join(self.directory, name + FOLDED_EXT)
+            self.phases = {}
+            self.active = True
+            self.thread = threading.Thread(target=self.run, args=(seconds, self.path), name="profiler",
+                                           daemon=True)
+            self.thread.start()
+            return self.path
+
+    def phase(self, name, seconds):
+        """Add one timed run of phase name."""
+        with self.lock:
+            timer = self.phases.get(name)
+            if timer is None:
+                timer = self.phases[name] = [0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def run(self, seconds, path):
+        """Sampler thread: collect stacks until the time is up, then write them out."""
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    stacks[collapse(names.get(ident, ident), frame)] += 1
+            samples += 1
+            time.sleep(self.interval)
+        elapsed = time.monotonic() - started
+        with self.lock:
+            self.active = False
+            phases = {name: {"count": count, "totalSeconds": total, "meanSeconds": total / count,
+                             "maxSeconds": peak}
+                      for name, (count, total, peak) in self.phases.items()}
+        try:
+            self.dump(path, stacks, phases, samples, elapsed)
+            log.info("Profile of %.1f s (%d samples) written to %s", elapsed, samples, path)
+        except OSError as e:
+            log.error("Could not write profile %s: %s", path, e)
+
+    def dump(self, path, stacks, phases, samples, elapsed):
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+        with open(path[:-len(FOLDED_EXT)] + PHASES_EXT, "w") as f:
+            json.dump({"seconds": elapsed, "samples": samples, "interval": self.interval, "phases": phases},
+                      f, indent=2)
+
+
+profiler = SamplingProfiler()
+
+
+def main():
+    """Ask a server on this host to profile itself and print where the output goes."""
+    from Rtsp import RtspParser, formatRequest
+
+    if len(sys.argv) < 3:
+        raise SystemExit("Usage: python Profiler.py host port [seconds]")
+    host, port = sys.argv[1], int(sys.argv[2])
+    seconds = sys.argv[3] if len(sys.argv) > 3 else "10"
+    body = "profile: %s\r\n" % seconds
+    request = formatRequest("SET_PARAMETER", "*", 1, [("Content-Type", "text/parameters"),
+                                                      ("Content-Length", len(body))]) + body
+    parser = RtspParser()
+    with socket.create_connection((host, port)) as sock:
+        sock.sendall(request.encode("utf-8"))
+        replies = []
+        while not replies:
+            data = sock.recv(4096)
+            if not data:
+                raise SystemExit("server closed the connection")
+            replies = parser.feed(data)
+    reply = replies[0]
+    print(reply.startLine)
+    if reply.body:
+        print(reply.body.decode("utf-8", errors="replace").strip())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Congestion control for unicast sessions, driven by RTCP receiver reports.
+
+Each session walks a ladder of levels. Level 0 sends the original frames;
+higher levels re-encode at lower JPEG quality or resolution, then thin the
+stream to every k-th frame. Loss or jitter above a threshold steps down a
+level at most once per hold time; a run of clean reports steps back up.
+"""
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from FrameCache import FrameCache
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow, levels only thin the stream
+    Image = None
+
+# (JPEG quality, resolution divisor, send every k-th frame); quality None keeps the original
+LEVELS = (
+    (None, 1, 1),
+    (60, 1, 1),
+    (40, 1, 1),
+    (40, 1, 2),
+    (30, 2, 2),
+    (30, 2, 3),
+)
+LOSS_HIGH = 0.05  # fraction lost in a report interval that steps down
+LOSS_LOW = 0.01  # reports at or below this count as clean
+JITTER_HIGH = 0.04  # seconds of interarrival jitter that steps down
+STEP_DOWN_HOLD = 1.0  # seconds between steps down, so one burst costs one level
+STEP_UP_REPORTS = 3  # consecutive clean reports before stepping up
+BITRATE_WINDOW = 2.0  # seconds of sends the bitrate is averaged over
+HISTORY = 32  # decisions kept per session
+
+RENDITION_BUDGET = 64 << 20
+ENCODE_THREADS = 2
+ENCODE_AHEAD = 8  # frames re-encoded ahead of the one being sent
+
+
+def availableLevels():
+    """Return LEVELS, cut down to its distinct thinning steps when Pillow is missing."""
+    if Image is not None:
+        return LEVELS
+    levels = []
+    for _, _, every in LEVELS:
+        if not levels or levels[-1][2] != every:
+            levels.append((None, 1, every))
+    return tuple(levels)
+
+
+def encodeRendition(data, quality, divisor):
+    """Re-encode a JPEG frame as baseline 4:2:0 at quality, shrunk by divisor."""
+    image = Image.open(BytesIO(data))
+    if divisor > 1:
+        # RFC 2435 needs dimensions that are multiples of 8
+        size = (max(8, image.width // divisor // 8 * 8), max(8, image.height // divisor // 8 * 8))
+        image = image.resize(size, Image.BILINEAR)
+    output = BytesIO()
+    image.convert("RGB").save(output, "JPEG", quality=quality, subsampling=2)
+    return output.getvalue()
+
+
+class Renditions:
+    """Cache of re-encoded frames, filled ahead of playback by a small encoder pool.
+
+    get() never encodes on the caller's thread: a rendition that is not ready
+    yet is queued along with the frames after it, and None is returned.
+    """
+
+    def __init__(self, budget=RENDITION_BUDGET, threads=ENCODE_THREADS):
+        self.cache = FrameCache(budget)
+        self.threads = threads
+        self.pool = None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def get(self, stream, n, quality, divisor):
+        """Return frame n of stream at quality and divisor, or None if it is still being encoded."""
+        rendition = self.cache.get((stream.cacheKey, quality, divisor, n))
+        if rendition is None:
+            for step in range(ENCODE_AHEAD + 1):
+                ahead = n + step * stream.stride  # the frames trick play will ask for next
+                if 1 <= ahead <= stream.frameCount():
+                    self.schedule(stream, ahead, quality, divisor)
+        return rendition
+
+    def schedule(self, stream, n, quality, divisor):
+        key = (stream.cacheKey, quality, divisor, n)
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix="rendition")
+        self.pool.submit(self.encode, stream, key)
+
+    def encode(self, stream, key):
+        _, quality, divisor, n = key
+        try:
+            data = stream.frameAt(n)
+            if data is not None:
+                self.cache.put(key, encodeRendition(data, quality, divisor))
+        except (OSError, ValueError):
+            pass  # the stream closed, or the frame is not a JPEG Pillow can read
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+
+class RateController:
+    """Per-session quality ladder and bitrate meter."""
+
+    def __init__(self, clock=time.monotonic, renditions=None):
+        self.clock = clock
+        self.renditions = renditions
+        self.level = 0
+        self.cleanReports = 0
+        self.lastStepDown = None
+        self.frames = 0  # frames offered, for thinning
+        self.dropped = 0
+        self.sends = collections.deque()  # (time, octets)
+        self.history = collections.deque(maxlen=HISTORY)
+        self.levels = availableLevels()
+
+    def onReport(self, fractionLost, jitter):
+        """Adapt to one RTCP report block's loss fraction and jitter (seconds)."""
+        now = self.clock()
+        if fractionLost > LOSS_HIGH or jitter > JITTER_HIGH:
+            self.cleanReports = 0
+            held = self.lastStepDown is not None and now - self.lastStepDown < STEP_DOWN_HOLD
+            if self.level < len(self.levels) - 1 and not held:
+                self.lastStepDown = now
+                self.setLevel(self.level + 1, "loss {:.1%}, jitter {:.0f} ms".format(fractionLost, jitter * 1000))
+        elif fractionLost <= LOSS_LOW:
+            self.cleanReports += 1
+            if self.level > 0 and self.cleanReports >= STEP_UP_REPORTS:
+                self.cleanReports = 0
+                self.setLevel(self.level - 1, "{} clean reports".format(STEP_UP_REPORTS))
+
+    def setLevel(self, level, reason):
+        self.level = level
+        self.history.append((time.time(), level, reason))
+
+    def frame(self, stream, data):
+        """Return what to send for the stream's current frame at this level, or None to drop it."""
+        quality, divisor, every = self.levels[self.level]
+        self.frames += 1
+        if self.frames % every:
+            self.dropped += 1
+            return None
+        if quality is None or self.renditions is None:
+            return data
+        rendition = self.renditions.get(stream, stream.frameNbr(), quality, divisor)
+        if rendition is None:
+            self.dropped += 1  # sending the full-size original would only add to the congestion
+        return rendition
+
+    def recordSent(self, octets):
+        now = self.clock()
+        self.sends.append((now, octets))
+        while self.sends and now - self.sends[0][0] > BITRATE_WINDOW:
+            self.sends.popleft()
+
+    def bitrate(self):
+        """Return the send rate in bits per second over the last BITRATE_WINDOW seconds."""
+        now = self.clock()
+        octets = sum(octets for sent, octets in self.sends if now - sent <= BITRATE_WINDOW)
+        return octets * 8 / BITRATE_WINDOW
+
+    def stats(self):
+        quality, divisor, every = self.levels[self.level]
+        return {
+            "level": self.level,
+            "quality": quality,
+            "divisor": divisor,
+            "every": every,
+            "bitrate": self.bitrate(),
+            "dropped": self.dropped,
+            "decisions": list(self.history),
+        }
+
+
+renditions = Renditions()
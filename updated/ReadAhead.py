@@ -0,0 +1,147 @@
+import collections
+import logging
+import queue
+import threading
+
+READ_AHEAD_FRAMES = 48  # upcoming frames buffered per stream
+CHUNK_BYTES = 4 << 20  # largest single read
+READER_THREADS = 2
+
+log = logging.getLogger(__name__)
+
+
+class ReadAheadBuffer:
+    """Bounded queue of one stream's upcoming frames, refilled off the sending thread.
+
+    take() never touches the disk: it returns the buffered frame or None, and the
+    caller reads that one frame itself. Refills read whole chunks through
+    stream.readFrames() on a ReadAheadPool thread once the buffer is half empty.
+    """
+
+    def __init__(self, stream, depth, pool):
+        self.stream = stream
+        self.depth = depth
+        self.pool = pool
+        self.frames = collections.deque()  # (frame number, data)
+        self.nextRead = 1  # first frame not yet buffered or being read
+        self.generation = 0  # bumped by reset() so in-flight reads are discarded
+        self.busy = False
+        self.closed = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def take(self, n):
+        """Return frame n (1-based) if it is buffered, else None."""
+        with self.lock:
+            while self.frames and self.frames[0][0] < n:
+                self.frames.popleft()
+            if self.frames and self.frames[0][0] == n:
+                data = self.frames.popleft()[1]
+                self.hits += 1
+            else:
+                data = None
+                self.misses += 1
+                if self.frames or self.nextRead != n:
+                    self.restart(n + 1)  # the stream jumped; read ahead of where it is now
+            fill = self.needsFill()
+        if fill:
+            self.pool.schedule(self)
+        return data
+
+    def reset(self, n):
+        """Drop buffered frames and read ahead from frame n instead."""
+        with self.lock:
+            self.restart(n)
+            fill = self.needsFill()
+        if fill:
+            self.pool.schedule(self)
+
+    def restart(self, n):
+        # Caller holds the lock
+        self.frames.clear()
+        self.nextRead = n
+        self.generation += 1
+
+    def needsFill(self):
+        # Caller holds the lock; claims the refill when it returns True
+        if (self.busy or self.closed or len(self.frames) > self.depth // 2
+                or self.nextRead > self.stream.frameCount()):
+            return False
+        self.busy = True
+        return True
+
+    def fill(self):
+        """Read the next chunk of frames into the buffer; runs on a pool thread."""
+        with self.lock:
+            generation = self.generation
+            first = self.nextRead
+            count = self.depth - len(self.frames)
+        frames = []
+        try:
+            if count > 0:
+                frames = self.stream.readFrames(first, count)
+        except Exception:
+            if not self.closed:  # otherwise the stream was closed under us
+                log.exception("Read-ahead from frame %d failed", first)
+        finally:
+            with self.lock:
+                self.busy = False
+                current = generation == self.generation and not self.closed
+                if current:
+                    self.frames.extend(zip(range(first, first + len(frames)), frames))
+                    self.nextRead = first + len(frames)
+                # Retrying an empty read of the same frames would fail again; take() falls back to the disk
+                fill = (frames or not current) and self.needsFill()
+        if fill:
+            self.pool.schedule(self)
+
+    def close(self):
+        """Stop refilling and drop buffered frames."""
+        with self.lock:
+            self.closed = True
+            self.frames.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"buffered": len(self.frames), "hits": self.hits, "misses": self.misses}
+
+
+class ReadAheadPool:
+    """Reader threads shared by every stream's ReadAheadBuffer."""
+
+    def __init__(self, threads=READER_THREADS):
+        self.threads = threads
+        self.pending = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def attach(self, stream, depth=READ_AHEAD_FRAMES):
+        """Return a buffer that reads ahead of stream, starting at its first frame."""
+        self.start()
+        buffer = ReadAheadBuffer(stream, depth, self)
+        buffer.reset(1)
+        return buffer
+
+    def schedule(self, buffer):
+        self.pending.put(buffer)
+
+    def run(self):
+        """Reader thread main loop."""
+        while True:
+            buffer = self.pending.get()
+            try:
+                buffer.fill()
+            except Exception:
+                log.exception("Read-ahead refill failed")
+
+    def start(self):
+        """Start the reader threads once."""
+        with self.lock:
+            while len(self.workers) < self.threads:
+                thread = threading.Thread(target=self.run, daemon=True)
+                thread.start()
+                self.workers.append(thread)
+
+
+readAheadPool = ReadAheadPool()
@@ -0,0 +1,120 @@
+"""RTP retransmission (RFC 4588) requested with RTCP generic NACKs (RFC 4585).
+
+The sender keeps its recently sent packets in a ring indexed by sequence
+number. It answers a NACK by resending them on a separate RTX stream, which
+has its own SSRC and sequence numbers and payload type RTX_PAYLOAD_TYPE. Each
+RTX payload starts with the original sequence number (OSN). The receiver
+watches for gaps in the media sequence, NACKs them, and turns the RTX packets
+that come back into the packets it missed.
+"""
+import struct
+
+from RtpPacket import RtpPacket
+
+RTX_PAYLOAD_TYPE = 97
+MEDIA_PAYLOAD_TYPE = 26  # JPEG (RFC 3551)
+HISTORY_PACKETS = 512  # sent packets kept per session
+MAX_RETRANSMITS = 2  # times one packet is resent, however often it is NACKed
+MAX_GAP = 256  # a larger jump is a restart, not loss worth repairing
+MAX_MISSING = 1024  # gaps remembered while waiting for their repair
+OSN = struct.Struct("!H")
+SEQ_MOD = 1 << 16
+
+
+class RetransmitHistory:
+    """Ring of the packets a session sent most recently, by sequence number."""
+
+    def __init__(self, size=HISTORY_PACKETS):
+        self.size = size
+        self.packets = [None] * size
+        self.resends = [0] * size
+
+    def add(self, rtpPacket):
+        slot = rtpPacket.seqNum() % self.size
+        self.packets[slot] = rtpPacket
+        self.resends[slot] = 0
+
+    def retransmit(self, seq):
+        """Return packet seq if it is still held and has not been resent too often, else None."""
+        slot = seq % self.size
+        rtpPacket = self.packets[slot]
+        if rtpPacket is None or rtpPacket.seqNum() != seq or self.resends[slot] >= MAX_RETRANSMITS:
+            return None
+        self.resends[slot] += 1
+        return rtpPacket
+
+
+def makeRtx(original, seqnum, ssrc):
+    """Wrap original in an RTX packet; the payload is shared, not copied."""
+    rtx = RtpPacket()
+    rtx.encode(2, 0, 0, 0, seqnum, original.marker(), RTX_PAYLOAD_TYPE, ssrc, original.payload,
+               OSN.pack(original.seqNum()) + bytes(original.payloadHeader), original.timestamp())
+    return rtx
+
+
+def originalSeq(rtx):
+    """Return the sequence number of the packet an RTX packet repairs."""
+    return OSN.unpack_from(rtx.getPayload())[0]
+
+
+def fromRtx(rtx, ssrc, payloadType=MEDIA_PAYLOAD_TYPE):
+    """Rebuild the original media packet carried by an RTX packet."""
+    payload = rtx.getPayload()
+    rtpPacket = RtpPacket()
+    rtpPacket.encode(2, 0, 0, 0, OSN.unpack_from(payload)[0], rtx.marker(), payloadType, ssrc, payload[OSN.size:],
+                     timestamp=rtx.timestamp())
+    return rtpPacket
+
+
+class LossTracker:
+    """Receiver side: find gaps in the media sequence and count how their repairs went.
+
+    recovered counts repairs that arrived in time to be played; late counts
+    repairs whose frame had already been played out.
+    """
+
+    def __init__(self):
+        self.highest = None
+        self.missing = {}  # seq -> None, oldest first
+        self.nacked = 0
+        self.recovered = 0
+        self.late = 0
+
+    def received(self, seq):
+        """Account for media packet seq. Return the sequence numbers newly found missing."""
+        if self.highest is None:
+            self.highest = seq
+            return []
+        ahead = (seq - self.highest) % SEQ_MOD
+        if ahead == 0:
+            return []
+        if ahead >= SEQ_MOD // 2:
+            self.missing.pop(seq, None)  # reordered, not lost after all
+            return []
+        self.highest = seq
+        if ahead - 1 > MAX_GAP:
+            return []
+        gap = [(seq - offset) % SEQ_MOD for offset in range(ahead - 1, 0, -1)]
+        for missing in gap:
+            self.missing[missing] = None
+        while len(self.missing) > MAX_MISSING:
+            del self.missing[next(iter(self.missing))]
+        self.nacked += len(gap)
+        return gap
+
+    def requested(self, seq):
+        """Return True if seq was missing and not yet repaired; it no longer is."""
+        if seq in self.missing:
+            del self.missing[seq]
+            return True
+        return False
+
+    def repaired(self, inTime):
+        if inTime:
+            self.recovered += 1
+        else:
+            self.late += 1
+
+    def stats(self):
+        return {"nacked": self.nacked, "recovered": self.recovered, "late": self.late,
+                "outstanding": len(self.missing)}
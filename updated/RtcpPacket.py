@@ -0,0 +1,302 @@
+"""RTCP (RFC 3550) sender/receiver reports, SDES, BYE, generic NACK (RFC 4585) and reception statistics."""
+import struct
+from time import time
+
+SR = 200
+RR = 201
+SDES = 202
+BYE = 203
+RTPFB = 205  # transport layer feedback (RFC 4585)
+
+NACK_FMT = 1  # RTPFB format of a generic NACK
+
+SDES_CNAME = 1
+NTP_EPOCH_OFFSET = 2208988800  # seconds from 1900-01-01 to 1970-01-01
+
+COMMON_HEADER = struct.Struct("!BBH")  # V/P/count, packet type, length in 32-bit words - 1
+SENDER_INFO = struct.Struct("!IIIII")  # NTP msw, NTP lsw, RTP timestamp, packet count, octet count
+REPORT_BLOCK = struct.Struct("!IIIIII")  # SSRC, fraction/cumulative lost, ext. seq, jitter, LSR, DLSR
+NACK_ITEM = struct.Struct("!HH")  # PID, bitmask of the 16 following lost packets
+
+SEQ_MOD = 1 << 16
+TS_MOD = 1 << 32
+
+
+def ntpTime(now=None):
+    """Return the 64-bit NTP timestamp as (seconds, fraction)."""
+    if now is None:
+        now = time()
+    now += NTP_EPOCH_OFFSET
+    seconds = int(now)
+    return seconds & 0xFFFFFFFF, int((now - seconds) * (1 << 32)) & 0xFFFFFFFF
+
+
+def ntpMiddle(seconds, fraction):
+    """Return the middle 32 bits of an NTP timestamp, as used by LSR."""
+    return ((seconds & 0xFFFF) << 16) | (fraction >> 16)
+
+
+class ReportBlock:
+    """One reception report block of an SR or RR."""
+
+    def __init__(self, ssrc, fractionLost, cumulativeLost, highestSeq, jitter, lsr, dlsr):
+        self.ssrc = ssrc
+        self.fractionLost = fractionLost
+        self.cumulativeLost = cumulativeLost
+        self.highestSeq = highestSeq
+        self.jitter = jitter
+        self.lsr = lsr
+        self.dlsr = dlsr
+
+    def encode(self):
+        lost = max(-(1 << 23), min(self.cumulativeLost, (1 << 23) - 1)) & 0xFFFFFF
+        return REPORT_BLOCK.pack(self.ssrc, self.fractionLost << 24 | lost, self.highestSeq,
+                                 self.jitter, self.lsr, self.dlsr)
+
+    @classmethod
+    def decode(cls, data, offset):
+        ssrc, lost, highestSeq, jitter, lsr, dlsr = REPORT_BLOCK.unpack_from(data, offset)
+        cumulativeLost = lost & 0xFFFFFF
+        if cumulativeLost & 0x800000:
+            cumulativeLost -= 1 << 24
+        return cls(ssrc, lost >> 24, cumulativeLost, highestSeq, jitter, lsr, dlsr)
+
+
+class RtcpPacket:
+    """A single RTCP packet; a datagram carries one or more of them (a compound)."""
+
+    def __init__(self, packetType, ssrc=0):
+        self.packetType = packetType
+        self.ssrc = ssrc
+        self.senderInfo = None  # SR: (ntpSeconds, ntpFraction, rtpTimestamp, packets, octets)
+        self.reports = []
+        self.items = {}  # SDES: {item type: text} for self.ssrc
+        self.sources = []  # BYE: SSRCs leaving
+        self.reason = ""
+        self.fmt = 0  # RTPFB: feedback message type
+        self.mediaSsrc = 0  # RTPFB: the stream the feedback is about
+        self.lost = []  # NACK: sequence numbers to resend
+
+    def encode(self):
+        """Encode the packet, padded to a 32-bit boundary."""
+        if self.packetType in (SR, RR):
+            count = len(self.reports)
+            body = struct.pack("!I", self.ssrc)
+            if self.packetType == SR:
+                body += SENDER_INFO.pack(*self.senderInfo)
+            body += b"".join(block.encode() for block in self.reports)
+        elif self.packetType == SDES:
+            count = 1
+            body = struct.pack("!I", self.ssrc)
+            for itemType, text in self.items.items():
+                value = text.encode()[:255]
+                body += bytes([itemType, len(value)]) + value
+            body += b"\0" * (4 - len(body) % 4)  # null item terminator plus padding
+        elif self.packetType == BYE:
+            sources = self.sources or [self.ssrc]
+            count = len(sources)
+            body = b"".join(struct.pack("!I", source) for source in sources)
+            if self.reason:
+                value = self.reason.encode()[:255]
+                body += bytes([len(value)]) + value
+                body += b"\0" * (-len(body) % 4)
+        elif self.packetType == RTPFB and self.fmt == NACK_FMT:
+            count = self.fmt
+            body = struct.pack("!II", self.ssrc, self.mediaSsrc) + b"".join(
+                NACK_ITEM.pack(pid, blp) for pid, blp in nackItems(self.lost))
+        else:
+            raise ValueError("unsupported RTCP packet type %d" % self.packetType)
+        return COMMON_HEADER.pack(0x80 | count, self.packetType, len(body) // 4) + body
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        """Decode one packet at offset. Return (packet, offset of the next one)."""
+        first, packetType, length = COMMON_HEADER.unpack_from(data, offset)
+        if first >> 6 != 2:
+            raise ValueError("bad RTCP version")
+        count = first & 0x1F
+        end = offset + 4 + length * 4
+        if end > len(data):
+            raise ValueError("truncated RTCP packet")
+        body = offset + 4
+        packet = cls(packetType)
+        if packetType in (SR, RR):
+            packet.ssrc = struct.unpack_from("!I", data, body)[0]
+            body += 4
+            if packetType == SR:
+                packet.senderInfo = SENDER_INFO.unpack_from(data, body)
+                body += SENDER_INFO.size
+            for _ in range(count):
+                packet.reports.append(ReportBlock.decode(data, body))
+                body += REPORT_BLOCK.size
+        elif packetType == SDES and count:
+            packet.ssrc = struct.unpack_from("!I", data, body)[0]
+            body += 4
+            while body < end and data[body] != 0:
+                itemType, itemLength = data[body], data[body + 1]
+                packet.items[itemType] = bytes(data[body + 2:body + 2 + itemLength]).decode(errors="replace")
+                body += 2 + itemLength
+        elif packetType == BYE:
+            packet.sources = list(struct.unpack_from("!%dI" % count, data, body))
+            packet.ssrc = packet.sources[0] if packet.sources else 0
+            body += 4 * count
+            if body < end:
+                packet.reason = bytes(data[body + 1:body + 1 + data[body]]).decode(errors="replace")
+        elif packetType == RTPFB:
+            packet.fmt = count
+            packet.ssrc, packet.mediaSsrc = struct.unpack_from("!II", data, body)
+            if count == NACK_FMT:
+                for item in range(body + 8, end - NACK_ITEM.size + 1, NACK_ITEM.size):
+                    pid, blp = NACK_ITEM.unpack_from(data, item)
+                    packet.lost.append(pid)
+                    packet.lost += [(pid + bit + 1) % SEQ_MOD for bit in range(16) if blp >> bit & 1]
+        return packet, end
+
+
+def makeSenderReport(ssrc, rtpTimestamp, packets, octets, reports=(), now=None):
+    packet = RtcpPacket(SR, ssrc)
+    packet.senderInfo = ntpTime(now) + (rtpTimestamp & 0xFFFFFFFF, packets & 0xFFFFFFFF, octets & 0xFFFFFFFF)
+    packet.reports = list(reports)
+    return packet
+
+
+def makeReceiverReport(ssrc, reports=()):
+    packet = RtcpPacket(RR, ssrc)
+    packet.reports = list(reports)
+    return packet
+
+
+def makeSdes(ssrc, cname):
+    packet = RtcpPacket(SDES, ssrc)
+    packet.items[SDES_CNAME] = cname
+    return packet
+
+
+def makeBye(ssrc, reason=""):
+    packet = RtcpPacket(BYE, ssrc)
+    packet.reason = reason
+    return packet
+
+
+def nackItems(lost):
+    """Pack sequence numbers into generic NACK (PID, BLP) pairs."""
+    items = []
+    if not lost:
+        return items
+    first = lost[0]
+    for seq in sorted(set(lost), key=lambda seq: (seq - first) % SEQ_MOD):
+        if items:
+            pid, blp = items[-1]
+            offset = (seq - pid) % SEQ_MOD
+            if 1 <= offset <= 16:
+                items[-1] = (pid, blp | 1 << (offset - 1))
+                continue
+        items.append((seq, 0))
+    return items
+
+
+def makeNack(ssrc, mediaSsrc, lost):
+    """Ask mediaSsrc's sender to resend the packets numbered in lost."""
+    packet = RtcpPacket(RTPFB, ssrc)
+    packet.fmt = NACK_FMT
+    packet.mediaSsrc = mediaSsrc
+    packet.lost = list(lost)
+    return packet
+
+
+def encodeCompound(packets):
+    """Encode several packets into one datagram."""
+    return b"".join(packet.encode() for packet in packets)
+
+
+def decodeCompound(data):
+    """Decode every packet in a datagram, stopping at the first malformed one."""
+    packets = []
+    offset = 0
+    while offset + COMMON_HEADER.size <= len(data):
+        try:
+            packet, offset = RtcpPacket.decode(data, offset)
+        except (ValueError, struct.error):
+            break
+        packets.append(packet)
+    return packets
+
+
+class ReceptionStats:
+    """Per-source reception statistics from RFC 3550 appendix A.3 and A.8."""
+
+    def __init__(self, clockRate):
+        self.clockRate = clockRate
+        self.ssrc = 0
+        self.baseSeq = None
+        self.maxSeq = 0
+        self.cycles = 0
+        self.received = 0
+        self.expectedPrior = 0
+        self.receivedPrior = 0
+        self.transit = None
+        self.baseArrival = None
+        self.lastTimestamp = 0
+        self.mediaTime = 0  # RTP timestamp units since the first packet, unwrapped
+        self.jitter = 0.0  # timestamp units
+        self.lastSr = 0  # middle 32 bits of the last SR's NTP timestamp
+        self.lastSrArrival = None
+
+    def update(self, rtpPacket, arrival=None):
+        """Account for one received RTP packet."""
+        if arrival is None:
+            arrival = time()
+        seq = rtpPacket.seqNum()
+        self.received += 1
+        if self.baseSeq is None:
+            self.ssrc = rtpPacket.ssrc()
+            self.baseSeq = self.maxSeq = seq
+        elif (seq - self.maxSeq) % SEQ_MOD < SEQ_MOD // 2:
+            if seq < self.maxSeq:
+                self.cycles += SEQ_MOD
+            self.maxSeq = seq
+
+        # Interarrival jitter: J += (|D(i-1, i)| - J) / 16, on a clock that
+        # starts at the first packet so the 32-bit timestamp may wrap
+        timestamp = rtpPacket.timestamp()
+        if self.baseArrival is None:
+            self.baseArrival = arrival
+        else:
+            diff = (timestamp - self.lastTimestamp) % TS_MOD
+            self.mediaTime += diff - TS_MOD if diff >= TS_MOD // 2 else diff
+        self.lastTimestamp = timestamp
+        transit = (arrival - self.baseArrival) * self.clockRate - self.mediaTime
+        if self.transit is not None:
+            self.jitter += (abs(transit - self.transit) - self.jitter) / 16
+        self.transit = transit
+
+    def senderReport(self, packet, arrival=None):
+        """Remember an incoming SR so the next report can carry LSR/DLSR."""
+        seconds, fraction = packet.senderInfo[:2]
+        self.lastSr = ntpMiddle(seconds, fraction)
+        self.lastSrArrival = time() if arrival is None else arrival
+
+    def extendedMax(self):
+        return self.cycles + self.maxSeq
+
+    def lost(self):
+        if self.baseSeq is None:
+            return 0
+        return self.extendedMax() - self.baseSeq + 1 - self.received
+
+    def reportBlock(self, now=None):
+        """Build the report block for this source and start a new interval."""
+        if now is None:
+            now = time()
+        expected = self.extendedMax() - self.baseSeq + 1 if self.baseSeq is not None else 0
+        expectedInterval = expected - self.expectedPrior
+        receivedInterval = self.received - self.receivedPrior
+        self.expectedPrior = expected
+        self.receivedPrior = self.received
+        lostInterval = expectedInterval - receivedInterval
+        fraction = (lostInterval << 8) // expectedInterval if expectedInterval > 0 and lostInterval > 0 else 0
+        dlsr = 0
+        if self.lastSrArrival is not None:
+            dlsr = int((now - self.lastSrArrival) * 65536) & 0xFFFFFFFF
+        return ReportBlock(self.ssrc, min(fraction, 255), self.lost(), self.extendedMax() & 0xFFFFFFFF,
+                           int(self.jitter) & 0xFFFFFFFF, self.lastSr, dlsr)
@@ -0,0 +1,268 @@
+"""RFC 2435 JPEG-over-RTP packetization (payload type 26) and reassembly."""
+import struct
+
+DEFAULT_MTU = 1500
+IP_UDP_OVERHEAD = 28  # IPv4 + UDP headers
+RTP_HEADER_SIZE = 12
+
+MAIN_HEADER = struct.Struct("!IBBBB")  # type-specific + fragment offset, type, Q, width/8, height/8
+RESTART_HEADER = struct.Struct("!HH")  # restart interval, F/L/restart count
+QTABLE_HEADER = struct.Struct("!BBH")  # MBZ, precision, length
+
+Q_INBAND = 255  # quantization tables travel in-band with every frame
+RESTART_TYPE_FLAG = 64
+
+# Standard Huffman tables (ITU T.81 K.3), assumed by RFC 2435 receivers
+LUM_DC_CODELENS = bytes([0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0])
+LUM_DC_SYMBOLS = bytes(range(12))
+LUM_AC_CODELENS = bytes([0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7D])
+LUM_AC_SYMBOLS = bytes([
+    0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07,
+    0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xA1, 0x08, 0x23, 0x42, 0xB1, 0xC1, 0x15, 0x52, 0xD1, 0xF0,
+    0x24, 0x33, 0x62, 0x72, 0x82, 0x09, 0x0A, 0x16, 0x17, 0x18, 0x19, 0x1A, 0x25, 0x26, 0x27, 0x28,
+    0x29, 0x2A, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49,
+    0x4A, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5A, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69,
+    0x6A, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7A, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+    0x8A, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9A, 0xA2, 0xA3, 0xA4, 0xA5, 0xA6, 0xA7,
+    0xA8, 0xA9, 0xAA, 0xB2, 0xB3, 0xB4, 0xB5, 0xB6, 0xB7, 0xB8, 0xB9, 0xBA, 0xC2, 0xC3, 0xC4, 0xC5,
+    0xC6, 0xC7, 0xC8, 0xC9, 0xCA, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9, 0xDA, 0xE1, 0xE2,
+    0xE3, 0xE4, 0xE5, 0xE6, 0xE7, 0xE8, 0xE9, 0xEA, 0xF1, 0xF2, 0xF3, 0xF4, 0xF5, 0xF6, 0xF7, 0xF8,
+    0xF9, 0xFA,
+])
+CHM_DC_CODELENS = bytes([0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0])
+CHM_DC_SYMBOLS = bytes(range(12))
+CHM_AC_CODELENS = bytes([0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 0x77])
+CHM_AC_SYMBOLS = bytes([
+    0x00, 0x01, 0x02, 0x03, 0x11, 0x04, 0x05, 0x21, 0x31, 0x06, 0x12, 0x41, 0x51, 0x07, 0x61, 0x71,
+    0x13, 0x22, 0x32, 0x81, 0x08, 0x14, 0x42, 0x91, 0xA1, 0xB1, 0xC1, 0x09, 0x23, 0x33, 0x52, 0xF0,
+    0x15, 0x62, 0x72, 0xD1, 0x0A, 0x16, 0x24, 0x34, 0xE1, 0x25, 0xF1, 0x17, 0x18, 0x19, 0x1A, 0x26,
+    0x27, 0x28, 0x29, 0x2A, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48,
+    0x49, 0x4A, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5A, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68,
+    0x69, 0x6A, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7A, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87,
+    0x88, 0x89, 0x8A, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9A, 0xA2, 0xA3, 0xA4, 0xA5,
+    0xA6, 0xA7, 0xA8, 0xA9, 0xAA, 0xB2, 0xB3, 0xB4, 0xB5, 0xB6, 0xB7, 0xB8, 0xB9, 0xBA, 0xC2, 0xC3,
+    0xC4, 0xC5, 0xC6, 0xC7, 0xC8, 0xC9, 0xCA, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9, 0xDA,
+    0xE2, 0xE3, 0xE4, 0xE5, 0xE6, 0xE7, 0xE8, 0xE9, 0xEA, 0xF2, 0xF3, 0xF4, 0xF5, 0xF6, 0xF7, 0xF8,
+    0xF9, 0xFA,
+])
+STANDARD_HUFFMAN = {  # (class, id) -> (code lengths, symbols); class 0 is DC, 1 is AC
+    (0, 0): (LUM_DC_CODELENS, LUM_DC_SYMBOLS),
+    (1, 0): (LUM_AC_CODELENS, LUM_AC_SYMBOLS),
+    (0, 1): (CHM_DC_CODELENS, CHM_DC_SYMBOLS),
+    (1, 1): (CHM_AC_CODELENS, CHM_AC_SYMBOLS),
+}
+SCAN_TABLES = (0x00, 0x11, 0x11)  # DC/AC table ids of Y, Cb and Cr in the rebuilt scan header
+
+
+class JpegFrame:
+    """The fields of a baseline JFIF image that RFC 2435 carries."""
+
+    def __init__(self, jpegType, width, height, qtables, restartInterval, scan):
+        self.type = jpegType
+        self.width = width
+        self.height = height
+        self.qtables = qtables
+        self.restartInterval = restartInterval
+        self.scan = scan
+
+
+def parseJpeg(data):
+    """Split a baseline 4:2:x YCbCr JPEG into its RFC 2435 fields.
+
+    The entropy-coded scan is returned as a memoryview slice of data. Receivers
+    rebuild the headers with the standard Huffman tables, so images coded with
+    any other tables are rejected rather than sent to decode as garbage.
+    """
+    view = memoryview(data)
+    if bytes(view[:2]) != b"\xff\xd8":
+        raise ValueError("not a JPEG image")
+    tables = {}
+    components = None
+    width = height = restartInterval = 0
+    pos = 2
+    while pos + 4 <= len(view):
+        if view[pos] != 0xFF:
+            raise ValueError("bad JPEG marker at %d" % pos)
+        marker = view[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        length = view[pos + 2] << 8 | view[pos + 3]
+        segment = view[pos + 4:pos + 2 + length]
+        if marker == 0xDB:  # DQT
+            i = 0
+            while i < len(segment):
+                if segment[i] >> 4:
+                    raise ValueError("16-bit quantization tables are not supported")
+                tables[segment[i] & 0x0F] = bytes(segment[i + 1:i + 65])
+                i += 65
+        elif marker == 0xC0:  # SOF0, baseline
+            height = segment[1] << 8 | segment[2]
+            width = segment[3] << 8 | segment[4]
+            components = [tuple(segment[6 + 3 * c:9 + 3 * c]) for c in range(segment[5])]
+        elif marker in (0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            raise ValueError("only baseline JPEG is supported")
+        elif marker == 0xC4:  # DHT
+            i = 0
+            while i < len(segment):
+                key = (segment[i] >> 4, segment[i] & 0x0F)
+                codelens = bytes(segment[i + 1:i + 17])
+                symbols = bytes(segment[i + 17:i + 17 + sum(codelens)])
+                if STANDARD_HUFFMAN.get(key) != (codelens, symbols):
+                    raise ValueError("JPEG uses non-standard Huffman tables")
+                i += 17 + len(symbols)
+        elif marker == 0xDD:  # DRI
+            restartInterval = segment[0] << 8 | segment[1]
+        elif marker == 0xDA:  # SOS
+            if tuple(segment[2:2 + 2 * segment[0]:2]) != SCAN_TABLES:
+                raise ValueError("JPEG scan does not use the standard Huffman table assignment")
+            pos += 2 + length
+            break
+        pos += 2 + length
+    else:
+        raise ValueError("JPEG has no scan")
+
+    if components is None or len(components) != 3:
+        raise ValueError("only 3-component YCbCr JPEG is supported")
+    sampling = components[0][1]
+    if sampling == 0x21:
+        jpegType = 0
+    elif sampling == 0x22:
+        jpegType = 1
+    else:
+        raise ValueError("unsupported chroma subsampling 0x%02x" % sampling)
+    if width > 2040 or height > 2040 or width % 8 or height % 8:
+        raise ValueError("RFC 2435 needs dimensions that are multiples of 8 up to 2040")
+    try:
+        qtables = tables[components[0][2]] + tables[components[1][2]]
+    except KeyError:
+        raise ValueError("JPEG references a missing quantization table")
+
+    end = len(view)
+    if bytes(view[end - 2:end]) == b"\xff\xd9":
+        end -= 2
+    if restartInterval:
+        jpegType += RESTART_TYPE_FLAG
+    return JpegFrame(jpegType, width, height, qtables, restartInterval, view[pos:end])
+
+
+def packetizeJpeg(data, mtu=DEFAULT_MTU):
+    """Fragment a JPEG frame into RFC 2435 payloads.
+
+    Returns a list of (jpegHeader, scanSlice, marker) tuples; each jpegHeader
+    plus its slice fits in one RTP packet within the given path MTU.
+    """
+    frame = parseJpeg(data)
+    maxPayload = mtu - IP_UDP_OVERHEAD - RTP_HEADER_SIZE
+    restart = b""
+    if frame.restartInterval:
+        # Fragments do not align to restart intervals, so F = L = 1 and count = 0x3FFF
+        restart = RESTART_HEADER.pack(frame.restartInterval, 0xFFFF)
+    qheader = QTABLE_HEADER.pack(0, 0, len(frame.qtables)) + frame.qtables
+
+    fragments = []
+    offset = 0
+    scanLength = len(frame.scan)
+    while True:
+        header = MAIN_HEADER.pack(offset & 0xFFFFFF, frame.type, Q_INBAND,
+                                  frame.width // 8, frame.height // 8) + restart
+        if offset == 0:
+            header += qheader
+        size = min(maxPayload - len(header), scanLength - offset)
+        if size <= 0:
+            raise ValueError("MTU too small for the JPEG headers")
+        fragments.append((header, frame.scan[offset:offset + size], offset + size == scanLength))
+        offset += size
+        if offset >= scanLength:
+            return fragments
+
+
+def makeHuffmanTable(tableClass, tableId, codelens, symbols):
+    return (b"\xff\xc4" + struct.pack("!HB", 3 + len(codelens) + len(symbols), tableClass << 4 | tableId)
+            + codelens + symbols)
+
+
+def makeHeaders(jpegType, width, height, qtables, restartInterval):
+    """Rebuild the JFIF headers a decoder needs (RFC 2435 appendix B)."""
+    header = bytearray(b"\xff\xd8")
+    header += b"\xff\xdb" + struct.pack("!HB", 67, 0) + qtables[:64]
+    header += b"\xff\xdb" + struct.pack("!HB", 67, 1) + qtables[64:128]
+    if restartInterval:
+        header += b"\xff\xdd" + struct.pack("!HH", 4, restartInterval)
+    sampling = 0x21 if jpegType & 0x3F == 0 else 0x22
+    header += b"\xff\xc0" + struct.pack("!HBHHB", 17, 8, height, width, 3)
+    header += bytes([0, sampling, 0, 1, 0x11, 1, 2, 0x11, 1])
+    header += makeHuffmanTable(0, 0, LUM_DC_CODELENS, LUM_DC_SYMBOLS)
+    header += makeHuffmanTable(1, 0, LUM_AC_CODELENS, LUM_AC_SYMBOLS)
+    header += makeHuffmanTable(0, 1, CHM_DC_CODELENS, CHM_DC_SYMBOLS)
+    header += makeHuffmanTable(1, 1, CHM_AC_CODELENS, CHM_AC_SYMBOLS)
+    header += b"\xff\xda" + struct.pack("!HB", 12, 3) + bytes([0, 0x00, 1, 0x11, 2, 0x11, 0, 63, 0])
+    return header
+
+
+class JpegReassembler:
+    """Collect RFC 2435 fragments back into complete JPEG images."""
+
+    def __init__(self):
+        self.timestamp = None
+        self.fragments = {}
+        self.headers = None
+        self.end = None
+        self.complete = 0
+        self.dropped = 0
+
+    def reset(self, timestamp):
+        if self.fragments:
+            self.dropped += 1  # the previous frame never completed
+        self.timestamp = timestamp
+        self.fragments = {}
+        self.headers = None
+        self.end = None
+
+    def push(self, rtpPacket):
+        """Add one RTP packet. Return the JPEG bytes once its frame is complete."""
+        payload = rtpPacket.getPayload()
+        if len(payload) < MAIN_HEADER.size:
+            return None
+        word, jpegType, q, width, height = MAIN_HEADER.unpack_from(payload)
+        offset = word & 0xFFFFFF
+        pos = MAIN_HEADER.size
+        restartInterval = 0
+        if jpegType & RESTART_TYPE_FLAG:
+            restartInterval = RESTART_HEADER.unpack_from(payload, pos)[0]
+            pos += RESTART_HEADER.size
+
+        timestamp = rtpPacket.timestamp()
+        if timestamp != self.timestamp:
+            self.reset(timestamp)
+
+        if offset == 0:
+            if q < 128:
+                return None  # tables derived from Q are not supported; wait for the next frame
+            _, _, length = QTABLE_HEADER.unpack_from(payload, pos)
+            pos += QTABLE_HEADER.size
+            qtables = bytes(payload[pos:pos + length])
+            pos += length
+            self.headers = makeHeaders(jpegType, width * 8, height * 8, qtables, restartInterval)
+        self.fragments[offset] = payload[pos:]
+        if rtpPacket.marker():
+            self.end = offset + len(payload) - pos
+
+        if self.end is None or self.headers is None:
+            return None
+        # The frame is complete once the fragments tile the scan up to the marker packet
+        image = bytearray(self.headers)
+        expected = 0
+        for fragmentOffset in sorted(self.fragments):
+            if fragmentOffset != expected:
+                return None
+            image += self.fragments[fragmentOffset]
+            expected += len(self.fragments[fragmentOffset])
+        if expected != self.end:
+            return None
+        image += b"\xff\xd9"
+        self.fragments = {}
+        self.headers = None
+        self.end = None
+        self.complete += 1
+        return bytes(image)
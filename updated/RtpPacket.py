@@ -1,79 +1,102 @@
-import sys
+import struct
 from time import time
 
 HEADER_SIZE = 12
+HEADER = struct.Struct("!BBHII")  # V/P/X/CC, M/PT, sequence number, timestamp, SSRC
+CLOCK_RATE = 90000  # RTP media clock for video (RFC 3551), ticks per second
+
+
+def mediaTimestamp(frameNbr, fps, offset=0):
+    """Return the 90 kHz RTP timestamp of frame frameNbr at fps, wrapped to 32 bits."""
+    return (offset + round(frameNbr * CLOCK_RATE / fps)) & 0xFFFFFFFF
 
 
 class RtpPacket:
+    __slots__ = ("header", "payload", "payloadHeader", "first", "second", "seq", "ts", "source")
+
     def __init__(self):
         self.header = bytearray(HEADER_SIZE)
         self.payload = b""
+        self.payloadHeader = b""
+        self.first = self.second = self.seq = self.ts = self.source = 0
 
     def encode(
-        self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload
+        self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload,
+        payloadHeader=b"", timestamp=None
     ):
-        """Encode the RTP packet with header fields and payload."""
-        timestamp = int(time())
-        header = bytearray(HEADER_SIZE)
-
-        # Byte 0: V(2), P(1), X(1), CC(4)
-        header[0] = (version << 6) | (padding << 5) | (extension << 4) | cc
-
-        # Byte 1: M(1), PT(7)
-        header[1] = (marker << 7) | (pt & 0x7F)
-
-        # Sequence Number (16 bits)
-        header[2] = (seqnum >> 8) & 0xFF
-        header[3] = seqnum & 0xFF
+        """Encode the RTP packet with header fields and payload.
+
+        payloadHeader is a payload-format header (e.g. RFC 2435) sent ahead of
+        payload without being concatenated to it. The header is packed in place,
+        so re-encoding a packet reuses its buffer.
+        """
+        if timestamp is None:
+            timestamp = int(time() * CLOCK_RATE) & 0xFFFFFFFF
+        if not isinstance(self.header, bytearray):
+            self.header = bytearray(HEADER_SIZE)  # last decodeFrom left a read-only view
+
+        # Byte 0: V(2), P(1), X(1), CC(4); byte 1: M(1), PT(7)
+        self.first = (version << 6) | (padding << 5) | (extension << 4) | cc
+        self.second = (marker << 7) | (pt & 0x7F)
+        self.seq = seqnum & 0xFFFF
+        self.ts = timestamp & 0xFFFFFFFF
+        self.source = ssrc & 0xFFFFFFFF
+        HEADER.pack_into(self.header, 0, self.first, self.second, self.seq, self.ts, self.source)
 
-        # Timestamp (32 bits)
-        header[4] = (timestamp >> 24) & 0xFF
-        header[5] = (timestamp >> 16) & 0xFF
-        header[6] = (timestamp >> 8) & 0xFF
-        header[7] = timestamp & 0xFF
-
-        # SSRC (32 bits)
-        header[8] = (ssrc >> 24) & 0xFF
-        header[9] = (ssrc >> 16) & 0xFF
-        header[10] = (ssrc >> 8) & 0xFF
-        header[11] = ssrc & 0xFF
-
-        self.header = header
         self.payload = payload
+        self.payloadHeader = payloadHeader
 
     def decode(self, byteStream):
         """Decode RTP packet."""
+        self.first, self.second, self.seq, self.ts, self.source = HEADER.unpack_from(byteStream)
         self.header = bytearray(byteStream[:HEADER_SIZE])
         self.payload = byteStream[HEADER_SIZE:]
+        self.payloadHeader = b""
+
+    def decodeFrom(self, buffer):
+        """Decode RTP packet without copying: header and payload become views of buffer."""
+        view = memoryview(buffer)
+        self.first, self.second, self.seq, self.ts, self.source = HEADER.unpack_from(view)
+        self.header = view[:HEADER_SIZE]
+        self.payload = view[HEADER_SIZE:]
+        self.payloadHeader = b""
 
     def version(self):
         """Return RTP version."""
-        return int(self.header[0] >> 6)
+        return self.first >> 6
 
     def seqNum(self):
-        """Return sequence (frame) number."""
-        seqNum = self.header[2] << 8 | self.header[3]
-        return int(seqNum)
+        """Return sequence number."""
+        return self.seq
 
     def timestamp(self):
         """Return timestamp."""
-        timestamp = (
-            self.header[4] << 24
-            | self.header[5] << 16
-            | self.header[6] << 8
-            | self.header[7]
-        )
-        return int(timestamp)
+        return self.ts
+
+    def ssrc(self):
+        """Return synchronization source identifier."""
+        return self.source
+
+    def marker(self):
+        """Return marker bit."""
+        return self.second >> 7
 
     def payloadType(self):
         """Return payload type."""
-        pt = self.header[1] & 127
-        return int(pt)
+        return self.second & 127
 
     def getPayload(self):
         """Return payload."""
+        if self.payloadHeader:
+            return self.payloadHeader + self.payload
         return self.payload
 
     def getPacket(self):
         """Return RTP packet."""
-        return self.header + self.payload
+        return b"".join(self.getBuffers())
+
+    def getBuffers(self):
+        """Return the packet as buffers for scatter-gather sends without concatenating."""
+        if self.payloadHeader:
+            return [self.header, self.payloadHeader, self.payload]
+        return [self.header, self.payload]
@@ -0,0 +1,254 @@
+"""RTSP message parsing and header helpers shared by the client and server."""
+import re
+
+MAX_HEADER_BYTES = 16384
+MAX_BODY_BYTES = 1 << 20
+LEGACY_WAIT = 0.5  # seconds of quiet after which flush() ends a header block
+LINE_BREAK = re.compile(rb"\r?\n")
+HEADER_END = re.compile(rb"\r?\n\r?\n")
+LINE_SPLIT = re.compile(r"\r?\n")
+NEXT_REQUEST = re.compile(rb"\r?\n(?=[A-Z_]+ \S+ RTSP/\d)")  # line break before a request line
+
+
+class RtspError(ValueError):
+    """A message that cannot be framed or parsed."""
+
+
+class RtspMessage:
+    """One RTSP request or response.
+
+    Requests have method, uri and version; responses have version, status and
+    reason. Header names are looked up case-insensitively.
+    """
+
+    def __init__(self, startLine, headers, body=b""):
+        self.startLine = startLine
+        self.headers = headers  # lowercased name -> value
+        self.body = body
+        parts = startLine.split(" ", 2)
+        if startLine.startswith("RTSP/"):
+            self.method = self.uri = None
+            self.version = parts[0]
+            try:
+                self.status = int(parts[1])
+            except (IndexError, ValueError):
+                raise RtspError("bad status line: %r" % startLine)
+            self.reason = parts[2] if len(parts) > 2 else ""
+        else:
+            if len(parts) < 2:
+                raise RtspError("bad request line: %r" % startLine)
+            self.method, self.uri = parts[0], parts[1]
+            self.version = parts[2] if len(parts) > 2 else ""
+            self.status = self.reason = None
+
+    def isResponse(self):
+        return self.status is not None
+
+    def header(self, name, default=None):
+        """Return a header's value, ignoring the case of its name."""
+        return self.headers.get(name.lower(), default)
+
+    def cseq(self):
+        """Return the CSeq header as an int, or None."""
+        try:
+            return int(self.header("CSeq"))
+        except (TypeError, ValueError):
+            return None
+
+    def session(self):
+        """Return the Session header's ID without parameters such as timeout."""
+        value = self.header("Session")
+        return value.split(";")[0].strip() if value is not None else None
+
+    def sessionTimeout(self):
+        """Return the Session header's timeout parameter in seconds, or None."""
+        for param in self.header("Session", "").split(";")[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "timeout":
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+
+class RtspParser:
+    """Incremental RTSP framer: feed() bytes as they arrive, get complete messages.
+
+    Bytes are buffered across reads, so messages may be split over or share
+    TCP segments (pipelining). Header lines may end in CRLF or a bare LF, and
+    a Content-Length body is read before the message is returned.
+
+    With lenient set, a header block also ends at the next request line, for
+    peers that never send the blank line (such as the original client). The
+    last such request ends only when the reader calls flush() after the peer
+    has gone quiet for LEGACY_WAIT; where one read ends says nothing, as TCP
+    may split a request at any line.
+    """
+
+    def __init__(self, lenient=False):
+        self.lenient = lenient
+        self.buffer = bytearray()
+        self.pending = None  # (message, body length) awaiting its body
+
+    def feed(self, data):
+        """Buffer data and return every message it completes."""
+        self.buffer += data
+        messages = []
+        while True:
+            message = self.next()
+            if message is None:
+                return messages
+            messages.append(message)
+
+    def stalled(self):
+        """Return True if whole lines of a header block are buffered without its blank line."""
+        return (self.lenient and self.pending is None and self.buffer.endswith(b"\n")
+                and bool(self.buffer.strip()))
+
+    def flush(self):
+        """End a stalled header block where its data stops and return the messages that completes.
+
+        Call it once the peer has been quiet for LEGACY_WAIT.
+        """
+        if not self.stalled():
+            return []
+        return self.feed(b"\r\n")
+
+    def next(self):
+        if self.pending is None:
+            # Tolerate blank lines between messages
+            while self.buffer[:1] in (b"\r", b"\n"):
+                match = LINE_BREAK.match(self.buffer)
+                if match is None:
+                    return None  # a lone CR; its LF has not arrived yet
+                del self.buffer[:match.end()]
+            if not self.buffer:
+                return None
+            end = HEADER_END.search(self.buffer)
+            nextRequest = None
+            if self.lenient:
+                nextRequest = NEXT_REQUEST.search(self.buffer, 0, end.start() if end else len(self.buffer))
+            if nextRequest is not None:
+                block, consumed = self.buffer[:nextRequest.start()], nextRequest.end()
+            elif end is not None:
+                block, consumed = self.buffer[:end.start()], end.end()
+            else:
+                if len(self.buffer) > MAX_HEADER_BYTES:
+                    raise RtspError("header block exceeds %d bytes" % MAX_HEADER_BYTES)
+                return None
+            if consumed > MAX_HEADER_BYTES:
+                raise RtspError("header block exceeds %d bytes" % MAX_HEADER_BYTES)
+            del self.buffer[:consumed]
+            self.pending = self.parseHead(block)
+
+        message, length = self.pending
+        if length:
+            if len(self.buffer) < length:
+                return None
+            message.body = bytes(self.buffer[:length])
+            del self.buffer[:length]
+        self.pending = None
+        return message
+
+    def parseHead(self, block):
+        lines = LINE_SPLIT.split(bytes(block).decode("utf-8", errors="replace"))
+        startLine = lines[0].strip()
+        headers = {}
+        name = None
+        for line in lines[1:]:
+            if line[:1] in (" ", "\t") and name is not None:
+                headers[name] += " " + line.strip()  # folded continuation line
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise RtspError("bad header line: %r" % line)
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = headers[name] + ", " + value if name in headers else value
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise RtspError("bad Content-Length: %r" % headers["content-length"])
+        if not 0 <= length <= MAX_BODY_BYTES:
+            raise RtspError("Content-Length %d out of range" % length)
+        return RtspMessage(startLine, headers), length
+
+
+def formatRequest(method, uri, cseq, headers=()):
+    """Return a request as the client sends it: LF line ends, then a blank line.
+
+    headers is a sequence of (name, value) pairs, sent in order after CSeq.
+    """
+    lines = ["%s %s RTSP/1.0" % (method, uri), "CSeq: %d" % cseq]
+    lines += ["%s: %s" % (name, value) for name, value in headers]
+    return "\n".join(lines) + "\n\n"
+
+
+def parseTransport(header):
+    """Return the parameters of a Transport header as {name: value}.
+
+    Accepts the whole header line or just its value. Flags such as "unicast"
+    or "multicast" map to True; names are lowercased.
+    """
+    value = header.split(":", 1)[1] if header.lower().startswith("transport:") else header
+    params = {}
+    for param in value.split(";"):
+        name, sep, setting = param.strip().partition("=")
+        if name:
+            params[name.strip().lower()] = setting.strip() if sep else True
+    return params
+
+
+def portRange(value):
+    """Parse "a" or "a-b" into (a, b), where b defaults to a + 1."""
+    ports = str(value).split("-")
+    first = int(ports[0])
+    return first, int(ports[1]) if len(ports) > 1 else first + 1
+
+
+def parseNpt(value):
+    """Parse a normal play time ("12.5" or "0:00:12.5") into seconds; "now" gives None."""
+    value = value.strip()
+    if value == "now":
+        return None
+    try:
+        seconds = 0.0
+        for part in value.split(":"):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise RtspError("bad npt time: %r" % value)
+    if seconds < 0:
+        raise RtspError("bad npt time: %r" % value)
+    return seconds
+
+
+def parseRange(header):
+    """Parse a Range header value such as "npt=10-" or "npt=5-20" into (start, end).
+
+    Either bound may be None: an open end, an omitted start or "now".
+    """
+    if header is None:
+        return None, None
+    unit, sep, span = header.split(";")[0].strip().partition("=")
+    if unit.strip().lower() != "npt" or "-" not in span:
+        raise RtspError("unsupported Range: %r" % header)
+    first, _, last = span.partition("-")
+    start = parseNpt(first) if first.strip() else None
+    end = parseNpt(last) if last.strip() else None
+    if start is not None and end is not None and end < start:
+        raise RtspError("Range ends before it starts: %r" % header)
+    return start, end
+
+
+def parseScale(header):
+    """Parse a Scale header value; a missing header means normal speed."""
+    if header is None:
+        return 1.0
+    try:
+        scale = float(header)
+    except ValueError:
+        raise RtspError("bad Scale: %r" % header)
+    if scale == 0 or scale != scale or abs(scale) == float("inf"):
+        raise RtspError("bad Scale: %r" % header)
+    return scale
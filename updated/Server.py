@@ -1,22 +1,112 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
 import socket
-import sys
+import threading
+import time
 
+from Broadcast import Channel
+from FrameCache import frameCache
+from Log import configureLogging
+from Metrics import serveMetrics
+from Profiler import profiler
 from ServerWorker import ServerWorker
+from SessionRegistry import sessionRegistry
+from VideoStream import VideoStream
+
+STATUS_INTERVAL = 1.0  # seconds between worker status reports
+
+log = logging.getLogger(__name__)
 
 
 class Server:
     def main(self):
-        try:
-            SERVER_PORT = int(sys.argv[1])
-        except (IndexError, ValueError):
-            print("[Usage: Server.py Server_port]\n")
-            sys.exit(1)
+        parser = argparse.ArgumentParser(usage="Server.py Server_port [--async] [--workers N] [--mtu BYTES] [--gso] "
+                                               "[--multicast-group ADDR] [--multicast-port N] [--multicast-ttl N] "
+                                               "[--session-timeout SECONDS] [--read-ahead FRAMES] [--cache-mb MB] [--no-adapt] "
+                                               "[--metrics-port N] [--log-level LEVEL] [--profile-dir DIR] [--rtx-history PACKETS]")
+        parser.add_argument("port", type=int)
+        parser.add_argument("--async", dest="useAsync", action="store_true",
+                            help="serve all sessions from one asyncio event loop")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="pre-fork N worker processes sharing the port via SO_REUSEPORT")
+        parser.add_argument("--mtu", type=int, default=ServerWorker.mtu,
+                            help="path MTU that RTP packets must fit in (default %(default)s)")
+        parser.add_argument("--gso", action="store_true",
+                            help="coalesce each frame's RTP packets into UDP GSO super-packets; fewer syscalls, "
+                                 "but every payload is copied once")
+        parser.add_argument("--no-adapt", dest="adaptive", action="store_false",
+                            help="always send every frame at full quality, whatever receivers report")
+        parser.add_argument("--multicast-group",
+                            help="send broadcast channels to this multicast group instead of to each viewer")
+        parser.add_argument("--multicast-port", type=int, default=Channel.multicastPort,
+                            help="first multicast group port, one even port per channel (default %(default)s)")
+        parser.add_argument("--multicast-ttl", type=int, default=Channel.multicastTtl,
+                            help="hop limit for multicast packets (default %(default)s)")
+        parser.add_argument("--session-timeout", type=int, default=sessionRegistry.timeout,
+                            help="free sessions silent for this many seconds (default %(default)s)")
+        parser.add_argument("--read-ahead", type=int, default=VideoStream.readAheadFrames,
+                            help="frames each stream reads ahead off the sending thread, 0 to disable "
+                                 "(default %(default)s)")
+        parser.add_argument("--cache-mb", type=int, default=0,
+                            help="read movies through a shared frame cache of this many MB "
+                                 "instead of mapping each file into memory")
+        parser.add_argument("--metrics-port", type=int, default=0,
+                            help="serve /metrics on this localhost port; pre-forked workers use the "
+                                 "ports above it, one each")
+        parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                            help="DEBUG also logs every RTSP request (default %(default)s)")
+        parser.add_argument("--rtx-history", type=int, default=ServerWorker.rtxHistory,
+                            help="sent packets kept per session to answer NACKs, 0 to disable retransmission "
+                                 "(default %(default)s)")
+        parser.add_argument("--profile-dir", default=profiler.directory,
+                            help="where profiles started with SET_PARAMETER are written (default %(default)s)")
+        args = parser.parse_args()
+        configureLogging(args.log_level)
+        profiler.directory = args.profile_dir
+        ServerWorker.mtu = args.mtu
+        ServerWorker.gso = args.gso
+        ServerWorker.adaptive = args.adaptive
+        ServerWorker.rtxHistory = args.rtx_history
+        Channel.multicastGroup = args.multicast_group
+        Channel.multicastPort = args.multicast_port
+        Channel.multicastTtl = args.multicast_ttl
+        sessionRegistry.timeout = args.session_timeout
+        VideoStream.readAheadFrames = args.read_ahead
+        if args.cache_mb > 0:
+            frameCache.resize(args.cache_mb << 20)
+            ServerWorker.store = None
+        SERVER_PORT = args.port
+
+        if args.workers > 1:
+            self.runWorkers(SERVER_PORT, args.workers, args.useAsync, args.metrics_port)
+        else:
+            if args.metrics_port:
+                serveMetrics(args.metrics_port)
+            threading.Thread(target=reportStatus, daemon=True).start()
+            self.serve(self.listen(SERVER_PORT), args.useAsync)
 
+    def listen(self, port, reusePort=False):
+        """Open the RTSP listening socket."""
         rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        rtspSocket.bind(("", SERVER_PORT))
-        rtspSocket.listen(5)
+        if reusePort:
+            # Every worker binds its own socket; the kernel spreads connections across them
+            rtspSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        rtspSocket.bind(("", port))
+        rtspSocket.listen(128 if reusePort else 5)
+        return rtspSocket
 
-        print(f"RTSP Server listening on port {SERVER_PORT}...")
+    def serve(self, rtspSocket, useAsync=False):
+        """Accept RTSP clients on rtspSocket until the process exits."""
+        port = rtspSocket.getsockname()[1]
+        if useAsync:
+            from AsyncServer import AsyncServer
+            AsyncServer(port, rtspSocket).main()
+            return
+
+        log.info("RTSP Server listening on port %s", port)
 
         # Receive client info (address,port) through RTSP/TCP session
         while True:
@@ -24,10 +114,85 @@ class Server:
 
             clientInfo = {"rtspSocket": (clientSocket, clientAddress)}
 
-            print(f"Client connected: {clientAddress}")
+            log.info("Client connected: %s", clientAddress)
 
             ServerWorker(clientInfo).run()
 
+    def runWorkers(self, port, count, useAsync, metricsPort=0):
+        """Pre-fork count workers on a shared port and aggregate their status."""
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise SystemExit("--workers needs SO_REUSEPORT, which this platform lacks")
+
+        ctx = multiprocessing.get_context("fork")
+        statusQueue = ctx.Queue()
+        workers = {}
+        status = {}
+
+        def spawn(index):
+            workerMetricsPort = metricsPort + 1 + index if metricsPort else 0
+            process = ctx.Process(target=workerMain, args=(self, port, useAsync, statusQueue, workerMetricsPort),
+                                  daemon=True)
+            process.start()
+            workers[index] = process
+
+        for index in range(count):
+            spawn(index)
+        log.info("RTSP Server pre-forked %d workers on port %s", count, port)
+
+        lastReport = None
+        while True:
+            try:
+                report = statusQueue.get(timeout=STATUS_INTERVAL)
+                status[report["pid"]] = report
+            except queue.Empty:
+                pass
+
+            for index, process in list(workers.items()):
+                if not process.is_alive():
+                    log.warning("Worker %s exited (%s), restarting", process.pid, process.exitcode)
+                    status.pop(process.pid, None)
+                    spawn(index)
+
+            totals = (
+                len(status),
+                sum(report["sessions"] for report in status.values()),
+                sum(report["playing"] for report in status.values()),
+                sum(report["reaped"] for report in status.values()),
+                sum(report["threads"] for report in status.values()),
+                sum(report["fds"] or 0 for report in status.values()),
+                sum(report["cacheHits"] for report in status.values()),
+                sum(report["cacheMisses"] for report in status.values()),
+            )
+            if totals != lastReport:
+                log.info("Workers: %d | sessions: %d | playing: %d | reaped: %d | threads: %d | fds: %d | "
+                         "cache hits: %d | misses: %d", *totals)
+                lastReport = totals
+
+
+def reportStatus():
+    """Log this process's session and resource counts whenever they change."""
+    lastReport = None
+    while True:
+        counts = ServerWorker.sessionCounts()
+        if counts != lastReport:
+            log.info("Sessions: %(sessions)s | playing: %(playing)s | reaped: %(reaped)s | threads: %(threads)s | "
+                     "fds: %(fds)s | cache hits: %(cacheHits)s | misses: %(cacheMisses)s", counts)
+            lastReport = counts
+        time.sleep(STATUS_INTERVAL)
+
+
+def workerMain(server, port, useAsync, statusQueue, metricsPort=0):
+    """Entry point of a pre-forked worker process."""
+    if metricsPort:
+        serveMetrics(metricsPort)
+    def report():
+        while True:
+            statusQueue.put(dict(ServerWorker.sessionCounts(), pid=os.getpid(), time=time.time()))
+            time.sleep(STATUS_INTERVAL)
+
+    threading.Thread(target=report, daemon=True).start()
+    server.serve(server.listen(port, reusePort=True), useAsync)
+
 
 if __name__ == "__main__":
     Server().main()
@@ -1,9 +1,46 @@
+import ipaddress
+import logging
 import socket
 import sys
 import threading
-from random import randint
-from RtpPacket import RtpPacket
+from random import getrandbits
+from time import perf_counter, time
+from RtpPacket import CLOCK_RATE, RtpPacket, mediaTimestamp
+from RtcpPacket import BYE, NACK_FMT, RR, RTPFB, SR, decodeCompound, encodeCompound, makeBye, makeSdes, makeSenderReport, ntpMiddle, ntpTime
+from RtpJpeg import DEFAULT_MTU, packetizeJpeg
 from VideoStream import VideoStream
+from MediaStore import mediaStore
+from FrameCache import frameCache
+from FrameScheduler import frameScheduler
+from UdpBatch import UdpBatchSender
+from Rtsp import LEGACY_WAIT, RtspError, RtspParser, parseRange, parseScale, parseTransport, portRange
+from SessionRegistry import sessionRegistry
+from RateControl import RateController, renditions
+from Metrics import frameReadSeconds, metrics, rtpBytes, rtpPackets, rtspRequests, rtxPackets, rtxUnavailable, sendErrors
+from Retransmit import HISTORY_PACKETS, MEDIA_PAYLOAD_TYPE, RTX_PAYLOAD_TYPE, RetransmitHistory, makeRtx
+from Profiler import profiler
+
+REPORT_INTERVAL = 1.0  # seconds between RTCP sender reports
+RECV_SIZE = 4096
+
+log = logging.getLogger(__name__)
+
+
+def bindPortPair():
+    """Bind UDP sockets on an even port and the odd port above it (RTP, RTCP)."""
+    for _ in range(32):
+        rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rtpSocket.bind(("", 0))
+        port = rtpSocket.getsockname()[1]
+        if port % 2 == 0:
+            rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                rtcpSocket.bind(("", port + 1))
+                return rtpSocket, rtcpSocket
+            except OSError:
+                rtcpSocket.close()
+        rtpSocket.close()
+    raise OSError("no free RTP/RTCP port pair")
 
 class ServerWorker:
     SETUP = "SETUP"
@@ -11,6 +48,10 @@ class ServerWorker:
     PAUSE = "PAUSE"
     TEARDOWN = "TEARDOWN"
     DESCRIBE = "DESCRIBE"
+    OPTIONS = "OPTIONS"
+    GET_PARAMETER = "GET_PARAMETER"
+    SET_PARAMETER = "SET_PARAMETER"
+    METHODS = (OPTIONS, DESCRIBE, SETUP, PLAY, PAUSE, TEARDOWN, GET_PARAMETER, SET_PARAMETER)
 
     INIT = 0
     READY = 1
@@ -20,11 +61,24 @@ class ServerWorker:
     OK_200 = 0
     FILE_NOT_FOUND_404 = 1
     CON_ERR_500 = 2
+    SESSION_NOT_FOUND_454 = 3
+    INVALID_RANGE_457 = 4
+    FORBIDDEN_403 = 5
+    PARAMETER_NOT_UNDERSTOOD_451 = 6
+    STATUS = {OK_200: 200, FILE_NOT_FOUND_404: 404, CON_ERR_500: 500, SESSION_NOT_FOUND_454: 454,
+              INVALID_RANGE_457: 457, FORBIDDEN_403: 403, PARAMETER_NOT_UNDERSTOOD_451: 451}
 
     clientInfo = {}
 
+    mtu = DEFAULT_MTU
+    store = mediaStore  # map movies once per process; None reads them through the frame cache
+    adaptive = True  # adapt quality and frame rate to receiver reports
+    gso = False  # coalesce each frame's packets with UDP GSO where supported; copies every payload once
+    rtxHistory = HISTORY_PACKETS  # sent packets kept per session for NACKed retransmission; 0 disables it
+
     def __init__(self, clientInfo):
         self.clientInfo = clientInfo
+        self.streamLock = threading.Lock()  # held by the scheduler while it sends, and while the session closes
 
     def run(self):
         threading.Thread(target=self.recvRtspRequest).start()
@@ -32,59 +86,129 @@ class ServerWorker:
     def recvRtspRequest(self):
         """Receive RTSP request from the client."""
         connSocket = self.clientInfo["rtspSocket"][0]
+        parser = RtspParser(lenient=True)
         while True:
             try:
-                data = connSocket.recv(256)
-                if data:
-                    print("Data received:\n" + data.decode())
-                    self.processRtspRequest(data.decode())
+                stalled = parser.stalled()
+                # A connection that never sets up a session is dropped after the session timeout
+                connSocket.settimeout(LEGACY_WAIT if stalled else sessionRegistry.timeout)
+                try:
+                    data = connSocket.recv(RECV_SIZE)
+                except socket.timeout:
+                    if not stalled:
+                        raise
+                    # A legacy client sends no blank line: its request ends where it went quiet
+                    requests = parser.flush()
                 else:
+                    if not data:
+                        break
+                    log.debug("Data received from %s:\n%s", self.clientInfo["rtspSocket"][1],
+                              data.decode(errors="replace"))
+                    requests = parser.feed(data)
+                for request in requests:
+                    self.processRtspRequest(request)
+            except socket.timeout:
+                if "session" not in self.clientInfo:
                     break
+            except RtspError:
+                self.replyBadRequest()
+                break
             except:
                 break
+        # The client is gone; free whatever its session still holds
+        self.stopStreaming()
+        self.closeSession()
+        connSocket.close()
+
+    def processRtspRequest(self, request):
+        """Process an RTSP request (an RtspMessage) sent from the client."""
+        self.replyStatus = None
+        try:
+            self.handleRtspRequest(request)
+        finally:
+            method = request.method if request.method in self.METHODS else "other"
+            rtspRequests.inc(method=method, status=self.replyStatus or "none")
 
-    def processRtspRequest(self, data):
-        """Process RTSP request sent from the client."""
-        request = data.split("\n")
-        line1 = request[0].split(" ")
-        requestType = line1[0]
-        filename = line1[1]
-        seq = request[1].split(" ")
+    def handleRtspRequest(self, request):
+        requestType = request.method
+        filename = request.uri
+        seq = request.header("CSeq", "0")
+        sessionRegistry.touch(self)
+
+        session = request.session()
+        if session not in (None, "0") and session != str(self.clientInfo.get("session")):
+            self.replyRtsp(self.SESSION_NOT_FOUND_454, seq)
+            return
 
         if requestType == self.SETUP:
             if self.state == self.INIT:
+                transport = parseTransport(request.header("Transport", ""))
+                self.clientInfo["rtpPort"] = portRange(transport.get("client_port", "0"))[0]
+                if "multicast" in transport:
+                    self.setupBroadcast(filename, seq)
+                    return
                 try:
-                    self.clientInfo["videoStream"] = VideoStream(filename)
-                    self.state = self.READY
+                    self.clientInfo["videoStream"] = VideoStream(filename, self.store)
                 except IOError:
-                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
+                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq)
                     return
-                self.clientInfo["session"] = randint(100000, 999999)
-                self.replyRtsp(self.OK_200, seq[1])
-                self.clientInfo["rtpPort"] = request[2].split(" ")[3]
+                try:
+                    serverPort = self.openRtpPorts()
+                except OSError:
+                    self.clientInfo.pop("videoStream").close()
+                    self.replyRtsp(self.CON_ERR_500, seq)
+                    return
+                self.state = self.READY
+                # Random SSRC, initial sequence number and timestamp offset (RFC 3550 5.1)
+                self.clientInfo["ssrc"] = getrandbits(32)
+                self.clientInfo["rtpSeq"] = getrandbits(16)
+                self.clientInfo["timestampOffset"] = getrandbits(32)
+                if self.rtxHistory:
+                    self.clientInfo["rtxHistory"] = RetransmitHistory(self.rtxHistory)
+                    self.clientInfo["rtxSsrc"] = getrandbits(32)
+                    self.clientInfo["rtxSeq"] = getrandbits(16)
+                sessionRegistry.register(self)
+                if self.adaptive:
+                    self.clientInfo["rate"] = RateController(renditions=renditions)
+                clientPort = self.clientInfo["rtpPort"]
+                transport = "Transport: RTP/AVP;unicast;client_port={}-{};server_port={}-{}".format(
+                    clientPort, clientPort + 1, serverPort, serverPort + 1)
+                self.replyRtsp(self.OK_200, seq, headers=[transport])
 
         elif requestType == self.PLAY:
-            if self.state == self.READY:
+            if "channel" in self.clientInfo:
+                # A broadcast channel is live: Range and Scale do not apply
+                if self.state == self.READY:
+                    self.state = self.PLAYING
+                    self.replyRtsp(self.OK_200, seq)
+                    self.clientInfo["channel"].subscribe(self, (self.clientInfo["rtspSocket"][1][0],
+                                                                self.clientInfo["rtpPort"]))
+            elif self.state in (self.READY, self.PLAYING):
+                try:
+                    start, end = parseRange(request.header("Range"))
+                    scale = parseScale(request.header("Scale"))
+                except RtspError:
+                    self.replyRtsp(self.INVALID_RANGE_457, seq)
+                    return
+                # PLAY while playing seeks or changes speed without a PAUSE in between
+                self.stopStreaming()
+                self.position(start, end, scale)
                 self.state = self.PLAYING
-                self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                self.replyRtsp(self.OK_200, seq[1])
-                self.clientInfo["event"] = threading.Event()
-                self.clientInfo["worker"] = threading.Thread(target=self.sendRtp)
-                self.clientInfo["worker"].start()
+                self.replyRtsp(self.OK_200, seq, headers=self.playHeaders(request.uri))
+                self.startStreaming()
 
         elif requestType == self.PAUSE:
             if self.state == self.PLAYING:
                 self.state = self.READY
-                self.clientInfo["event"].set()
-                self.replyRtsp(self.OK_200, seq[1])
+                if "channel" in self.clientInfo:
+                    self.clientInfo["channel"].unsubscribe(self)
+                self.stopStreaming()
+                self.replyRtsp(self.OK_200, seq)
 
         elif requestType == self.TEARDOWN:
-            self.clientInfo["event"].set()
-            self.replyRtsp(self.OK_200, seq[1])
-            try:
-                self.clientInfo["rtpSocket"].close()
-            except:
-                pass
+            self.stopStreaming()
+            self.replyRtsp(self.OK_200, seq)
+            self.closeSession()
         
         elif requestType == self.DESCRIBE:
             # Cria o corpo SDP (Session Description Protocol)
@@ -92,53 +216,433 @@ class ServerWorker:
             sdp += "o=- " + str(self.clientInfo.get('session', 0)) + " 1 IN IP4 127.0.0.1\n"
             sdp += "s=RTSP Session\n"
             sdp += "m=video " + str(self.clientInfo.get('rtpPort', '0')) + " RTP/AVP 26\n"
+            sdp += "a=rtpmap:26 JPEG/90000\n"
             sdp += "a=mimetype:string; \"video/MJPEG\"\n"
+            if "rtxHistory" in self.clientInfo:
+                sdp += "a=rtpmap:{} rtx/90000\n".format(RTX_PAYLOAD_TYPE)
+                sdp += "a=fmtp:{} apt={}\n".format(RTX_PAYLOAD_TYPE, MEDIA_PAYLOAD_TYPE)
+            stream = self.clientInfo.get("videoStream")
+            if stream is not None:
+                sdp += "a=range:npt=0-{:.3f}\n".format(stream.duration())
+                sdp += "a=framerate:{:g}\n".format(stream.frameRate())
+                if stream.width and stream.height:
+                    sdp += "a=x-dimensions:{},{}\n".format(stream.width, stream.height)
             
-            self.replyRtsp(self.OK_200, seq[1], sdp)
+            self.replyRtsp(self.OK_200, seq, sdp)
 
-    def sendRtp(self):
-        """Send RTP packets over UDP."""
-        while True:
-            self.clientInfo["event"].wait(0.05)
-            if self.clientInfo["event"].is_set():
-                break
-            data = self.clientInfo["videoStream"].nextFrame()
-            if data:
-                frameNumber = self.clientInfo["videoStream"].frameNbr()
+        elif requestType == self.OPTIONS:
+            self.replyRtsp(self.OK_200, seq, headers=["Public: " + ", ".join(self.METHODS)])
+
+        elif requestType == self.GET_PARAMETER:
+            # No parameters are served; an empty request is the client's keep-alive
+            self.replyRtsp(self.OK_200, seq)
+
+        elif requestType == self.SET_PARAMETER:
+            self.setParameters(request, seq)
+
+    def setParameters(self, request, seq):
+        """Apply a SET_PARAMETER body of "name: value" lines. Only local clients may set anything.
+
+        profile: <seconds> runs the sampling profiler; the reply names the file it writes.
+        """
+        params = {}
+        for line in request.body.decode("utf-8", errors="replace").splitlines():
+            name, sep, value = line.partition(":")
+            if sep:
+                params[name.strip().lower()] = value.strip()
+        if not params:
+            self.replyRtsp(self.OK_200, seq)
+            return
+        try:
+            local = ipaddress.ip_address(self.clientInfo["rtspSocket"][1][0]).is_loopback
+        except ValueError:
+            local = False
+        if not local:
+            self.replyRtsp(self.FORBIDDEN_403, seq)
+            return
+        if set(params) != {"profile"}:
+            self.replyRtsp(self.PARAMETER_NOT_UNDERSTOOD_451, seq)
+            return
+        try:
+            path = profiler.start(float(params["profile"]))
+        except ValueError:
+            self.replyRtsp(self.PARAMETER_NOT_UNDERSTOOD_451, seq)
+            return
+        log.info("Profiling for %s s into %s", params["profile"], path)
+        self.replyRtsp(self.OK_200, seq, "profile: {}\n".format(path), contentType="text/parameters")
+
+    def position(self, start, end, scale):
+        """Apply a PLAY request's Range (npt seconds, None to keep going) and Scale."""
+        stream = self.clientInfo["videoStream"]
+        # Fast-forward and rewind send every stride-th frame at the normal rate;
+        # a Scale below 1 slows the frame rate down instead
+        stride = max(1, int(round(abs(scale))))
+        stream.stride = stride if scale > 0 else -stride
+        self.clientInfo["scale"] = scale
+        self.clientInfo["rangeEnd"] = end
+        if start is not None:
+            stream.seek(stream.frameForTime(start) + 1 - stream.stride)
+
+    def playRate(self, stream):
+        """Return the frames per second stream is paced at."""
+        return stream.frameRate() * abs(self.clientInfo.get("scale", 1.0)) / abs(stream.stride)
+
+    def playHeaders(self, uri):
+        """Return the Range, Scale and RTP-Info headers of a PLAY reply."""
+        stream = self.clientInfo["videoStream"]
+        first = min(max(stream.frameNbr() + stream.stride, 1), stream.frameCount())
+        end = self.clientInfo.get("rangeEnd")
+        return [
+            "Range: npt={:.3f}-{:.3f}".format(stream.frameTime(first), stream.duration() if end is None else end),
+            "Scale: {:g}".format(self.clientInfo.get("scale", 1.0)),
+            "RTP-Info: url={};seq={};rtptime={}".format(uri, self.clientInfo.get("rtpSeq", 0), self.mediaClock()),
+        ]
+
+    def setupBroadcast(self, filename, seq):
+        """SETUP a session that watches the movie's shared broadcast channel."""
+        from Broadcast import broadcaster
+        try:
+            channel = broadcaster.acquire(filename)
+        except FileNotFoundError:
+            self.replyRtsp(self.FILE_NOT_FOUND_404, seq)
+            return
+        except OSError:
+            self.replyRtsp(self.CON_ERR_500, seq)
+            return
+        self.clientInfo["channel"] = channel
+        self.clientInfo["ssrc"] = channel.ssrc()
+        self.state = self.READY
+        sessionRegistry.register(self)
+        self.replyRtsp(self.OK_200, seq, headers=[channel.transport(self.clientInfo["rtpPort"])])
+
+    def openRtpPorts(self):
+        """Bind the session's RTP/RTCP socket pair. Return the RTP port."""
+        rtpSocket, rtcpSocket = bindPortPair()
+        rtcpSocket.setblocking(False)
+        self.clientInfo["rtpSocket"] = rtpSocket
+        self.clientInfo["rtcpSocket"] = rtcpSocket
+        self.clientInfo["rtpSender"] = UdpBatchSender(rtpSocket, self.gso)
+        frameScheduler.watch(rtcpSocket, self.pollRtcp)
+        return rtpSocket.getsockname()[1]
+
+    def startStreaming(self):
+        """Start pacing RTP packets for this session."""
+        self.clientInfo["pacer"] = frameScheduler.add(self, self.playRate(self.clientInfo["videoStream"]))
+        frameScheduler.start()
+
+    def stopStreaming(self):
+        """Stop pacing, if the session is playing."""
+        if "pacer" in self.clientInfo:
+            frameScheduler.remove(self.clientInfo.pop("pacer"))
+
+    def closeSession(self):
+        """Say BYE and release the RTP/RTCP sockets and the video stream."""
+        if "channel" in self.clientInfo:
+            self.clientInfo.pop("channel").leave(self)
+        elif "session" in self.clientInfo:
+            try:
+                self.sendRtcp(encodeCompound([makeBye(self.ssrc(), "teardown")]))
+            except:
+                pass
+        if "rtcpSocket" in self.clientInfo:
+            frameScheduler.unwatch(self.clientInfo["rtcpSocket"])
+        # Waits out a frame the scheduler is sending; the pacer must not outlive the stream
+        with self.streamLock:
+            self.stopStreaming()
+            for name in ("rtpSocket", "rtcpSocket"):
                 try:
-                    address = self.clientInfo["rtspSocket"][1][0]
-                    port = int(self.clientInfo["rtpPort"])
-                    self.clientInfo["rtpSocket"].sendto(self.makeRtp(data, frameNumber), (address, port))
+                    self.clientInfo.pop(name).close()
                 except:
                     pass
+            if "videoStream" in self.clientInfo:
+                self.clientInfo.pop("videoStream").close()
+        sessionRegistry.unregister(self)
+
+    def expire(self):
+        """Free a session the client abandoned, as if it had sent TEARDOWN."""
+        log.info("Session %s expired", self.clientInfo.get("session"))
+        self.stopStreaming()
+        self.closeSession()
+        self.closeConnection()
+
+    def closeConnection(self):
+        """Shut the RTSP connection down; its reader thread then exits."""
+        try:
+            self.clientInfo["rtspSocket"][0].shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    @staticmethod
+    def sessionCounts():
+        """Return live session, thread, file descriptor and frame cache counts for this process."""
+        return dict(sessionRegistry.counts(), cacheHits=frameCache.hits, cacheMisses=frameCache.misses)
+
+    @staticmethod
+    def qosStats():
+        """Return {session ID: delivery statistics} from the latest receiver reports."""
+        workers = sessionRegistry.workers()
+        return {
+            session: dict(worker.clientInfo.get("qos", {}),
+                          packetsSent=worker.clientInfo.get("packetsSent", 0),
+                          octetsSent=worker.clientInfo.get("octetsSent", 0),
+                          rate=worker.clientInfo["rate"].stats() if "rate" in worker.clientInfo else None)
+            for session, worker in workers
+        }
+
+    def sendRtp(self):
+        """Send the next frame as RTP over UDP. Return False at end of stream.
+
+        Called by the frame scheduler each time the session's deadline comes due.
+        """
+        with self.streamLock:
+            stream = self.clientInfo.get("videoStream")
+            if stream is None:
+                return False  # the session closed while the frame was due
+            try:
+                return self.sendFrame(stream)
+            except OSError as e:
+                # The client's port is gone or the socket buffer is full; the next frame tries again
+                sendErrors.inc(error=type(e).__name__)
+                log.warning("Session %s: RTP send failed: %s", self.clientInfo.get("session"), e)
+            except Exception as e:
+                sendErrors.inc(error=type(e).__name__)
+                log.exception("Session %s: could not send frame %d", self.clientInfo.get("session"), stream.frameNbr())
+            return True
+
+    def sendFrame(self, stream):
+        """Read, packetize and send stream's next frame. Return False at end of stream."""
+        start = perf_counter()
+        data = stream.nextFrame()
+        read = perf_counter() - start
+        frameReadSeconds.observe(read)
+        if profiler.active:
+            profiler.phase("read", read)
+        if not data:
+            return False
+        end = self.clientInfo.get("rangeEnd")
+        if end is not None and stream.stride > 0 and stream.frameTime(stream.frameNbr()) > end:
+            return False
+        timestamp = self.advanceClock(stream)  # a dropped frame still takes its place on the clock
+        rate = self.clientInfo.get("rate")
+        if rate is not None:
+            data = rate.frame(stream, data)
+        if data is not None:
+            address = self.clientInfo["rtspSocket"][1][0]
+            port = int(self.clientInfo["rtpPort"])
+            start = perf_counter()
+            packets = self.makeRtp(data, stream.frameNbr(), timestamp)
+            packetized = perf_counter()
+            self.sendPackets(packets, (address, port))
+            if profiler.active:
+                profiler.phase("packetize", packetized - start)
+                profiler.phase("send", perf_counter() - packetized)
+            octets = sum(len(rtpPacket.payloadHeader) + len(rtpPacket.payload) for rtpPacket in packets)
+            self.clientInfo["packetsSent"] = self.clientInfo.get("packetsSent", 0) + len(packets)
+            self.clientInfo["octetsSent"] = self.clientInfo.get("octetsSent", 0) + octets
+            self.clientInfo["lastTimestamp"] = timestamp
+            rtpPackets.inc(len(packets))
+            rtpBytes.inc(octets)
+            history = self.clientInfo.get("rtxHistory")
+            if history is not None:
+                for rtpPacket in packets:
+                    history.add(rtpPacket)
+            if rate is not None:
+                rate.recordSent(octets)
+        if time() - self.clientInfo.get("lastReport", 0) >= REPORT_INTERVAL:
+            self.sendRtcpReport()
+        return True
+
+    def sendRtcpReport(self):
+        """Send an RTCP sender report with the session's packet and octet counts."""
+        now = time()
+        self.clientInfo["lastReport"] = now
+        report = makeSenderReport(self.ssrc(), self.clientInfo.get("lastTimestamp", 0),
+                                  self.clientInfo.get("packetsSent", 0), self.clientInfo.get("octetsSent", 0),
+                                  now=now)
+        try:
+            self.sendRtcp(encodeCompound([report, makeSdes(report.ssrc, "server@" + socket.gethostname())]))
+        except OSError:
+            pass
+
+    def sendRtcp(self, data):
+        """Send an RTCP datagram to the client's RTCP port (RTP port + 1)."""
+        address = (self.clientInfo["rtspSocket"][1][0], int(self.clientInfo["rtpPort"]) + 1)
+        self.clientInfo["rtcpSocket"].sendto(data, address)
+
+    def pollRtcp(self):
+        """Drain the RTCP packets waiting on the session's socket; the frame scheduler calls it on arrival."""
+        while True:
+            try:
+                data = self.clientInfo["rtcpSocket"].recv(2048)
+            except (BlockingIOError, KeyError, OSError):
+                return
+            self.handleRtcp(data)
+
+    def deliverRtcp(self, data):
+        """Handle RTCP that arrived on a broadcast channel's socket, on the channel's thread."""
+        self.handleRtcp(data)
+
+    def handleRtcp(self, data):
+        """Update the session's QoS statistics from an RTCP compound packet."""
+        sessionRegistry.touch(self)
+        qos = self.clientInfo.setdefault("qos", {})
+        now = time()
+        for packet in decodeCompound(data):
+            if packet.packetType in (RR, SR):
+                for block in packet.reports:
+                    qos["fractionLost"] = block.fractionLost / 256
+                    qos["cumulativeLost"] = block.cumulativeLost
+                    qos["highestSeq"] = block.highestSeq
+                    qos["jitter"] = block.jitter / CLOCK_RATE
+                    if block.lsr:
+                        # RTT = arrival - LSR - DLSR, all in 1/65536 s (RFC 3550 6.4.1)
+                        rtt = (ntpMiddle(*ntpTime(now)) - block.lsr - block.dlsr) & 0xFFFFFFFF
+                        qos["rtt"] = rtt / 65536
+                    qos["lastReport"] = now
+                    if "rate" in self.clientInfo:
+                        self.clientInfo["rate"].onReport(qos["fractionLost"], qos["jitter"])
+            elif packet.packetType == RTPFB and packet.fmt == NACK_FMT and packet.mediaSsrc == self.ssrc():
+                self.retransmit(packet.lost)
+            elif packet.packetType == BYE:
+                qos["bye"] = True
 
-    def makeRtp(self, payload, frameNbr):
-        """RTP-packetize the video data."""
+    def retransmit(self, lost):
+        """Resend NACKed packets still in the session's history on its RTX stream (RFC 4588)."""
+        history = self.clientInfo.get("rtxHistory")
+        if history is None:
+            return
+        packets = []
+        for seq in lost:
+            original = history.retransmit(seq)
+            if original is None:
+                rtxUnavailable.inc()
+                continue
+            rtxSeq = self.clientInfo["rtxSeq"]
+            self.clientInfo["rtxSeq"] = (rtxSeq + 1) & 0xFFFF
+            packets.append(makeRtx(original, rtxSeq, self.clientInfo["rtxSsrc"]))
+        if not packets:
+            return
+        try:
+            self.sendPackets(packets, (self.clientInfo["rtspSocket"][1][0], int(self.clientInfo["rtpPort"])))
+            rtxPackets.inc(len(packets))
+        except OSError as e:
+            sendErrors.inc(error=type(e).__name__)
+
+    def sendPacket(self, rtpPacket, address):
+        """Send one RTP packet to address."""
+        # Header and frame go out as two iovecs; the payload is never copied
+        self.clientInfo["rtpSocket"].sendmsg(rtpPacket.getBuffers(), [], 0, address)
+
+    def sendPackets(self, packets, address):
+        """Send a frame's RTP packets to address in as few syscalls as possible."""
+        self.clientInfo["rtpSender"].send([rtpPacket.getBuffers() for rtpPacket in packets], address)
+
+    def makeRtp(self, payload, frameNbr, timestamp=None):
+        """RTP-packetize the video data into MTU-sized RFC 2435 fragments.
+
+        The fragments carry timestamp, or frame frameNbr's media time when it is None.
+        """
         version = 2
         padding = 0
         extension = 0
         cc = 0
-        marker = 0
         pt = 26
-        seqnum = frameNbr
-        ssrc = 0
-        rtpPacket = RtpPacket()
-        rtpPacket.encode(version, padding, extension, cc, seqnum, marker, pt, ssrc, payload)
-        return rtpPacket.getPacket()
+        ssrc = self.ssrc()
+        if timestamp is None:
+            timestamp = self.rtpTimestamp(frameNbr)  # every fragment of a frame shares one timestamp
+        packets = []
+        for jpegHeader, fragment, marker in packetizeJpeg(payload, self.mtu):
+            seqnum = self.clientInfo.get("rtpSeq", 0)
+            self.clientInfo["rtpSeq"] = (seqnum + 1) & 0xFFFF
+            rtpPacket = RtpPacket()
+            rtpPacket.encode(version, padding, extension, cc, seqnum, int(marker), pt, ssrc,
+                             fragment, jpegHeader, timestamp)
+            packets.append(rtpPacket)
+        return packets
+
+    def ssrc(self):
+        """Return the session's RTP synchronization source identifier."""
+        return self.clientInfo.get("ssrc", 0)
+
+    def rtpTimestamp(self, frameNbr):
+        """Return the 90 kHz media timestamp of frame frameNbr of the session's stream."""
+        fps = self.clientInfo["videoStream"].frameRate()
+        return mediaTimestamp(frameNbr, fps, self.clientInfo.get("timestampOffset", 0))
+
+    def mediaClock(self):
+        """Return the RTP timestamp the session's next frame will carry."""
+        return (self.clientInfo.get("timestampOffset", 0) + round(self.clientInfo.get("mediaClock", 0.0))) & 0xFFFFFFFF
+
+    def advanceClock(self, stream):
+        """Return the next frame's RTP timestamp and move the clock one frame interval on.
+
+        The clock follows the pace frames are sent at, not their place in the file,
+        so timestamps keep rising across seeks and play out at the right speed.
+        """
+        timestamp = self.mediaClock()
+        self.clientInfo["mediaClock"] = self.clientInfo.get("mediaClock", 0.0) + CLOCK_RATE / self.playRate(stream)
+        return timestamp
 
-    def replyRtsp(self, code, seq, content=None):
+    def replyRtsp(self, code, seq, content=None, headers=None, contentType="application/sdp"):
         """Send RTSP reply to the client."""
-        connSocket = self.clientInfo["rtspSocket"][0]
+        self.replyStatus = self.STATUS[code]
         if code == self.OK_200:
-            reply = "RTSP/1.0 200 OK\nCSeq: {}\nSession: {}\n".format(seq, self.clientInfo.get('session', 0))
+            reply = "RTSP/1.0 200 OK\nCSeq: {}\nSession: {}\n".format(seq, self.sessionHeader())
+            for header in headers or []:
+                reply += header + "\n"
             if content:
-                reply += "Content-Type: application/sdp\n"
+                reply += "Content-Type: {}\n".format(contentType)
                 reply += "Content-Length: {}\n".format(len(content))
                 reply += "\n" + content
             else:
                 reply += "\n"
-            connSocket.send(reply.encode())
+            self.sendRtspReply(reply.encode())
         elif code == self.FILE_NOT_FOUND_404:
-            print("404 NOT FOUND")
+            log.warning("404 NOT FOUND")
+            self.sendRtspReply("RTSP/1.0 404 Not Found\nCSeq: {}\n\n".format(seq).encode())
         elif code == self.CON_ERR_500:
-            print("500 CONNECTION ERROR")
\ No newline at end of file
+            log.warning("500 CONNECTION ERROR")
+            self.sendRtspReply("RTSP/1.0 500 Internal Server Error\nCSeq: {}\n\n".format(seq).encode())
+        elif code == self.SESSION_NOT_FOUND_454:
+            log.warning("454 SESSION NOT FOUND")
+            self.sendRtspReply("RTSP/1.0 454 Session Not Found\nCSeq: {}\n\n".format(seq).encode())
+        elif code == self.INVALID_RANGE_457:
+            log.warning("457 INVALID RANGE")
+            self.sendRtspReply("RTSP/1.0 457 Invalid Range\nCSeq: {}\nSession: {}\n\n".format(
+                seq, self.sessionHeader()).encode())
+        elif code == self.FORBIDDEN_403:
+            log.warning("403 FORBIDDEN")
+            self.sendRtspReply("RTSP/1.0 403 Forbidden\nCSeq: {}\n\n".format(seq).encode())
+        elif code == self.PARAMETER_NOT_UNDERSTOOD_451:
+            log.warning("451 PARAMETER NOT UNDERSTOOD")
+            self.sendRtspReply("RTSP/1.0 451 Parameter Not Understood\nCSeq: {}\n\n".format(seq).encode())
+
+    def sessionHeader(self):
+        """Return the Session header value, advertising the timeout once a session exists."""
+        if "session" not in self.clientInfo:
+            return 0
+        return "{};timeout={}".format(self.clientInfo["session"], sessionRegistry.timeout)
+
+    def replyBadRequest(self):
+        """Answer a request that could not be parsed."""
+        rtspRequests.inc(method="invalid", status=400)
+        try:
+            self.sendRtspReply(b"RTSP/1.0 400 Bad Request\nCSeq: 0\n\n")
+        except OSError:
+            pass
+
+    def sendRtspReply(self, reply):
+        """Write an encoded RTSP reply to the client connection."""
+        self.clientInfo["rtspSocket"][0].send(reply)
+
+
+def sessionStates():
+    """Count the live sessions in each state, for the sessions gauge."""
+    counts = {("init",): 0, ("ready",): 0, ("playing",): 0}
+    names = {ServerWorker.INIT: "init", ServerWorker.READY: "ready", ServerWorker.PLAYING: "playing"}
+    for _, worker in sessionRegistry.workers():
+        counts[(names[worker.state],)] += 1
+    return counts
+
+
+metrics.gauge("rtsp_sessions", "Live sessions by state.", ("state",), collect=sessionStates)
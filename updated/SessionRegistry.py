@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from random import randint
+
+DEFAULT_TIMEOUT = 60  # seconds a session may go without RTSP or RTCP traffic (RFC 2326 12.37)
+BYE_GRACE = 5.0  # seconds allowed between an RTCP BYE and the TEARDOWN that should follow it
+REAP_INTERVAL = 1.0  # seconds between reaper passes
+
+
+def openFileCount():
+    """Return the number of file descriptors open in this process, or None if unknown."""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+class SessionRegistry:
+    """Table of the sessions alive in this process, and the reaper that frees abandoned ones.
+
+    Workers register at SETUP and unregister when the session closes. Every RTSP
+    request and RTCP packet touches the session; one that stays silent past the
+    timeout, or goes quiet after an RTCP BYE, is expired as if it had sent TEARDOWN.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.sessions = {}  # session ID -> worker
+        self.lock = threading.Lock()
+        self.thread = None
+        self.reaped = 0
+
+    def register(self, worker):
+        """Give worker a session ID no live session uses and start tracking it."""
+        with self.lock:
+            session = randint(100000000, 999999999)
+            while session in self.sessions:
+                session = randint(100000000, 999999999)
+            self.sessions[session] = worker
+        worker.clientInfo["session"] = session
+        self.touch(worker)
+        self.start()
+        return session
+
+    def unregister(self, worker):
+        """Stop tracking worker's session, if it is still the registered one."""
+        with self.lock:
+            session = worker.clientInfo.get("session")
+            if self.sessions.get(session) is worker:
+                del self.sessions[session]
+
+    def get(self, session):
+        """Return the worker serving session, or None."""
+        with self.lock:
+            return self.sessions.get(session)
+
+    def touch(self, worker):
+        """Record activity on worker's session."""
+        worker.clientInfo["lastActivity"] = self.clock()
+
+    def workers(self):
+        """Return [(session ID, worker)] for every live session."""
+        with self.lock:
+            return list(self.sessions.items())
+
+    def expired(self, now=None):
+        """Return the workers whose sessions have gone silent for too long."""
+        now = self.clock() if now is None else now
+        stale = []
+        for _, worker in self.workers():
+            idle = now - worker.clientInfo.get("lastActivity", now)
+            if idle > self.timeout or (worker.clientInfo.get("qos", {}).get("bye") and idle > BYE_GRACE):
+                stale.append(worker)
+        return stale
+
+    def reapOnce(self, now=None):
+        """Expire every stale session. Return how many were freed."""
+        stale = self.expired(now)
+        for worker in stale:
+            self.unregister(worker)
+            try:
+                worker.expire()
+            except:
+                pass
+        self.reaped += len(stale)
+        return len(stale)
+
+    def run(self):
+        """Reaper thread main loop."""
+        while True:
+            time.sleep(REAP_INTERVAL)
+            self.reapOnce()
+
+    def start(self):
+        """Start the reaper thread once."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def counts(self):
+        """Return live session, thread and file descriptor counts for this process."""
+        workers = [worker for _, worker in self.workers()]
+        return {
+            "sessions": len(workers),
+            "playing": sum(1 for worker in workers if worker.state == worker.PLAYING),
+            "reaped": self.reaped,
+            "threads": threading.active_count(),
+            "fds": openFileCount(),
+        }
+
+
+sessionRegistry = SessionRegistry()
@@ -0,0 +1,366 @@
+"""Batched UDP I/O: sendmmsg/recvmmsg through ctypes, UDP GSO, and portable fallbacks."""
+import ctypes
+import errno
+import select
+import socket
+import struct
+
+SOL_UDP = 17
+UDP_SEGMENT = 103  # linux/udp.h
+MSG_DONTWAIT = 0x40
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000
+IOV_PER_MESSAGE = 2  # joined headers, then the payload
+WORD = ctypes.sizeof(ctypes.c_size_t)
+SOCKADDR_SIZE = 28  # sizeof(struct sockaddr_in6), large enough for either family
+PyBUF_SIMPLE = 0
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+
+class Py_buffer(ctypes.Structure):
+    _fields_ = [
+        ("buf", ctypes.c_void_p),
+        ("obj", ctypes.c_void_p),
+        ("len", ctypes.c_ssize_t),
+        ("itemsize", ctypes.c_ssize_t),
+        ("readonly", ctypes.c_int),
+        ("ndim", ctypes.c_int),
+        ("format", ctypes.c_char_p),
+        ("shape", ctypes.c_void_p),
+        ("strides", ctypes.c_void_p),
+        ("suboffsets", ctypes.c_void_p),
+        ("internal", ctypes.c_void_p),
+    ]
+
+
+def loadLibc():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return None, None
+    sendmmsg = getattr(libc, "sendmmsg", None)
+    recvmmsg = getattr(libc, "recvmmsg", None)
+    if sendmmsg is not None:
+        sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        sendmmsg.restype = ctypes.c_int
+    if recvmmsg is not None:
+        recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        recvmmsg.restype = ctypes.c_int
+    return sendmmsg, recvmmsg
+
+
+def loadBufferApi():
+    """Return PyObject_GetBuffer and PyBuffer_Release, or (None, None) off CPython."""
+    pythonapi = getattr(ctypes, "pythonapi", None)
+    getBuffer = getattr(pythonapi, "PyObject_GetBuffer", None)
+    releaseBuffer = getattr(pythonapi, "PyBuffer_Release", None)
+    if getBuffer is None or releaseBuffer is None:
+        return None, None
+    getBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(Py_buffer), ctypes.c_int]
+    getBuffer.restype = ctypes.c_int
+    releaseBuffer.argtypes = [ctypes.POINTER(Py_buffer)]
+    releaseBuffer.restype = None
+    return getBuffer, releaseBuffer
+
+
+libcSendmmsg, libcRecvmmsg = loadLibc()
+getBuffer, releaseBuffer = loadBufferApi()
+
+# Word offsets into struct mmsghdr, for writing fields through a memoryview
+MMSGHDR_WORDS = ctypes.sizeof(mmsghdr) // WORD
+NAME_WORD = (mmsghdr.msg_hdr.offset + msghdr.msg_name.offset) // WORD
+IOV_WORD = (mmsghdr.msg_hdr.offset + msghdr.msg_iov.offset) // WORD
+IOVLEN_WORD = (mmsghdr.msg_hdr.offset + msghdr.msg_iovlen.offset) // WORD
+MSGLEN_INT = mmsghdr.msg_len.offset // 4
+
+
+def bufferAddress(buffer, view, ref):
+    """Return the address of a contiguous buffer's data, through the buffer protocol.
+
+    view is a scratch Py_buffer and ref a byref() of it. The address stays
+    valid while the caller holds buffer: bytes and mmap slices never move,
+    and a memoryview pins the object it exports.
+    """
+    getBuffer(buffer, ref, PyBUF_SIMPLE)  # raises BufferError if not contiguous
+    address = view.buf
+    releaseBuffer(ref)
+    return address
+
+
+def wordView(array):
+    """View a ctypes array as native machine words."""
+    return memoryview(array).cast("B").cast("N")
+
+
+def sockaddr(address):
+    """Encode a numeric (host, port) as a struct sockaddr_in / sockaddr_in6."""
+    host, port = address[0], address[1]
+    try:
+        return struct.pack("=H", socket.AF_INET) + struct.pack("!H", port) + socket.inet_aton(host) + bytes(8)
+    except OSError:
+        packed = socket.inet_pton(socket.AF_INET6, host)
+        return struct.pack("=H", socket.AF_INET6) + struct.pack("!HI", port, 0) + packed + struct.pack("=I", 0)
+
+
+class PreparedBatch:
+    """A frame's datagrams laid out once for the sender's fastest path.
+
+    The same batch can go to any number of destinations; it is valid until the
+    sender that prepared it prepares another.
+    """
+
+    __slots__ = ("messages", "runs", "keep")
+
+    def __init__(self, messages, runs=None, keep=None):
+        self.messages = messages
+        self.runs = runs  # GSO: [(first message, super-packet, control messages)]
+        self.keep = keep  # sendmmsg: buffers the iovec array points into
+
+
+class UdpBatchSender:
+    """Send many datagrams per syscall.
+
+    Uses UDP GSO when enabled and supported, else sendmmsg(2), else a sendmsg loop.
+    Buffers are passed to the kernel by address, so read-only memoryviews (e.g.
+    mmap'd frame slices) go out without being copied. Buffers must be contiguous.
+    """
+
+    def __init__(self, sock, gso=False):
+        self.sock = sock
+        self.gso = gso and self.probeGso()
+        self.useSendmmsg = libcSendmmsg is not None and getBuffer is not None
+        self.capacity = 0
+        self.name = ctypes.create_string_buffer(SOCKADDR_SIZE)
+        self.address = None
+        self.view = Py_buffer()
+        self.viewRef = ctypes.byref(self.view)
+        self.syscalls = 0
+        self.datagrams = 0
+
+    def probeGso(self):
+        try:
+            self.sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)
+            return True
+        except OSError:
+            return False
+
+    def send(self, messages, address):
+        """Send each message, a list of buffers, as one datagram to address.
+
+        On a non-blocking socket that fills up, raises BlockingIOError whose
+        characters_written is the number of messages already sent.
+        """
+        if messages:
+            self.sendPrepared(self.prepare(messages), address)
+
+    def prepare(self, messages):
+        """Lay out messages for sendPrepared(), doing the per-frame work once."""
+        if self.gso and len(messages) > 1:
+            return PreparedBatch(messages, runs=self.gsoRuns(messages))
+        if self.useSendmmsg:
+            return PreparedBatch(messages, keep=self.fillIovecs(messages))
+        return PreparedBatch(messages)
+
+    def sendPrepared(self, batch, address):
+        """Send a prepared batch to address."""
+        if batch.runs is not None:
+            for start, data, control in batch.runs:
+                try:
+                    self.sock.sendmsg([data], control, 0, address)
+                except BlockingIOError as exc:
+                    raise BlockingIOError(exc.errno, exc.strerror, start)
+                except OSError as exc:
+                    if exc.errno not in (errno.EINVAL, errno.EIO, errno.EMSGSIZE, errno.ENOPROTOOPT, errno.EOPNOTSUPP):
+                        raise
+                    self.gso = False  # no UDP GSO on this route: resend the rest plainly
+                    try:
+                        self.send(batch.messages[start:], address)
+                    except BlockingIOError as exc:
+                        raise BlockingIOError(exc.errno, exc.strerror, start + exc.characters_written)
+                    return
+                self.syscalls += 1
+        elif batch.keep is not None:
+            self.sendmmsg(len(batch.messages), address)
+        else:
+            for sent, buffers in enumerate(batch.messages):
+                try:
+                    self.sock.sendmsg(buffers, [], 0, address)
+                except BlockingIOError as exc:
+                    raise BlockingIOError(exc.errno, exc.strerror, sent)
+                self.syscalls += 1
+        self.datagrams += len(batch.messages)
+
+    def gsoRuns(self, messages):
+        """Join equal-sized datagrams into GSO super-packets.
+
+        The segments must sit back to back in one buffer, so this path copies
+        each datagram once; it pays off when syscalls dominate.
+        """
+        sizes = [sum(len(buffer) for buffer in buffers) for buffers in messages]
+        runs = []
+        start = 0
+        while start < len(messages):
+            segment = sizes[start]
+            end = start + 1
+            total = segment
+            # Only the final segment of a run may be shorter than the others
+            while (end < len(messages) and end - start < GSO_MAX_SEGMENTS
+                   and total + sizes[end] <= GSO_MAX_BYTES and sizes[end] <= segment):
+                total += sizes[end]
+                end += 1
+                if sizes[end - 1] < segment:
+                    break
+            data = b"".join(buffer for buffers in messages[start:end] for buffer in buffers)
+            control = [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", segment))] if end - start > 1 else []
+            runs.append((start, data, control))
+            start = end
+        return runs
+
+    def ensureCapacity(self, count):
+        """Grow the preallocated mmsghdr and iovec arrays to hold count messages."""
+        if count <= self.capacity:
+            return
+        self.capacity = count
+        self.headers = (mmsghdr * count)()
+        self.iovecs = (iovec * (count * IOV_PER_MESSAGE))()
+        self.headerWords = wordView(self.headers)
+        self.iovecWords = wordView(self.iovecs)
+        base = ctypes.addressof(self.iovecs)
+        nameAddress = ctypes.addressof(self.name)
+        for i in range(count):
+            self.headerWords[i * MMSGHDR_WORDS + IOV_WORD] = base + i * IOV_PER_MESSAGE * ctypes.sizeof(iovec)
+            self.headerWords[i * MMSGHDR_WORDS + NAME_WORD] = nameAddress
+            self.headers[i].msg_hdr.msg_namelen = SOCKADDR_SIZE  # 32 bits; a word store misplaces it on big-endian
+
+    def fillIovecs(self, messages):
+        """Point the iovec array at every message's buffers. Return what must stay alive."""
+        self.ensureCapacity(len(messages))
+        headerWords = self.headerWords
+        iovecWords = self.iovecWords
+        view = self.view
+        ref = self.viewRef
+        # Headers are a few bytes: copying them into one block is cheaper than looking up each address
+        heads = [b"".join(buffers[:-1]) for buffers in messages]
+        block = b"".join(heads)
+        keep = [block]  # buffers built here, alive until the batch is done with
+        address = bufferAddress(block, view, ref)
+        word = 0
+        for i, buffers in enumerate(messages):
+            count = 1
+            size = len(heads[i])
+            if size:
+                iovecWords[word] = address
+                iovecWords[word + 1] = size
+                address += size
+                count = 2
+            payload = buffers[-1]
+            if type(payload) is not bytes and type(payload) is not memoryview:
+                payload = memoryview(payload)  # pins a bytearray against resizing
+            keep.append(payload)
+            iovecWords[word + 2 * count - 2] = bufferAddress(payload, view, ref)
+            iovecWords[word + 2 * count - 1] = payload.nbytes if type(payload) is memoryview else len(payload)
+            headerWords[i * MMSGHDR_WORDS + IOVLEN_WORD] = count
+            word += 2 * IOV_PER_MESSAGE
+        return keep
+
+    def sendmmsg(self, total, address):
+        """Send the first total prepared messages with as few sendmmsg(2) calls as possible."""
+        if address != self.address:
+            ctypes.memset(self.name, 0, SOCKADDR_SIZE)
+            packed = sockaddr(address)
+            ctypes.memmove(self.name, packed, len(packed))
+            self.address = address
+        sent = 0
+        fd = self.sock.fileno()
+        base = ctypes.addressof(self.headers)
+        while sent < total:
+            result = libcSendmmsg(fd, base + sent * ctypes.sizeof(mmsghdr), total - sent, 0)
+            self.syscalls += 1
+            if result < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise BlockingIOError(err, "sendmmsg would block", sent)
+                raise OSError(err, "sendmmsg failed")
+            sent += result
+
+
+class RecvRing:
+    """Receive datagrams into a preallocated ring of buffers, many per syscall.
+
+    recv() returns memoryviews into the ring; they stay valid until the ring
+    wraps around to their slot again, so callers that hold packets longer must
+    copy them.
+    """
+
+    def __init__(self, sock, slots=256, slotSize=9216):
+        self.sock = sock
+        self.slots = slots
+        self.buffers = [bytearray(slotSize) for _ in range(slots)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.pos = 0
+        self.syscalls = 0
+        self.useRecvmmsg = libcRecvmmsg is not None
+        if self.useRecvmmsg:
+            self.iovecs = (iovec * slots)()
+            self.headers = (mmsghdr * slots)()
+            for i, buffer in enumerate(self.buffers):
+                self.iovecs[i].iov_base = ctypes.addressof((ctypes.c_char * slotSize).from_buffer(buffer))
+                self.iovecs[i].iov_len = slotSize
+                self.headers[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+                self.headers[i].msg_hdr.msg_iovlen = 1
+            self.lengths = memoryview(self.headers).cast("B").cast("I")
+
+    def recv(self):
+        """Wait up to the socket timeout for datagrams and return all that are queued.
+
+        Raises socket.timeout if none arrive in time.
+        """
+        if not self.useRecvmmsg:
+            view = self.views[self.pos]
+            nbytes = self.sock.recv_into(view)
+            self.syscalls += 1
+            self.pos = (self.pos + 1) % self.slots
+            return [view[:nbytes]]
+
+        timeout = self.sock.gettimeout()
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            raise socket.timeout("timed out")
+        fd = self.sock.fileno()
+        while True:
+            pointer = ctypes.addressof(self.headers) + self.pos * ctypes.sizeof(mmsghdr)
+            count = libcRecvmmsg(fd, pointer, self.slots - self.pos, MSG_DONTWAIT, None)
+            self.syscalls += 1
+            if count >= 0:
+                break
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise OSError(err, "recvmmsg failed")
+        start = self.pos
+        self.pos = (self.pos + count) % self.slots
+        stride = ctypes.sizeof(mmsghdr) // 4
+        return [self.views[slot][:self.lengths[slot * stride + MSGLEN_INT]] for slot in range(start, start + count)]
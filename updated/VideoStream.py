@@ -1,28 +1,238 @@
+import os
+import struct
+from bisect import bisect_right
+import threading
+from array import array
+from Container import ContainerIndex, isContainer, readIndex
+from FrameCache import frameCache
+from ReadAhead import CHUNK_BYTES, READ_AHEAD_FRAMES, readAheadPool
+
+LENGTH_SIZE = 5  # ASCII frame length prefix
+INDEX_EXT = ".idx"
+INDEX_MAGIC = b"VIDX"
+INDEX_HEADER = struct.Struct("!4sQQI")  # magic, file size, mtime (ns), frame count
+FPS_EXT = ".fps"
+DEFAULT_FRAME_RATE = 20
+
+
+def scanIndex(file):
+    """Scan the whole file once and return (offsets, lengths) of every frame."""
+    offsets = array("Q")
+    lengths = array("I")
+    file.seek(0)
+    while True:
+        data = file.read(LENGTH_SIZE)
+        if len(data) < LENGTH_SIZE:
+            break
+        try:
+            framelength = int(data)
+        except ValueError:
+            break
+        offset = file.tell()
+        if file.seek(framelength, os.SEEK_CUR) > os.fstat(file.fileno()).st_size:
+            break  # truncated last frame
+        offsets.append(offset)
+        lengths.append(framelength)
+    file.seek(0)
+    return offsets, lengths
+
+
+def loadIndex(filename, file):
+    """Load the frame index from the sidecar file, rebuilding it when stale."""
+    st = os.fstat(file.fileno())
+    try:
+        with open(filename + INDEX_EXT, "rb") as idx:
+            magic, size, mtime, count = INDEX_HEADER.unpack(idx.read(INDEX_HEADER.size))
+            if magic == INDEX_MAGIC and size == st.st_size and mtime == st.st_mtime_ns:
+                offsets = array("Q")
+                lengths = array("I")
+                offsets.fromfile(idx, count)
+                lengths.fromfile(idx, count)
+                return offsets, lengths
+    except (OSError, EOFError, struct.error):
+        pass
+
+    offsets, lengths = scanIndex(file)
+    try:
+        with open(filename + INDEX_EXT, "wb") as idx:
+            idx.write(INDEX_HEADER.pack(INDEX_MAGIC, st.st_size, st.st_mtime_ns, len(offsets)))
+            offsets.tofile(idx)
+            lengths.tofile(idx)
+    except OSError:
+        pass  # read-only media directory, keep the in-memory index
+    return offsets, lengths
+
+
+def loadFrameRate(filename):
+    """Read the frame rate from the optional <movie>.fps file."""
+    try:
+        with open(filename + FPS_EXT) as file:
+            fps = float(file.read().strip())
+    except (OSError, ValueError):
+        return DEFAULT_FRAME_RATE
+    return fps if fps > 0 else DEFAULT_FRAME_RATE
+
+
+def loadMovie(filename, file):
+    """Return the ContainerIndex of a container or legacy movie, detected from its first bytes."""
+    if isContainer(file):
+        return readIndex(file)
+    offsets, lengths = loadIndex(filename, file)
+    return ContainerIndex(loadFrameRate(filename), 0, 0, offsets, lengths, None)
+
+
 class VideoStream:
-    def __init__(self, filename):
+    readAheadFrames = READ_AHEAD_FRAMES  # 0 reads every frame on demand
+    cache = frameCache  # private handles read through it while it has a budget
+
+    def __init__(self, filename, store=None):
         self.filename = filename
-        try:
-            self.file = open(filename, "rb")
-        except:
-            raise IOError("Não foi possível abrir o arquivo de vídeo.")
+        self.store = store
+        self.media = None
+        self.file = None
+        self.fileLock = threading.Lock()  # serializes seek() + read() where pread is missing
+        if store is not None:
+            # Frames come from a shared memory mapping instead of a private handle
+            self.media = store.acquire(filename)
+            index = self.media.index
+            file = self.media.file
+        else:
+            try:
+                self.file = open(filename, "rb")
+                index = loadMovie(filename, self.file)
+            except:
+                if self.file is not None:
+                    self.file.close()
+                raise IOError("Não foi possível abrir o arquivo de vídeo.")
+            file = self.file
+        st = os.fstat(file.fileno())
+        # A file replaced on disk gets new cache keys rather than stale frames
+        self.cacheKey = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+        self.offsets, self.lengths = index.offsets, index.lengths
+        self.timestamps = index.timestamps  # None for legacy files
+        self.fps = index.fps
+        self.width, self.height = index.width, index.height  # 0 when the file does not say
         self.frameNum = 0
+        self.stride = 1  # frames advanced per nextFrame(); negative plays backwards
+        self.readAhead = readAheadPool.attach(self, self.readAheadFrames) if self.readAheadFrames else None
 
     def nextFrame(self):
         """Get next frame."""
-        data = self.file.read(5)  # framelength (first 5 bytes)
-        if data:
-            try:
-                framelength = int(data)
-            except:
-                return None
+        n = self.frameNum + self.stride
+        if not 1 <= n <= len(self.offsets):
+            return None
+        # Read-ahead follows normal play; trick play jumps straight to each frame through the index
+        data = self.readAhead.take(n) if self.readAhead is not None and self.stride == 1 else None
+        if data is None:
+            data = self.frameAt(n)
+        self.frameNum = n
+        return data
 
-            # Read the current frame
-            data = self.file.read(framelength)
-            self.frameNum += 1
-            return data
-        else:
+    def frameAt(self, n):
+        """Get frame n (1-based) without moving the stream position.
+
+        Shared streams return a memoryview into the mapping rather than bytes.
+        """
+        if not 1 <= n <= len(self.offsets):
             return None
+        if self.media is not None:
+            return self.media.frameAt(n)
+        if not self.cache.budget:
+            return self.readAt(self.offsets[n - 1], self.lengths[n - 1])
+        key = (self.cacheKey, n)
+        data = self.cache.get(key)
+        if data is None:
+            data = self.readAt(self.offsets[n - 1], self.lengths[n - 1])
+            self.cache.put(key, data)
+        return data
+
+    def readAt(self, offset, size):
+        """Read size bytes at offset of the private file handle."""
+        if hasattr(os, "pread"):
+            return os.pread(self.file.fileno(), size, offset)
+        with self.fileLock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def readFrames(self, first, count):
+        """Read up to count frames from frame first (1-based) in one large read.
+
+        The read stops short of CHUNK_BYTES, but always covers at least one frame.
+        Returns a list of memoryviews, or of bytes when frames go through the cache.
+        """
+        if not 1 <= first <= len(self.offsets):
+            return []
+        last = min(len(self.offsets), first + count - 1)
+        start = self.offsets[first - 1]
+        end = first
+        while end < last and self.offsets[end] + self.lengths[end] - start <= CHUNK_BYTES:
+            end += 1
+        size = self.offsets[end - 1] + self.lengths[end - 1] - start
+        if self.media is not None:
+            self.media.prefault(start, start + size)
+            return [self.media.frameAt(n) for n in range(first, end + 1)]
+        if not self.cache.budget:
+            chunk = memoryview(self.readAt(start, size))
+            return [chunk[self.offsets[n - 1] - start:self.offsets[n - 1] - start + self.lengths[n - 1]]
+                    for n in range(first, end + 1)]
+
+        frames = [self.cache.get((self.cacheKey, n)) for n in range(first, end + 1)]
+        missing = [n for n, data in zip(range(first, end + 1), frames) if data is None]
+        if missing:
+            # One read spanning every missing frame; cached frames inside it are reused, not replaced
+            start = self.offsets[missing[0] - 1]
+            size = self.offsets[missing[-1] - 1] + self.lengths[missing[-1] - 1] - start
+            chunk = memoryview(self.readAt(start, size))
+            for n in missing:
+                offset = self.offsets[n - 1] - start
+                data = frames[n - first] = bytes(chunk[offset:offset + self.lengths[n - 1]])
+                self.cache.put((self.cacheKey, n), data)
+        return frames
+
+    def seek(self, frameNumber):
+        """Position the stream so that the next frame returned is frameNumber + 1."""
+        self.frameNum = max(0, min(frameNumber, len(self.offsets)))
+        if self.readAhead is not None:
+            self.readAhead.reset(self.frameNum + 1)
+
+    def frameForTime(self, seconds):
+        """Return the seek() position after which the frame showing at seconds comes next."""
+        if self.timestamps is not None:
+            position = bisect_right(self.timestamps, round(seconds * 1000000)) - 1
+        else:
+            position = int(seconds * self.fps)
+        return max(0, min(position, len(self.offsets) - 1))
+
+    def duration(self):
+        """Return the playing time of the whole stream in seconds."""
+        if not self.offsets:
+            return 0.0
+        return self.frameTime(len(self.offsets)) + 1 / self.fps
+
+    def frameCount(self):
+        """Get the total number of frames."""
+        return len(self.offsets)
+
+    def frameRate(self):
+        """Get the playback rate in frames per second."""
+        return self.fps
+
+    def frameTime(self, n):
+        """Return the presentation time of frame n (1-based) in seconds."""
+        if self.timestamps is not None and 1 <= n <= len(self.timestamps):
+            return self.timestamps[n - 1] / 1000000
+        return (n - 1) / self.fps
 
     def frameNbr(self):
         """Get frame number."""
         return self.frameNum
+
+    def close(self):
+        """Close the video file or release the shared mapping."""
+        if self.readAhead is not None:
+            self.readAhead.close()
+        if self.media is not None:
+            self.store.release(self.media)
+            self.media = None
+        elif self.file is not None:
+            self.file.close()
@@ -0,0 +1,65 @@
+"""Benchmark: FrameCache hit rate on a simulated catalog, segmented LRU against plain LRU.
+
+Sessions start on files drawn from a Zipf-like popularity curve and play them
+frame by frame, interleaved as the frame scheduler would. Plain LRU is the
+same cache with no protected segment.
+
+Usage: python benchmarks/bench_framecache.py [budget_mb] [files] [sessions]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FrameCache import FrameCache  # noqa: E402
+
+FRAMES_PER_FILE = 2000
+FRAME_BYTES = 50000
+CONCURRENT = 40  # sessions playing at once
+
+
+def trace(files, sessions, seed=1):
+    """Yield (file, frame) reads of overlapping sessions."""
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(files)]
+    starts = [(rng.choices(range(files), weights)[0], rng.randrange(FRAMES_PER_FILE // 2))
+              for _ in range(sessions)]
+    playing = []
+    while starts or playing:
+        while starts and len(playing) < CONCURRENT:
+            playing.append(list(starts.pop()))
+        for session in list(playing):
+            yield session[0], session[1]
+            session[1] += 1
+            if session[1] >= FRAMES_PER_FILE:
+                playing.remove(session)
+
+
+def run(label, cache, files, sessions):
+    payload = bytes(FRAME_BYTES)
+    start = time.perf_counter()
+    reads = 0
+    for key in trace(files, sessions):
+        if cache.get(key) is None:
+            cache.put(key, payload)
+        reads += 1
+    seconds = time.perf_counter() - start
+    stats = cache.stats()
+    print("{:<16} hit rate {:>6.1%}   evictions {:>9,}   {:>10,.0f} lookups/s".format(
+        label, stats["hitRate"], stats["evictions"], reads / seconds))
+
+
+def main():
+    budget = (int(sys.argv[1]) if len(sys.argv) > 1 else 512) << 20
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    sessions = int(sys.argv[3]) if len(sys.argv) > 3 else 400
+    print("budget {} MB, {} files of {} MB, {} sessions".format(
+        budget >> 20, files, FRAMES_PER_FILE * FRAME_BYTES >> 20, sessions))
+    run("LRU", FrameCache(budget, protectedShare=0), files, sessions)
+    run("segmented LRU", FrameCache(budget), files, sessions)
+
+
+if __name__ == "__main__":
+    main()
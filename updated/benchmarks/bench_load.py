@@ -0,0 +1,343 @@
+"""Load generator: many headless RTSP/RTP sessions against a running server.
+
+Each session connects, runs a script of RTSP requests in the client's wire
+format, reassembles the RTP/JPEG stream it receives and sends RTCP receiver
+reports, as the GUI client does. Per session it records goodput, packet and
+frame loss, interarrival jitter and RTSP response latency; the report can be
+written as JSON and CSV to compare server builds.
+
+A script is a space-separated list of METHOD[:seconds] steps, where seconds
+is how long to wait after the reply, e.g. "setup play:10 pause:1 play:5 teardown".
+
+Usage: python benchmarks/bench_load.py host port file [--sessions N] [--ramp SECONDS]
+                                       [--script STEPS] [--json PATH] [--csv PATH]
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RtcpPacket import SR, ReceptionStats, decodeCompound, encodeCompound, makeReceiverReport, makeSdes  # noqa: E402
+from RtpJpeg import JpegReassembler  # noqa: E402
+from RtpPacket import CLOCK_RATE, RtpPacket  # noqa: E402
+from Rtsp import RtspError, RtspParser, formatRequest, parseTransport, portRange  # noqa: E402
+
+DEFAULT_SCRIPT = "setup play:10 teardown"
+METHODS = ("SETUP", "PLAY", "PAUSE", "TEARDOWN", "DESCRIBE", "OPTIONS", "GET_PARAMETER")
+REPLY_TIMEOUT = 10.0  # seconds to wait for an RTSP reply
+REPORT_INTERVAL = 1.0  # seconds between RTCP receiver reports
+PERCENTILES = (50, 90, 99)
+BIND_ATTEMPTS = 100
+SESSION_FIELDS = ["session", "error", "requests", "failedRequests", "packets", "packetsLost", "frames",
+                  "framesDropped", "frameLoss", "playSeconds", "goodputBps", "jitterMs",
+                  "latencyP50Ms", "latencyP90Ms", "latencyP99Ms", "latencyMaxMs"]
+
+
+def percentile(values, p):
+    """Return the nearest-rank p-th percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[rank - 1]
+
+
+def parseScript(text):
+    """Parse "setup play:10 teardown" into [(method, seconds to wait)]."""
+    steps = []
+    for step in text.split():
+        method, _, wait = step.partition(":")
+        method = method.upper()
+        if method not in METHODS:
+            raise ValueError("unknown script step %r" % step)
+        steps.append((method, float(wait) if wait else 0.0))
+    return steps
+
+
+def bindPorts(host):
+    """Return UDP sockets bound to an even RTP port and the RTCP port above it."""
+    for _ in range(BIND_ATTEMPTS):
+        rtp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            rtp.bind((host, 0))
+            port = rtp.getsockname()[1]
+            if port % 2 == 0:
+                rtcp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    rtcp.bind((host, port + 1))
+                    return rtp, rtcp
+                except OSError:
+                    rtcp.close()
+        except OSError:
+            rtp.close()
+            raise
+        rtp.close()
+    raise OSError("no free RTP/RTCP port pair")
+
+
+class Datagrams(asyncio.DatagramProtocol):
+    """Hand every datagram on a socket to a callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        self.callback(data)
+
+
+class LoadSession:
+    """One scripted session and the statistics of the stream it received."""
+
+    def __init__(self, index, host, port, fileName, script):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.fileName = fileName
+        self.script = script
+        self.cseq = 0
+        self.sessionId = None
+        self.serverRtcpPort = None
+        self.ssrc = random.getrandbits(32)
+        self.serverSsrc = None
+        self.stats = ReceptionStats(CLOCK_RATE)
+        self.reassembler = JpegReassembler()
+        self.parser = RtspParser()
+        self.latencies = {}  # method -> [seconds]
+        self.failed = 0
+        self.error = None
+        self.packets = 0
+        self.frameBytes = 0
+        self.playSeconds = 0.0
+        self.playingSince = None
+        self.rtcp = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        sockets = []
+        transports = []  # one per socket in sockets, once the event loop owns it
+        reporter = None
+        writer = None
+        try:
+            # Running out of ports or descriptors fails this session, not the whole run
+            sockets = rtpSocket, rtcpSocket = bindPorts("0.0.0.0")
+            self.rtpPort = rtpSocket.getsockname()[1]
+            rtp, _ = await loop.create_datagram_endpoint(lambda: Datagrams(self.onRtp), sock=rtpSocket)
+            transports.append(rtp)
+            self.rtcp, _ = await loop.create_datagram_endpoint(lambda: Datagrams(self.onRtcp), sock=rtcpSocket)
+            transports.append(self.rtcp)
+            reporter = loop.create_task(self.report())
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            for method, wait in self.script:
+                await self.request(reader, writer, method)
+                await asyncio.sleep(wait)
+        except (OSError, RtspError, asyncio.TimeoutError, EOFError) as e:
+            self.error = "{}: {}".format(type(e).__name__, e)
+        finally:
+            self.stopClock()
+            if reporter is not None:
+                reporter.cancel()
+            if writer is not None:
+                writer.close()
+            for transport in transports:
+                transport.close()
+            for sock in sockets[len(transports):]:
+                sock.close()
+
+    async def request(self, reader, writer, method):
+        """Send one request and wait for its reply."""
+        self.cseq += 1
+        headers = []
+        if method == "SETUP":
+            headers.append(("Transport", "RTP/UDP; client_port= {}".format(self.rtpPort)))
+        elif self.sessionId is not None:
+            headers.append(("Session", self.sessionId))
+        if method in ("PAUSE", "TEARDOWN"):
+            self.stopClock()
+        start = time.perf_counter()
+        writer.write(formatRequest(method, self.fileName, self.cseq, headers).encode("utf-8"))
+        await writer.drain()
+        reply = await asyncio.wait_for(self.reply(reader), REPLY_TIMEOUT)
+        self.latencies.setdefault(method, []).append(time.perf_counter() - start)
+        if reply.status != 200:
+            self.failed += 1
+            return
+        if method == "SETUP":
+            self.sessionId = reply.session()
+            transport = parseTransport(reply.header("Transport", ""))
+            if "server_port" in transport:
+                self.serverRtcpPort = portRange(transport["server_port"])[1]
+        elif method == "PLAY":
+            self.playingSince = time.perf_counter()
+
+    async def reply(self, reader):
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                raise EOFError("server closed the connection")
+            for message in self.parser.feed(data):
+                if message.isResponse() and message.cseq() == self.cseq:
+                    return message
+
+    def stopClock(self):
+        if self.playingSince is not None:
+            self.playSeconds += time.perf_counter() - self.playingSince
+            self.playingSince = None
+
+    def onRtp(self, data):
+        rtpPacket = RtpPacket()
+        try:
+            rtpPacket.decode(data)
+        except Exception:
+            return
+        if self.serverSsrc is None:
+            self.serverSsrc = rtpPacket.ssrc()
+        if rtpPacket.ssrc() != self.serverSsrc:
+            return
+        self.packets += 1
+        self.stats.update(rtpPacket)
+        frame = self.reassembler.push(rtpPacket)
+        if frame:
+            self.frameBytes += len(frame)
+
+    def onRtcp(self, data):
+        try:
+            for packet in decodeCompound(data):
+                if packet.packetType == SR:
+                    self.stats.senderReport(packet)
+        except ValueError:
+            pass
+
+    async def report(self):
+        """Send a receiver report every REPORT_INTERVAL once the server's RTCP port is known."""
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            if self.serverRtcpPort is None or self.stats.baseSeq is None:
+                continue
+            compound = [makeReceiverReport(self.ssrc, [self.stats.reportBlock()]),
+                        makeSdes(self.ssrc, "load%d@%s" % (self.index, socket.gethostname()))]
+            self.rtcp.sendto(encodeCompound(compound), (self.host, self.serverRtcpPort))
+
+    def result(self):
+        """Return this session's row of the report."""
+        frames = self.reassembler.complete
+        dropped = self.reassembler.dropped
+        latencies = [seconds for values in self.latencies.values() for seconds in values]
+        row = {
+            "session": self.index,
+            "error": self.error or "",
+            "requests": len(latencies),
+            "failedRequests": self.failed,
+            "packets": self.packets,
+            "packetsLost": max(0, self.stats.lost()),
+            "frames": frames,
+            "framesDropped": dropped,
+            "frameLoss": dropped / (frames + dropped) if frames + dropped else 0.0,
+            "playSeconds": self.playSeconds,
+            "goodputBps": self.frameBytes * 8 / self.playSeconds if self.playSeconds else 0.0,
+            "jitterMs": self.stats.jitter / CLOCK_RATE * 1000,
+        }
+        for p in PERCENTILES:
+            value = percentile(latencies, p)
+            row["latencyP%dMs" % p] = value * 1000 if value is not None else None
+        row["latencyMaxMs"] = max(latencies) * 1000 if latencies else None
+        row["latencyMs"] = {method: [seconds * 1000 for seconds in values]
+                            for method, values in self.latencies.items()}
+        return row
+
+
+def summarize(rows):
+    """Aggregate the per-session rows."""
+    latencies = {}
+    for row in rows:
+        for method, values in row["latencyMs"].items():
+            latencies.setdefault(method, []).extend(values)
+    allLatencies = [value for values in latencies.values() for value in values]
+    frames = sum(row["frames"] for row in rows)
+    dropped = sum(row["framesDropped"] for row in rows)
+    jitters = [row["jitterMs"] for row in rows if row["packets"]]
+    summary = {
+        "sessions": len(rows),
+        "failedSessions": sum(1 for row in rows if row["error"] or row["failedRequests"]),
+        "goodputBps": sum(row["goodputBps"] for row in rows),
+        "packets": sum(row["packets"] for row in rows),
+        "packetsLost": sum(row["packetsLost"] for row in rows),
+        "frames": frames,
+        "frameLoss": dropped / (frames + dropped) if frames + dropped else 0.0,
+        "jitterMeanMs": sum(jitters) / len(jitters) if jitters else 0.0,
+        "jitterMaxMs": max(jitters) if jitters else 0.0,
+        "latencyMs": {},
+    }
+    for method, values in sorted(latencies.items()) + [("all", allLatencies)]:
+        summary["latencyMs"][method] = {"p%d" % p: percentile(values, p) for p in PERCENTILES}
+        summary["latencyMs"][method]["max"] = max(values) if values else None
+    return summary
+
+
+async def runLoad(args):
+    script = parseScript(args.script)
+
+    async def start(index):
+        await asyncio.sleep(args.ramp * index / args.sessions)
+        session = LoadSession(index, args.host, args.port, args.file, script)
+        await session.run()
+        return session.result()
+
+    return await asyncio.gather(*(start(index) for index in range(args.sessions)))
+
+
+def formatMs(value):
+    return "{:8.2f}".format(value) if value is not None else "       -"
+
+
+def printSummary(summary):
+    print("{sessions} sessions, {failedSessions} with errors".format(**summary))
+    print("goodput {:.2f} Mbit/s   packets {:,} lost {:,}   frames {:,} frame loss {:.2%}".format(
+        summary["goodputBps"] / 1e6, summary["packets"], summary["packetsLost"], summary["frames"],
+        summary["frameLoss"]))
+    print("jitter mean {:.2f} ms max {:.2f} ms".format(summary["jitterMeanMs"], summary["jitterMaxMs"]))
+    print("{:<14} {:>8} {:>8} {:>8} {:>8}  (ms)".format("RTSP latency", "p50", "p90", "p99", "max"))
+    for method, values in summary["latencyMs"].items():
+        print("{:<14} {} {} {} {}".format(method, formatMs(values["p50"]), formatMs(values["p90"]),
+                                          formatMs(values["p99"]), formatMs(values["max"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run concurrent headless sessions against an RTSP server.")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("file", help="file name to request, as the server resolves it")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which sessions start")
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="steps such as %r" % DEFAULT_SCRIPT)
+    parser.add_argument("--json", help="write the summary and per-session rows to this file")
+    parser.add_argument("--csv", help="write the per-session rows to this file")
+    args = parser.parse_args()
+    try:
+        parseScript(args.script)
+    except ValueError as e:
+        parser.error(str(e))
+
+    started = time.time()
+    rows = asyncio.run(runLoad(args))
+    summary = summarize(rows)
+    printSummary(summary)
+    if args.json:
+        config = dict(vars(args), started=started, seconds=time.time() - started)
+        with open(args.json, "w") as f:
+            json.dump({"config": config, "summary": summary, "sessions": rows}, f, indent=2)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, SESSION_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark: time spent in VideoStream.nextFrame with and without read-ahead.
+
+Frames are pulled at the movie's frame rate, as the sending thread does, and
+the file is evicted from the page cache before each run where the platform
+allows it, so reads start cold.
+
+Usage: python benchmarks/bench_readahead.py movie.Mjpeg [frames] [fps]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MediaStore import MediaStore  # noqa: E402
+from VideoStream import VideoStream  # noqa: E402
+
+
+def evict(filename):
+    """Drop the file's pages from the page cache, if the platform supports it."""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    with open(filename, "rb") as file:
+        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return True
+
+
+def run(label, filename, store, readAhead, frames, fps):
+    VideoStream.readAheadFrames = readAhead
+    cold = evict(filename)
+    stream = VideoStream(filename, store)
+    timings = []
+    deadline = time.perf_counter()
+    for _ in range(frames):
+        deadline += 1.0 / fps
+        start = time.perf_counter()
+        data = stream.nextFrame()
+        if not data:
+            stream.seek(0)
+            data = stream.nextFrame()
+        timings.append(time.perf_counter() - start)
+        time.sleep(max(0.0, deadline - time.perf_counter()))
+    stream.close()
+    timings.sort()
+    print("{:<28} {:<5} p50 {:>8.1f} us   p99 {:>8.1f} us   max {:>8.1f} us".format(
+        label, "cold" if cold else "warm", timings[len(timings) // 2] * 1e6,
+        timings[int(len(timings) * 0.99)] * 1e6, timings[-1] * 1e6))
+
+
+def main():
+    filename = sys.argv[1]
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    fps = float(sys.argv[3]) if len(sys.argv) > 3 else 100
+    print("{} frames at {} fps".format(frames, fps))
+    for readAhead in (0, VideoStream.readAheadFrames):
+        suffix = "read-ahead {}".format(readAhead) if readAhead else "on demand"
+        run("file, " + suffix, filename, None, readAhead, frames, fps)
+        run("mmap, " + suffix, filename, MediaStore(), readAhead, frames, fps)
+
+
+if __name__ == "__main__":
+    main()
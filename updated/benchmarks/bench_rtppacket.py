@@ -0,0 +1,100 @@
+"""Microbenchmark: RtpPacket struct fast path against the original byte-by-byte codec.
+
+Usage: python benchmarks/bench_rtppacket.py [payload_bytes] [iterations]
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RtpPacket import HEADER_SIZE, RtpPacket  # noqa: E402
+
+
+class LegacyRtpPacket:
+    """The original pure-Python encoder/decoder, kept as the baseline."""
+
+    def __init__(self):
+        self.header = bytearray(HEADER_SIZE)
+        self.payload = b""
+
+    def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, timestamp):
+        header = bytearray(HEADER_SIZE)
+        header[0] = (version << 6) | (padding << 5) | (extension << 4) | cc
+        header[1] = (marker << 7) | (pt & 0x7F)
+        header[2] = (seqnum >> 8) & 0xFF
+        header[3] = seqnum & 0xFF
+        header[4] = (timestamp >> 24) & 0xFF
+        header[5] = (timestamp >> 16) & 0xFF
+        header[6] = (timestamp >> 8) & 0xFF
+        header[7] = timestamp & 0xFF
+        header[8] = (ssrc >> 24) & 0xFF
+        header[9] = (ssrc >> 16) & 0xFF
+        header[10] = (ssrc >> 8) & 0xFF
+        header[11] = ssrc & 0xFF
+        self.header = header
+        self.payload = payload
+
+    def decode(self, byteStream):
+        self.header = bytearray(byteStream[:HEADER_SIZE])
+        self.payload = byteStream[HEADER_SIZE:]
+
+    def seqNum(self):
+        return int(self.header[2] << 8 | self.header[3])
+
+    def timestamp(self):
+        return int(self.header[4] << 24 | self.header[5] << 16 | self.header[6] << 8 | self.header[7])
+
+    def getPacket(self):
+        return self.header + self.payload
+
+
+def bench(label, func, iterations):
+    seconds = min(timeit.repeat(func, number=iterations, repeat=5))
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{:<34} {:>12,.0f} ops/s   peak alloc/op {:>8,} B".format(label, iterations / seconds, peak))
+    return iterations / seconds
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1400
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    payload = os.urandom(size)
+    args = (2, 0, 0, 0, 4242, 1, 26, 0xDEADBEEF, payload)
+
+    legacy = LegacyRtpPacket()
+    fast = RtpPacket()
+    legacy.encode(*args, 123456)
+    wire = bytes(legacy.getPacket())
+
+    def legacyEncode():
+        legacy.encode(*args, 123456)
+        legacy.getPacket()
+
+    def fastEncode():
+        fast.encode(*args, timestamp=123456)
+        fast.getBuffers()
+
+    def legacyDecode():
+        legacy.decode(wire)
+        legacy.seqNum(), legacy.timestamp()
+
+    def fastDecode():
+        fast.decodeFrom(wire)
+        fast.seqNum(), fast.timestamp()
+
+    print("payload {} bytes, {} iterations".format(size, iterations))
+    before = bench("legacy encode + getPacket", legacyEncode, iterations)
+    after = bench("struct encode + getBuffers", fastEncode, iterations)
+    print("  encode speedup x{:.2f}".format(after / before))
+    before = bench("legacy decode + accessors", legacyDecode, iterations)
+    after = bench("decodeFrom + accessors", fastDecode, iterations)
+    print("  decode speedup x{:.2f}".format(after / before))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Microbenchmark for the incremental RTSP parser against the original split-based framing.
+
+Usage: python benchmarks/bench_rtsp.py [iterations]
+
+The parser's split and fuzz checks live in tests/test_rtsp.py.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Rtsp import RtspParser  # noqa: E402
+
+
+def legacyParse(data):
+    """The original framing: one recv() is one request, fields found by line index."""
+    request = data.decode().split("\n")
+    line1 = request[0].split(" ")
+    return line1[0], line1[1], request[1].split(" ")[1]
+
+
+def bench(iterations):
+    request = b"PLAY movie.Mjpeg RTSP/1.0\r\nCSeq: 2\r\nSession: 123456\r\n\r\n"
+    parser = RtspParser()
+    pipelined = request * 10
+
+    def legacy():
+        legacyParse(request)
+
+    def single():
+        parser.feed(request)
+
+    def batch():
+        parser.feed(pipelined)
+
+    for label, func, count in (("legacy split", legacy, 1), ("parser, one per read", single, 1),
+                               ("parser, 10 pipelined", batch, 10)):
+        seconds = min(timeit.repeat(func, number=iterations, repeat=5))
+        print("{:<22} {:>10,.0f} requests/s".format(label, iterations * count / seconds))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bench(iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Benchmark suite for the streaming hot paths, with saved baselines.
+
+Covers RtpPacket encode/decode, ServerWorker.makeRtp, RTSP parsing plus
+processRtspRequest, and VideoStream.nextFrame on synthetic MJPEG movies of
+several frame sizes in both file formats. Each benchmark reports throughput,
+the payload bytes copied per operation (bytes returned in buffers that are
+not views of the source), the allocations still held by its result, and the
+peak memory allocated during one operation.
+
+Frames are read on demand with the frame cache off, so nextFrame measures
+the read itself rather than the reader pool.
+
+Usage: python benchmarks/bench_suite.py [--quick] [--filter TEXT]
+                                        [--save baseline.json] [--compare baseline.json]
+
+--compare prints each benchmark's throughput change against a saved run and
+exits with status 1 if any fell by more than --threshold.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Container import ContainerWriter  # noqa: E402
+from MediaStore import MediaStore  # noqa: E402
+from RtpJpeg import makeHeaders  # noqa: E402
+from RtpPacket import RtpPacket  # noqa: E402
+from Rtsp import RtspParser, formatRequest  # noqa: E402
+from ServerWorker import ServerWorker  # noqa: E402
+from VideoStream import VideoStream  # noqa: E402
+
+FRAME_SIZES = (8 << 10, 32 << 10, 96 << 10)  # the legacy format caps frames at 99999 bytes
+FRAMES = 200
+WIDTH, HEIGHT = 640, 480
+RTP_PAYLOAD = 1400
+REPEAT = 5
+THRESHOLD = 0.10
+
+
+def syntheticFrame(size, seed):
+    """Return a baseline JPEG of about size bytes whose scan is random data."""
+    headers = makeHeaders(1, WIDTH, HEIGHT, bytes(range(1, 129)), 0)
+    scan = os.urandom(max(0, size - len(headers) - 2)).replace(b"\xff", bytes([seed & 0x7F]))
+    return bytes(headers) + scan + b"\xff\xd9"
+
+
+def writeMovies(directory, size):
+    """Write the same synthetic frames as a legacy .Mjpeg and a .mjpb movie."""
+    frames = [syntheticFrame(size, n) for n in range(FRAMES)]
+    legacy = os.path.join(directory, "synthetic%d.Mjpeg" % size)
+    with open(legacy, "wb") as file:
+        for frame in frames:
+            file.write(b"%05d" % len(frame) + frame)
+    container = os.path.join(directory, "synthetic%d.mjpb" % size)
+    with open(container, "wb") as file:
+        writer = ContainerWriter(file, 25, WIDTH, HEIGHT)
+        for frame in frames:
+            writer.writeFrame(frame)
+        writer.close()
+    return frames, legacy, container
+
+
+def copiedBytes(buffers):
+    """Return the bytes held in buffers that are copies rather than views."""
+    return sum(len(buffer) for buffer in buffers if not isinstance(buffer, memoryview))
+
+
+class NullSocket:
+    """RTSP connection stand-in that discards replies."""
+
+    def send(self, data):
+        return len(data)
+
+
+class Benchmark:
+    """One operation to time; op() runs it once and returns the buffers it produced."""
+
+    def __init__(self, name, unit, op, unitsPerOp=1, setup=None, teardown=None):
+        self.name = name
+        self.unit = unit
+        self.op = op
+        self.unitsPerOp = unitsPerOp  # e.g. packets per makeRtp call
+        self.setup = setup
+        self.teardown = teardown
+
+    def run(self, number):
+        if self.setup:
+            self.setup()
+        try:
+            self.op()  # warm up
+            seconds = min(timeit.repeat(self.op, number=number, repeat=REPEAT)) / number
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            buffers = self.op()
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        finally:
+            if self.teardown:
+                self.teardown()
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        allocations = sum(stat.count_diff for stat in after.filter_traces(ignore).compare_to(
+            before.filter_traces(ignore), "filename"))
+        buffers = buffers or []
+        return {
+            "opsPerSecond": 1 / seconds,
+            "unitsPerSecond": self.unitsPerOp / seconds,
+            "unit": self.unit,
+            "mbPerSecond": sum(len(buffer) for buffer in buffers) / seconds / 1e6,
+            "copiedBytes": copiedBytes(buffers),
+            "allocations": max(0, allocations),
+            "peakBytes": peak,
+        }
+
+
+def packetBenchmarks():
+    payload = os.urandom(RTP_PAYLOAD)
+    packet = RtpPacket()
+    packet.encode(2, 0, 0, 0, 4242, 1, 26, 0xDEADBEEF, payload, timestamp=123456)
+    wire = packet.getPacket()
+    decoded = RtpPacket()
+
+    def encode():
+        packet.encode(2, 0, 0, 0, 4242, 1, 26, 0xDEADBEEF, payload, timestamp=123456)
+        return packet.getBuffers()
+
+    def decode():
+        decoded.decodeFrom(wire)
+        decoded.seqNum(), decoded.timestamp()
+        return [decoded.payload]
+
+    return [Benchmark("RtpPacket.encode %dB" % RTP_PAYLOAD, "packets", encode),
+            Benchmark("RtpPacket.decodeFrom %dB" % RTP_PAYLOAD, "packets", decode)]
+
+
+def makeRtpBenchmark(frames, size):
+    worker = ServerWorker({"ssrc": 0xDEADBEEF})
+    frame = frames[0]
+    packets = len(worker.makeRtp(frame, 1, 0))
+
+    def op():
+        return [buffer for packet in worker.makeRtp(frame, 1, 0) for buffer in packet.getBuffers()]
+
+    return Benchmark("ServerWorker.makeRtp %dKB" % (size >> 10), "packets", op, unitsPerOp=packets)
+
+
+def nextFrameBenchmarks(filename, label, size):
+    benchmarks = []
+    for path, store in (("file", None), ("mmap", MediaStore())):
+        state = {}
+
+        def setup(store=store, state=state):
+            VideoStream.readAheadFrames = 0
+            state["stream"] = VideoStream(filename, store)
+
+        def teardown(state=state):
+            state.pop("stream").close()
+
+        def op(state=state):
+            stream = state["stream"]
+            data = stream.nextFrame()
+            if not data:
+                stream.seek(0)
+                data = stream.nextFrame()
+            return [data]
+
+        benchmarks.append(Benchmark("VideoStream.nextFrame %s %s %dKB" % (label, path, size >> 10), "frames",
+                                    op, setup=setup, teardown=teardown))
+    return benchmarks
+
+
+def rtspBenchmarks(filename):
+    worker = ServerWorker({"rtspSocket": (NullSocket(), ("127.0.0.1", 0))})
+    parser = RtspParser()
+    state = {}
+
+    def setup():
+        state["stream"] = worker.clientInfo["videoStream"] = VideoStream(filename)
+
+    def teardown():
+        worker.clientInfo.pop("videoStream", None)
+        state.pop("stream").close()
+
+    benchmarks = []
+    for method in ("OPTIONS", "GET_PARAMETER", "DESCRIBE"):
+        request = formatRequest(method, filename, 1, [("Session", 0)]).encode()
+
+        def op(request=request):
+            with redirect_stdout(io.StringIO()):
+                for message in parser.feed(request):
+                    worker.processRtspRequest(message)
+
+        benchmarks.append(Benchmark("processRtspRequest %s" % method, "requests", op,
+                                    setup=setup, teardown=teardown))
+    return benchmarks
+
+
+def formatResult(name, result, baseline):
+    line = "{:<44} {:>12,.0f} {:<9} {:>9,} {:>6,} {:>10,}".format(
+        name, result["unitsPerSecond"], result["unit"] + "/s", result["copiedBytes"], result["allocations"],
+        result["peakBytes"])
+    if baseline is not None:
+        line += "  {:+7.1%}".format(result["unitsPerSecond"] / baseline["unitsPerSecond"] - 1)
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the packetization, parsing and frame reading paths.")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for a smoke run")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--save", help="write the results to this JSON file as a baseline")
+    parser.add_argument("--compare", help="compare against a baseline written by --save")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="throughput drop that counts as a regression (default %(default)s)")
+    args = parser.parse_args()
+    number = 200 if args.quick else 2000
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = packetBenchmarks()
+        for size in FRAME_SIZES:
+            frames, legacy, container = writeMovies(directory, size)
+            benchmarks.append(makeRtpBenchmark(frames, size))
+            benchmarks += nextFrameBenchmarks(legacy, "Mjpeg", size)
+            benchmarks += nextFrameBenchmarks(container, "mjpb", size)
+        benchmarks += rtspBenchmarks(container)
+
+        print("{:<44} {:>22} {:>9} {:>6} {:>10}".format("benchmark", "throughput", "copied B", "allocs",
+                                                         "peak B") + ("  vs base" if baseline else ""))
+        for benchmark in benchmarks:
+            if args.filter not in benchmark.name:
+                continue
+            result = results[benchmark.name] = benchmark.run(number)
+            base = baseline.get(benchmark.name)
+            print(formatResult(benchmark.name, result, base))
+            if base is not None and result["unitsPerSecond"] < base["unitsPerSecond"] * (1 - args.threshold):
+                regressions.append(benchmark.name)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "number": number, "results": results}, f, indent=2)
+    if regressions:
+        print("{} benchmark(s) slower than the baseline by more than {:.0%}: {}".format(
+            len(regressions), args.threshold, ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
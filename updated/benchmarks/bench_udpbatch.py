@@ -0,0 +1,83 @@
+"""Microbenchmark: per-packet sendmsg against batched sendmmsg and UDP GSO over loopback.
+
+Usage: python benchmarks/bench_udpbatch.py [packets_per_frame] [frames]
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from UdpBatch import RecvRing, UdpBatchSender  # noqa: E402
+
+PACKET_SIZE = 1400
+
+
+def drain(sock, stop, counts):
+    ring = RecvRing(sock, 256, 2048)
+    while not stop.is_set():
+        try:
+            counts[0] += len(ring.recv())
+        except socket.timeout:
+            pass
+    counts[1] = ring.syscalls
+
+
+def bench(label, send, frames):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(0.1)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    stop = threading.Event()
+    counts = [0, 0]
+    thread = threading.Thread(target=drain, args=(receiver, stop, counts))
+    thread.start()
+    address = receiver.getsockname()
+    start = time.perf_counter()
+    syscalls = send(sender, address, frames)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.2)
+    stop.set()
+    thread.join()
+    sender.close()
+    receiver.close()
+    print("{:<22} {:>10,.0f} packets/s  send syscalls {:>7,}  received {:>7,} in {:>6,} recv calls".format(
+        label, sent[0] / elapsed, syscalls, counts[0], counts[1]))
+
+
+sent = [0]
+
+
+def main():
+    perFrame = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    header = bytes(12)
+    payload = memoryview(os.urandom(PACKET_SIZE * perFrame))
+    messages = [[header, payload[i * PACKET_SIZE:(i + 1) * PACKET_SIZE]] for i in range(perFrame)]
+    sent[0] = perFrame * frames
+
+    def loop(sock, address, frames):
+        for _ in range(frames):
+            for buffers in messages:
+                sock.sendmsg(buffers, [], 0, address)
+        return perFrame * frames
+
+    def batched(gso):
+        def send(sock, address, frames):
+            batch = UdpBatchSender(sock, gso)
+            for _ in range(frames):
+                batch.send(messages, address)
+            return batch.syscalls
+        return send
+
+    print("{} packets of {} bytes per frame, {} frames".format(perFrame, PACKET_SIZE, frames))
+    bench("sendmsg per packet", loop, frames)
+    bench("sendmmsg batch", batched(False), frames)
+    bench("UDP GSO", batched(True), frames)
+
+
+if __name__ == "__main__":
+    main()
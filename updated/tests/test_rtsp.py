@@ -0,0 +1,115 @@
+"""Tests for the incremental RTSP parser, in the strict and the lenient mode the server uses.
+
+Usage: python -m unittest discover -s tests   (or python -m pytest tests)
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Rtsp import RtspError, RtspParser  # noqa: E402
+
+METHODS = ["SETUP", "PLAY", "PAUSE", "TEARDOWN", "DESCRIBE", "OPTIONS", "GET_PARAMETER"]
+ROUNDS = 1000
+
+
+def randomMessage(rng, cseq):
+    """Return (wire bytes, expected (method, uri, cseq, body))."""
+    eol = rng.choice([b"\r\n", b"\n"])
+    method = rng.choice(METHODS)
+    uri = "movie%d.Mjpeg" % rng.randrange(100)
+    body = bytes(rng.randrange(256) for _ in range(rng.choice([0, 0, 1, 17, 300])))
+    name = rng.choice(["CSeq", "cseq", "CSEQ"])
+    lines = ["%s %s RTSP/1.0" % (method, uri), "%s: %d" % (name, cseq), "Session: %d" % rng.randrange(10 ** 6)]
+    if rng.random() < 0.5:
+        lines.append("Transport: RTP/AVP;unicast;client_port=%d-%d" % (5000, 5001))
+    if body:
+        lines.append(rng.choice(["Content-Length", "content-length"]) + ": %d" % len(body))
+    wire = eol.join(line.encode() for line in lines) + eol + eol + body
+    return wire, (method, uri, cseq, body)
+
+
+def parsed(messages):
+    return [(message.method, message.uri, message.cseq(), message.body) for message in messages]
+
+
+def feedSplit(parser, stream, cuts):
+    got = []
+    for start, end in zip([0] + cuts, cuts + [len(stream)]):
+        got += parsed(parser.feed(stream[start:end]))
+    return got
+
+
+class RtspParserTest(unittest.TestCase):
+    def testRandomSplits(self):
+        """Pipelined requests split at random points parse the same as when fed whole."""
+        for lenient in (False, True):
+            rng = random.Random(1)
+            for _ in range(ROUNDS):
+                pieces = [randomMessage(rng, cseq) for cseq in range(rng.randrange(1, 6))]
+                stream = b"".join(wire for wire, _ in pieces)
+                expected = [message for _, message in pieces]
+                cuts = sorted(rng.sample(range(len(stream) + 1), min(len(stream), rng.randrange(0, 8))))
+                got = feedSplit(RtspParser(lenient=lenient), stream, cuts)
+                self.assertEqual(got, expected, (lenient, stream, cuts))
+
+    def testSplitsAtEveryLineBreak(self):
+        stream = (b"SETUP m RTSP/1.0\nCSeq: 1\nTransport: RTP/AVP;client_port=5000\n\n"
+                  b"PLAY m RTSP/1.0\r\nCSeq: 2\r\nSession: 7\r\n\r\n")
+        cuts = [i + 1 for i, byte in enumerate(stream[:-1]) if byte == ord("\n")]
+        expected = [("SETUP", "m", 1, b""), ("PLAY", "m", 2, b"")]
+        for lenient in (False, True):
+            self.assertEqual(feedSplit(RtspParser(lenient=lenient), stream, cuts), expected)
+
+    def testLenientKeepsHeadersSplitFromTheirRequest(self):
+        parser = RtspParser(lenient=True)
+        self.assertEqual(parser.feed(b"SETUP m RTSP/1.0\nCSeq: 1\n"), [])
+        [message] = parser.feed(b"Transport: RTP/AVP;client_port=5000\n\n")
+        self.assertEqual(message.method, "SETUP")
+        self.assertEqual(message.header("Transport"), "RTP/AVP;client_port=5000")
+
+    def testLenientEndsBlockAtNextRequestLine(self):
+        parser = RtspParser(lenient=True)
+        messages = parser.feed(b"PLAY m RTSP/1.0\nCSeq: 3\nPAUSE m RTSP/1.0\nCSeq: 4\n")
+        self.assertEqual(parsed(messages), [("PLAY", "m", 3, b"")])
+        self.assertEqual(parsed(parser.flush()), [("PAUSE", "m", 4, b"")])
+
+    def testFlushEndsStalledBlock(self):
+        parser = RtspParser(lenient=True)
+        parser.feed(b"TEARDOWN m RTSP/1.0\r\nCSeq: 5\r\nSession: 7\r\n")
+        self.assertTrue(parser.stalled())
+        self.assertEqual(parsed(parser.flush()), [("TEARDOWN", "m", 5, b"")])
+        self.assertFalse(parser.stalled())
+        self.assertEqual(parser.flush(), [])
+
+    def testFlushWaitsForWholeLines(self):
+        parser = RtspParser(lenient=True)
+        parser.feed(b"PLAY m RTSP/1.0\nCSeq: 6\nSess")
+        self.assertFalse(parser.stalled())
+        self.assertEqual(parser.flush(), [])
+
+    def testStrictNeverStalls(self):
+        parser = RtspParser()
+        parser.feed(b"PLAY m RTSP/1.0\nCSeq: 6\n")
+        self.assertFalse(parser.stalled())
+        self.assertEqual(parser.flush(), [])
+
+    def testMutatedBytesFailOnlyWithRtspError(self):
+        rng = random.Random(2)
+        for _ in range(ROUNDS):
+            stream = b"".join(randomMessage(rng, cseq)[0] for cseq in range(rng.randrange(1, 4)))
+            mutated = bytearray(stream)
+            for _ in range(rng.randrange(1, 10)):
+                mutated[rng.randrange(len(mutated))] = rng.randrange(256)
+            parser = RtspParser(lenient=rng.random() < 0.5)
+            try:
+                parser.feed(bytes(mutated))
+                parser.flush()
+            except RtspError:
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()